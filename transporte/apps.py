@@ -5,3 +5,6 @@ class TransporteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transporte'
     verbose_name = 'Sistema de Transporte Público'
+    
+    def ready(self):
+        from . import esquema, instrumentacion, signals  # noqa: F401
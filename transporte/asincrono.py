@@ -0,0 +1,174 @@
+"""
+Lectura asíncrona (`list` y `retrieve`) de los recursos públicos bajo ASGI.
+
+Con `LECTURAS_ASINCRONAS` (activado por `transporte_config/asgi.py`) las
+rutas de listado y detalle de los viewsets con `LecturaAsincronaMixin`
+resuelven los GET con una vista asíncrona; el resto de los métodos sigue en
+la vista de DRF, en un hilo como cualquier vista síncrona bajo ASGI. Con WSGI
+no cambia nada: una vista asíncrona ahí costaría un event loop por solicitud.
+
+La vista asíncrona recorre el mismo ciclo que `APIView.dispatch`
+(negociación, autenticación, permisos, throttling, manejo de excepciones) y
+usa los mismos `get_queryset`, `filter_queryset`, serializers y paginadores
+del viewset, así que permisos, filtros, fieldsets, expansiones, paginación,
+GET condicional y cache de respuestas se comportan igual. Lo que consulta la
+base se hace con el ORM asíncrono (agregados de los validadores, `COUNT` y
+filas de la página, el objeto del detalle) y lo demás corre en el event loop.
+Solo pasan a un hilo la autenticación cuando la request trae credenciales
+(JWT y sesión consultan la base) y los filtros de django-filter que validan
+un id contra la base (`?ruta=`).
+"""
+from functools import lru_cache, update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.http import Http404
+from django_filters import ModelChoiceFilter, ModelMultipleChoiceFilter
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from .pagination import KeysetCursorPagination
+
+ACCIONES_ASINCRONAS = ('list', 'retrieve')
+METODOS_LECTURA = ('GET', 'HEAD')
+
+
+@lru_cache(maxsize=None)
+def filtros_con_consultas(viewset_class):
+    """Parámetros de django-filter del viewset que validan su valor con una consulta (`?ruta=3`)"""
+    nombres = set()
+    for backend in viewset_class.filter_backends:
+        if not issubclass(backend, DjangoFilterBackend):
+            continue
+        filterset_class = backend().get_filterset_class(viewset_class, viewset_class.queryset)
+        if filterset_class is None:
+            continue
+        nombres.update(
+            nombre for nombre, filtro in filterset_class.base_filters.items()
+            if isinstance(filtro, (ModelChoiceFilter, ModelMultipleChoiceFilter))
+        )
+    return frozenset(nombres)
+
+
+async def paginar_por_numero(paginador, queryset, request):
+    """`PageNumberPagination.paginate_queryset` con el ORM asíncrono"""
+    paginador.request = request
+    page_size = paginador.get_page_size(request)
+    if not page_size:
+        return None
+
+    paginator = paginador.django_paginator_class(queryset, page_size)
+    # `count` es una cached_property: precargada, `page()` ya no consulta
+    paginator.count = await queryset.acount()
+    page_number = paginador.get_page_number(request, paginator)
+    try:
+        paginador.page = paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginador.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    paginador.page.object_list = [fila async for fila in paginador.page.object_list]
+
+    if paginator.num_pages > 1 and paginador.template is not None:
+        paginador.display_page_controls = True
+    return list(paginador.page)
+
+
+class LecturaAsincronaMixin:
+    """
+    `list` y `retrieve` asíncronos para ASGI. Va después de los mixins que
+    extienden `list`/`retrieve` (GET condicional, cache), que también definen
+    sus versiones `alist`/`aretrieve`.
+    """
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        vista = super().as_view(actions, **initkwargs)
+        if not settings.LECTURAS_ASINCRONAS or actions.get('get') not in ACCIONES_ASINCRONAS:
+            return vista
+        vista_sincrona = sync_to_async(vista)
+        acciones = {'head': actions['get'], **actions}
+
+        async def vista_asincrona(request, *args, **kwargs):
+            if request.method not in METODOS_LECTURA:
+                return await vista_sincrona(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = acciones
+            return await self.adispatch(request, *args, **kwargs)
+
+        # Conserva `cls`, `initkwargs`, `actions` y `csrf_exempt` de la vista de DRF
+        return update_wrapper(vista_asincrona, vista)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """`dispatch` de DRF con el handler asíncrono de la acción"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    def tiene_credenciales(self, request):
+        return 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+    async def ainitial(self, request, *args, **kwargs):
+        if self.tiene_credenciales(request):
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+        else:
+            self.initial(request, *args, **kwargs)
+
+    async def aconsulta(self):
+        """`filter_queryset(get_queryset())`, calculado una vez por request"""
+        if not hasattr(self, '_consulta'):
+            if not filtros_con_consultas(type(self)).isdisjoint(self.request.query_params):
+                self._consulta = await sync_to_async(self.filter_queryset)(self.get_queryset())
+            else:
+                self._consulta = self.filter_queryset(self.get_queryset())
+        return self._consulta
+
+    async def apaginar(self, queryset):
+        paginador = self.paginator
+        if paginador is None:
+            return None
+        if isinstance(paginador, KeysetCursorPagination):
+            return await paginador.apaginate_queryset(queryset, self.request, view=self)
+        if isinstance(paginador, PageNumberPagination):
+            return await paginar_por_numero(paginador, queryset, self.request)
+        return await sync_to_async(self.paginate_queryset)(queryset)
+
+    async def aobtener(self):
+        """`get_object` con el ORM asíncrono"""
+        queryset = await self.aconsulta()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise Http404('No %s matches the given query.' % queryset.model._meta.object_name)
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.aconsulta()
+        page = await self.apaginar(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer([fila async for fila in queryset], many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(await self.aobtener())
+        return Response(serializer.data)
@@ -0,0 +1,132 @@
+"""
+Autenticación JWT sin consultar la tabla de usuarios en cada solicitud.
+
+`JWTAuthentication` de simplejwt trae el `User` de la base en cada request
+autenticada. `JWTCacheAuthentication` resuelve el `user_id` del token en la
+cache `JWT_USUARIOS_CACHE` (por defecto la de memoria local del proceso; con
+una compartida la ven todos los workers) durante `JWT_USUARIOS_TTL` segundos.
+La entrada guarda solo los campos que usan los permisos (`username`,
+`is_active`, `is_staff`, `is_superuser`; con `CHECK_REVOKE_TOKEN`, también
+el md5 del hash de la contraseña) y el usuario se arma con `User.from_db`:
+el resto de los campos quedan diferidos y se cargan de la base solo si algo
+los lee. Guardar o borrar un usuario borra
+su entrada (`signals.py`); los cambios hechos con `update()` o desde otro
+proceso con cache local se ven cuando vence el TTL.
+
+Con `JWT_SIN_ESTADO` los tokens que emiten `/api/token/` y
+`/api/token/refresh/` llevan esos campos como claims y la autenticación no
+consulta ni la base ni la cache. Un token sin esos claims (emitido antes de
+activarlo) se resuelve con la cache. La contrapartida es que un cambio de
+permisos o una baja recién se ven con el próximo access token (el refresh
+vuelve a leer el usuario).
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import serializers
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+CAMPOS_USUARIO = ('username', 'is_active', 'is_staff', 'is_superuser')
+PREFIJO_USUARIO = 'jwt_usuario:'
+
+
+def cache_usuarios():
+    return caches[settings.JWT_USUARIOS_CACHE]
+
+
+def campos_usuario(usuario):
+    campos = {campo: getattr(usuario, campo) for campo in CAMPOS_USUARIO}
+    if api_settings.CHECK_REVOKE_TOKEN:
+        campos[api_settings.REVOKE_TOKEN_CLAIM] = get_md5_hash_password(usuario.password)
+    return campos
+
+
+def olvidar_usuario(user_id):
+    cache_usuarios().delete(f'{PREFIJO_USUARIO}{user_id}')
+
+
+def campos_cacheados(user_id):
+    """Campos del usuario desde la cache, o de la base si no están (o vencieron)"""
+    cache = cache_usuarios()
+    clave = f'{PREFIJO_USUARIO}{user_id}'
+    campos = cache.get(clave)
+    if campos is None:
+        modelo = get_user_model()
+        try:
+            usuario = modelo.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except modelo.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        campos = campos_usuario(usuario)
+        cache.set(clave, campos, settings.JWT_USUARIOS_TTL)
+    return campos
+
+
+def construir_usuario(user_id, campos):
+    """`User` con los campos indicados; los demás quedan diferidos"""
+    modelo = get_user_model()
+    valores = {modelo._meta.get_field(api_settings.USER_ID_FIELD).attname: user_id}
+    valores.update((nombre, campos[nombre]) for nombre in CAMPOS_USUARIO)
+    # `from_db` espera los valores en el orden de los campos del modelo
+    nombres = [campo.attname for campo in modelo._meta.concrete_fields if campo.attname in valores]
+    return modelo.from_db(modelo.objects.db, nombres, [valores[nombre] for nombre in nombres])
+
+
+def agregar_claims(token, usuario):
+    for campo in CAMPOS_USUARIO:
+        token[campo] = getattr(usuario, campo)
+    return token
+
+
+class JWTCacheAuthentication(JWTAuthentication):
+    """`JWTAuthentication` que resuelve el usuario con los claims del token o la cache"""
+
+    def get_user(self, validated_token):
+        try:
+            # El claim es un string desde simplejwt 5.4
+            campo_id = get_user_model()._meta.get_field(api_settings.USER_ID_FIELD)
+            user_id = campo_id.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        if settings.JWT_SIN_ESTADO and not api_settings.CHECK_REVOKE_TOKEN \
+                and all(campo in validated_token for campo in CAMPOS_USUARIO):
+            campos = {campo: validated_token[campo] for campo in CAMPOS_USUARIO}
+        else:
+            campos = campos_cacheados(user_id)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not campos['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) \
+                != campos[api_settings.REVOKE_TOKEN_CLAIM]:
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return construir_usuario(user_id, campos)
+
+
+class TokenObtainPairSerializer(serializers.TokenObtainPairSerializer):
+    """Con `JWT_SIN_ESTADO`, el par de tokens lleva los campos del usuario como claims"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        if settings.JWT_SIN_ESTADO:
+            agregar_claims(token, user)
+        return token
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    """Con `JWT_SIN_ESTADO`, el access token nuevo lleva los claims actuales del usuario"""
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        if settings.JWT_SIN_ESTADO:
+            refresh = self.token_class(attrs['refresh'])
+            usuario = get_user_model().objects.get(
+                **{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}
+            )
+            data['access'] = str(agregar_claims(refresh.access_token, usuario))
+        return data
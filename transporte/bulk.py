@@ -0,0 +1,219 @@
+"""
+Ingesta masiva de boletos desde los validadores.
+
+En lugar de pasar cada toque por el serializer, el lote se valida en una sola
+pasada: los viajes, paradas y tarjetas referenciados se resuelven con una
+consulta por modelo, los débitos se acumulan por tarjeta y se aplican con
+pocos UPDATE agrupados por importe, y los boletos se insertan con
+`bulk_create`. Cada fila se acepta o rechaza por separado; el resultado se
+informa por índice.
+"""
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Viaje, Tarjeta, Boleto, Parada
+from .condicional import tocar_padres
+from .estadisticas import acumular_boletos
+
+MAX_FILAS = 20000
+BATCH_SIZE = 1000
+TARJETAS_POR_UPDATE = 500
+
+CAMPO_REQUERIDO = 'Este campo es requerido.'
+ID_INVALIDO = 'Tipo incorrecto. Se esperaba valor de clave primaria.'
+OBJETO_INEXISTENTE = 'Clave primaria "{pk}" inválida - objeto no existe.'
+MONTO_INVALIDO = 'Se requiere un número decimal válido con hasta 2 decimales.'
+SALDO_INSUFICIENTE = 'Saldo insuficiente en la tarjeta.'
+
+MONTO_MAXIMO = Decimal('1E8')
+
+
+def _id(fila, campo, requerido, errores):
+    valor = fila.get(campo)
+    if valor is None or valor == '':
+        if requerido:
+            errores[campo] = [CAMPO_REQUERIDO]
+        return None
+    if isinstance(valor, bool):
+        errores[campo] = [ID_INVALIDO]
+        return None
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        errores[campo] = [ID_INVALIDO]
+        return None
+
+
+def parsear_monto(valor):
+    """Decimal no negativo con hasta 2 decimales que entra en la columna, o `None`"""
+    try:
+        monto = Decimal(str(valor).strip())
+    except InvalidOperation:
+        return None
+    if (not monto.is_finite() or monto < 0 or monto >= MONTO_MAXIMO
+            or monto.as_tuple().exponent < -2):
+        return None
+    return monto
+
+
+def _monto(fila, errores):
+    valor = fila.get('monto')
+    if valor is None or valor == '':
+        errores['monto'] = [CAMPO_REQUERIDO]
+        return None
+    monto = parsear_monto(valor)
+    if monto is None:
+        errores['monto'] = [MONTO_INVALIDO]
+    return monto
+
+
+def validar_fila(fila):
+    """Valida tipos de una fila; devuelve `(datos, errores)`"""
+    if not isinstance(fila, dict):
+        return None, {'non_field_errors': ['Se esperaba un objeto.']}
+    errores = {}
+    datos = {
+        'viaje': _id(fila, 'viaje', True, errores),
+        'tarjeta': _id(fila, 'tarjeta', False, errores),
+        'parada_subida': _id(fila, 'parada_subida', False, errores),
+        'monto': _monto(fila, errores),
+    }
+    return datos, errores
+
+
+def _existentes(modelo, datos, campo):
+    ids = {fila[campo] for _, fila in datos if fila[campo] is not None}
+    if not ids:
+        return set()
+    return set(modelo.objects.filter(pk__in=ids).values_list('pk', flat=True))
+
+
+def sumar_saldos(importes):
+    """
+    Suma a cada tarjeta su importe (negativo para debitar). Las tarjetas se
+    agrupan por importe (las tarifas y recargas son pocas y se repiten), así
+    hay un UPDATE ... WHERE id IN (...) por importe distinto y bloque de tarjetas.
+    """
+    por_importe = defaultdict(list)
+    for pk, importe in importes.items():
+        por_importe[importe].append(pk)
+    ahora = timezone.now()
+    for importe, ids in por_importe.items():
+        for inicio in range(0, len(ids), TARJETAS_POR_UPDATE):
+            Tarjeta.objects.filter(pk__in=ids[inicio:inicio + TARJETAS_POR_UPDATE]).update(
+                saldo=F('saldo') + importe, fecha_actualizacion=ahora
+            )
+
+
+def debitar(debitos):
+    sumar_saldos({pk: -total for pk, total in debitos.items()})
+
+
+def ingresar_boletos(filas):
+    """
+    Crea los boletos válidos de `filas` y devuelve un resultado por fila:
+    `{'indice', 'id'}` si se creó o `{'indice', 'errores'}` si se rechazó.
+    Los cobros se evalúan en el orden del lote contra el saldo bloqueado de
+    cada tarjeta, igual que si los toques hubieran llegado uno por uno.
+    """
+    resultados = [None] * len(filas)
+    validas = []
+    for indice, fila in enumerate(filas):
+        datos, errores = validar_fila(fila)
+        if errores:
+            resultados[indice] = {'indice': indice, 'errores': errores}
+        else:
+            validas.append((indice, datos))
+
+    with transaction.atomic():
+        viajes = _existentes(Viaje, validas, 'viaje')
+        paradas = _existentes(Parada, validas, 'parada_subida')
+        ids_tarjetas = {datos['tarjeta'] for _, datos in validas if datos['tarjeta'] is not None}
+        saldos = dict(
+            Tarjeta.objects.select_for_update()
+            .filter(pk__in=ids_tarjetas)
+            .order_by('pk')
+            .values_list('pk', 'saldo')
+        ) if ids_tarjetas else {}
+
+        debitos = defaultdict(Decimal)
+        boletos, indices = [], []
+        for indice, datos in validas:
+            errores = {}
+            for campo, existentes in (('viaje', viajes), ('parada_subida', paradas), ('tarjeta', saldos)):
+                pk = datos[campo]
+                if pk is not None and pk not in existentes:
+                    errores[campo] = [OBJETO_INEXISTENTE.format(pk=pk)]
+            tarjeta = datos['tarjeta']
+            if not errores and tarjeta is not None:
+                if saldos[tarjeta] - debitos[tarjeta] < datos['monto']:
+                    errores['tarjeta'] = [SALDO_INSUFICIENTE]
+                else:
+                    debitos[tarjeta] += datos['monto']
+            if errores:
+                resultados[indice] = {'indice': indice, 'errores': errores}
+                continue
+            boletos.append(Boleto(
+                viaje_id=datos['viaje'],
+                tarjeta_id=tarjeta,
+                parada_subida_id=datos['parada_subida'],
+                monto=datos['monto'],
+            ))
+            indices.append(indice)
+
+        debitar(debitos)
+        Boleto.objects.bulk_create(boletos, batch_size=BATCH_SIZE)
+        # bulk_create no emite señales: los resúmenes y los totales de los viajes
+        # se actualizan acá (las tarjetas ya las actualizó el débito)
+        acumular_boletos(boletos)
+        tocar_padres(Boleto, {'viaje': {boleto.viaje_id for boleto in boletos}})
+
+    for indice, boleto in zip(indices, boletos):
+        resultados[indice] = {'indice': indice, 'id': boleto.pk}
+    return resultados
+
+
+def acreditar_recargas(recargas):
+    """
+    Aplica en una transacción un bloque de recargas `(linea, numero, monto)`
+    sumando los importes por tarjeta. Las líneas con monto inválido o tarjeta
+    inexistente o inactiva no se aplican y se devuelven como rechazos
+    `(linea, numero, monto, motivo)` sin abortar el bloque.
+    Devuelve `(aplicadas, importe_total, rechazos)`.
+    """
+    rechazos, validas = [], []
+    for linea, numero, valor in recargas:
+        monto = parsear_monto(valor)
+        if monto is None or monto == 0:
+            rechazos.append((linea, numero, valor, 'Monto inválido'))
+        else:
+            validas.append((linea, numero, valor, monto))
+
+    creditos = defaultdict(Decimal)
+    aplicadas, importe_total = 0, Decimal('0')
+    with transaction.atomic():
+        # Bloqueadas hasta el commit: una tarjeta no puede desactivarse entre
+        # la validación y el crédito, así que las aplicadas son exactas
+        tarjetas = {
+            numero: (pk, activa)
+            for numero, pk, activa in Tarjeta.objects.select_for_update().filter(
+                numero__in={numero for _, numero, _, _ in validas}
+            ).order_by('pk').values_list('numero', 'pk', 'activa')
+        }
+        for linea, numero, valor, monto in validas:
+            if numero not in tarjetas:
+                rechazos.append((linea, numero, valor, 'Tarjeta inexistente'))
+                continue
+            pk, activa = tarjetas[numero]
+            if not activa:
+                rechazos.append((linea, numero, valor, 'Tarjeta inactiva'))
+                continue
+            creditos[pk] += monto
+            aplicadas += 1
+            importe_total += monto
+        sumar_saldos(creditos)
+    return aplicadas, importe_total, rechazos
@@ -0,0 +1,174 @@
+"""
+Búsqueda de texto (`?search=`) con índices de PostgreSQL.
+
+`SearchFilter` traduce cada término a `ILIKE '%término%'` sobre cada campo,
+lo que obliga a recorrer la tabla. En PostgreSQL `BusquedaFilter` resuelve los
+campos locales de `search_fields` con índices GIN:
+
+- los `TextField` (descripciones) con búsqueda de texto completo: un
+  `tsvector` con la configuración `transporte_es` (raíces en castellano y sin
+  acentos), así "choques" encuentra "choque" y "camion" encuentra "camión";
+- los `CharField` (nombres, direcciones, códigos) con trigramas (`pg_trgm`)
+  sobre el texto concatenado en minúsculas y sin acentos, que admiten
+  `LIKE '%término%'` con índice.
+
+Los resultados se ordenan por relevancia salvo que se pida `?ordering=` o que
+la vista lo desactive (`ordenar_por_relevancia = False`, p. ej. con paginación
+por cursor). Un `CharField` de un modelo relacionado a uno
+(`vehiculo__patente`) se busca primero en ese modelo, con los mismos
+trigramas, y se filtra por los ids encontrados (`vehiculo_id IN (...)`): la
+condición usa el índice de la clave foránea en lugar de un `ILIKE` sobre el
+JOIN, así PostgreSQL puede combinarla con el índice GIN de los otros campos.
+Los demás campos relacionados siguen con `icontains`. En otras bases (SQLite
+en los tests) se usa el comportamiento de `SearchFilter`.
+
+Las expresiones que se consultan son las mismas que indexan los `GinIndex` de
+los modelos (`vector_busqueda` y `texto_trigramas`), en el orden de
+`search_fields`; si cambia uno hay que cambiar el otro.
+"""
+import operator
+import unicodedata
+from functools import reduce
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, models
+from django.db.models.functions import Concat, Lower
+from django.db.migrations.operations import AddIndex
+from rest_framework.filters import SearchFilter
+
+CONFIGURACION = 'transporte_es'
+FUNCION_SIN_ACENTOS = 'transporte_sin_acentos'
+
+
+class SinAcentos(models.Func):
+    """`unaccent` declarada IMMUTABLE (ver la migración) para poder indexarla"""
+    function = FUNCION_SIN_ACENTOS
+    output_field = models.TextField()
+
+
+def vector_busqueda(*campos):
+    return SearchVector(*campos, config=CONFIGURACION)
+
+
+def texto_trigramas(*campos):
+    if len(campos) > 1:
+        separados = [campo for nombre in campos for campo in (models.F(nombre), models.Value(' '))][:-1]
+        texto = Concat(*separados, output_field=models.TextField())
+    else:
+        texto = models.F(campos[0])
+    return SinAcentos(Lower(texto))
+
+
+def sin_acentos(texto):
+    """Lo mismo que `SinAcentos(Lower(...))` pero en Python, para los términos"""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(caracter for caracter in descompuesto if not unicodedata.combining(caracter))
+
+
+def clasificar_campos(modelo, search_fields):
+    """
+    `(texto completo, trigramas, otros)` según el tipo de cada campo; los
+    relacionados y los que usan prefijos de `SearchFilter` quedan en `otros`.
+    """
+    textos, cortos, otros = [], [], []
+    for campo in search_fields:
+        if '__' in campo or campo[0] in SearchFilter.lookup_prefixes:
+            otros.append(campo)
+        elif isinstance(modelo._meta.get_field(campo), models.TextField):
+            textos.append(campo)
+        else:
+            cortos.append(campo)
+    return textos, cortos, otros
+
+
+def campo_relacionado(modelo, campo):
+    """
+    `(clave foránea, modelo relacionado, campo)` si `campo` es un `CharField`
+    de un modelo relacionado a uno (`vehiculo__patente`), si no `None`.
+    """
+    nombres = campo.split('__')
+    if len(nombres) != 2 or campo[0] in SearchFilter.lookup_prefixes:
+        return None
+    try:
+        relacion = modelo._meta.get_field(nombres[0])
+        if not relacion.many_to_one:
+            return None
+        destino = relacion.related_model._meta.get_field(nombres[1])
+    except FieldDoesNotExist:
+        return None
+    if not isinstance(destino, models.CharField):
+        return None
+    return relacion, relacion.related_model, nombres[1]
+
+
+def ids_relacionados(modelo, campo, termino):
+    """
+    Ids de `modelo` cuyo `campo` contiene el término. Se traen como lista y no
+    como subconsulta: dentro de un OR, PostgreSQL evalúa una subconsulta fila
+    por fila y no puede usar los índices de las otras condiciones.
+    """
+    return list(
+        modelo._default_manager.order_by()
+        .alias(_busqueda_texto=texto_trigramas(campo))
+        .filter(_busqueda_texto__contains=sin_acentos(termino))
+        .values_list('pk', flat=True)
+    )
+
+
+class BusquedaFilter(SearchFilter):
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        terminos = self.get_search_terms(request)
+        if not search_fields or not terminos or connections[queryset.db].vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+        textos, cortos, otros = clasificar_campos(queryset.model, search_fields)
+        if not textos and not cortos:
+            return super().filter_queryset(request, queryset, view)
+
+        alias, relevancia = {}, []
+        if textos:
+            alias['_busqueda_vector'] = vector_busqueda(*textos)
+            consulta = SearchQuery(' '.join(terminos), config=CONFIGURACION)
+            relevancia.append(SearchRank(models.F('_busqueda_vector'), consulta))
+        if cortos:
+            alias['_busqueda_texto'] = texto_trigramas(*cortos)
+            relevancia.append(TrigramWordSimilarity(sin_acentos(' '.join(terminos)), '_busqueda_texto'))
+        queryset = queryset.alias(**alias)
+
+        # Cada término tiene que aparecer en alguno de los campos
+        for termino in terminos:
+            condiciones = []
+            if textos:
+                condiciones.append(models.Q(_busqueda_vector=SearchQuery(termino, config=CONFIGURACION)))
+            if cortos:
+                condiciones.append(models.Q(_busqueda_texto__contains=sin_acentos(termino)))
+            for campo in otros:
+                relacionado = campo_relacionado(queryset.model, campo)
+                if relacionado is None:
+                    condiciones.append(models.Q(**{self.construct_search(campo, queryset): termino}))
+                else:
+                    relacion, modelo, nombre = relacionado
+                    condiciones.append(models.Q(**{
+                        f'{relacion.attname}__in': ids_relacionados(modelo, nombre, termino)
+                    }))
+            queryset = queryset.filter(reduce(operator.or_, condiciones))
+
+        if getattr(view, 'ordenar_por_relevancia', True):
+            queryset = queryset.alias(
+                _busqueda_relevancia=reduce(operator.add, relevancia)
+            ).order_by('-_busqueda_relevancia', 'pk')
+        return queryset
+
+
+class AgregarIndicePostgres(AddIndex):
+    """`AddIndex` que solo crea el índice en PostgreSQL (los GIN no existen en SQLite)"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
@@ -0,0 +1,176 @@
+"""
+Cache de respuestas para los endpoints públicos del catálogo.
+
+Las respuestas de `list` y `retrieve` se guardan ya serializadas bajo una
+clave formada por el host, la ruta, los parámetros de la consulta y la
+generación de cada modelo del que dependen (el del serializer, los de sus
+serializers anidados y los que aportan totales). Las señales `post_save` y
+`post_delete` incrementan la generación del modelo modificado cuando se
+confirma la transacción (antes, un GET concurrente guardaría las filas viejas
+bajo la generación nueva), así las claves viejas dejan de usarse sin tener
+que buscarlas ni borrarlas.
+
+Con `CondicionalViewSetMixin` la clave también lleva el `ETag` calculado de
+la base en la misma solicitud: una respuesta solo se sirve si se guardó para
+la versión vigente de los datos, aunque la generación no se haya incrementado
+en este proceso (con memoria local, un cambio hecho en otro worker) o la
+respuesta se haya guardado con datos anteriores al commit.
+
+El backend es la cache `respuestas` de Django (`CACHES`), configurable con
+`RESPUESTAS_CACHE_BACKEND`: con memoria local cada proceso tiene su cache y
+sus generaciones; con el backend de archivos (o uno compartido) todos los
+workers ven las mismas.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from .expansion import _serializer_hijo, campos_expandibles, nombres_totales
+
+CACHE_ALIAS = 'respuestas'
+PREFIJO_GENERACION = 'generacion:'
+PREFIJO_RESPUESTA = 'respuesta:'
+
+
+def cache_respuestas():
+    return caches[CACHE_ALIAS]
+
+
+def _clave_generacion(modelo):
+    return PREFIJO_GENERACION + modelo._meta.label_lower
+
+
+def generaciones(modelos):
+    """Generación actual de cada modelo, inicializando las que no existan"""
+    cache = cache_respuestas()
+    claves = [_clave_generacion(modelo) for modelo in modelos]
+    actuales = cache.get_many(claves)
+    for clave in claves:
+        if clave not in actuales:
+            # Un valor nuevo (y no 0) evita reutilizar claves viejas si la
+            # generación fue desalojada de la cache
+            cache.add(clave, time.time_ns(), timeout=None)
+            actuales[clave] = cache.get(clave)
+    return [actuales[clave] for clave in claves]
+
+
+def incrementar_generacion(modelo):
+    cache = cache_respuestas()
+    clave = _clave_generacion(modelo)
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.set(clave, time.time_ns(), timeout=None)
+
+
+@lru_cache(maxsize=None)
+def modelos_dependientes(serializer_class):
+    """Modelos cuyos cambios pueden alterar lo que devuelve `serializer_class`"""
+    modelo = serializer_class.Meta.model
+    modelos = {modelo}
+    if nombres_totales(modelo):
+        modelos.update(relacion.related_model for relacion in modelo._meta.related_objects)
+    for _, campo in campos_expandibles(serializer_class).values():
+        modelos |= modelos_dependientes(type(_serializer_hijo(campo)))
+    return frozenset(modelos)
+
+
+class Estadisticas:
+    """Aciertos y fallos de la cache en este proceso, por vista"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.aciertos = Counter()
+        self.fallos = Counter()
+
+    def registrar(self, vista, acierto):
+        with self._lock:
+            (self.aciertos if acierto else self.fallos)[vista] += 1
+
+    def resumen(self):
+        with self._lock:
+            vistas = sorted(set(self.aciertos) | set(self.fallos))
+            aciertos, fallos = sum(self.aciertos.values()), sum(self.fallos.values())
+            return {
+                'backend': cache_respuestas().__class__.__name__,
+                'aciertos': aciertos,
+                'fallos': fallos,
+                'tasa_aciertos': round(aciertos / (aciertos + fallos), 4) if aciertos + fallos else None,
+                'por_vista': {
+                    vista: {'aciertos': self.aciertos[vista], 'fallos': self.fallos[vista]}
+                    for vista in vistas
+                },
+            }
+
+    def reiniciar(self):
+        with self._lock:
+            self.aciertos.clear()
+            self.fallos.clear()
+
+
+estadisticas = Estadisticas()
+
+
+class RespuestaCacheViewSetMixin:
+    """
+    Sirve `list` y `retrieve` desde la cache de respuestas. Solo se guardan
+    las respuestas 200; la cabecera `X-Cache` indica si hubo acierto.
+    """
+    acciones_cache = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        return self.respuesta_cacheada(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.respuesta_cacheada(super().retrieve, request, *args, **kwargs)
+
+    def clave_cache(self, request):
+        modelos = sorted(modelos_dependientes(self.get_serializer_class()), key=lambda m: m._meta.label_lower)
+        parametros = sorted(request.query_params.lists())
+        # `etag_vigente` lo fija `CondicionalViewSetMixin` antes de llamar a la vista
+        etag = getattr(self, 'etag_vigente', None)
+        firma = repr((request.get_host(), request.path, parametros, generaciones(modelos), etag))
+        return PREFIJO_RESPUESTA + hashlib.sha256(firma.encode()).hexdigest()
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.arespuesta_cacheada(super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.arespuesta_cacheada(super().aretrieve, request, *args, **kwargs)
+
+    def buscar_respuesta(self, request):
+        """`(clave, respuesta cacheada o None)`"""
+        clave = self.clave_cache(request)
+        datos = cache_respuestas().get(clave)
+        estadisticas.registrar(self.basename or type(self).__name__, datos is not None)
+        if datos is None:
+            return clave, None
+        return clave, Response(datos, headers={'X-Cache': 'HIT'})
+
+    def guardar_respuesta(self, clave, response):
+        if response.status_code == 200:
+            cache_respuestas().set(clave, response.data)
+            response['X-Cache'] = 'MISS'
+        return response
+
+    def respuesta_cacheada(self, vista, request, *args, **kwargs):
+        if self.action not in self.acciones_cache:
+            return vista(request, *args, **kwargs)
+        clave, response = self.buscar_respuesta(request)
+        if response is None:
+            response = self.guardar_respuesta(clave, vista(request, *args, **kwargs))
+        return response
+
+    async def arespuesta_cacheada(self, vista, request, *args, **kwargs):
+        # La cache de respuestas es local (memoria o archivos): se consulta sin pasar a un hilo
+        if self.action not in self.acciones_cache:
+            return await vista(request, *args, **kwargs)
+        clave, response = self.buscar_respuesta(request)
+        if response is None:
+            response = self.guardar_respuesta(clave, await vista(request, *args, **kwargs))
+        return response
@@ -0,0 +1,139 @@
+"""
+Búsqueda de paradas cercanas sin consultar la base de datos.
+
+Las paradas con coordenadas se guardan en memoria en un KD-tree sobre sus
+posiciones en la esfera unitaria (x, y, z): la distancia en línea recta entre
+dos puntos de la esfera crece igual que la distancia haversine, así que el
+árbol poda y ordena sin aproximaciones y sin problemas en el antimeridiano.
+La distancia devuelta se convierte a metros sobre la superficie.
+
+El índice se descarta desde las señales de `Parada` y se reconstruye en la
+próxima consulta; además se reconstruye cada `PARADAS_CERCANAS_MAX_EDAD`
+segundos para recoger cambios hechos en otros procesos.
+"""
+import math
+import threading
+import time
+from heapq import heappush, heapreplace
+
+from django.conf import settings
+
+from .models import Parada
+from .serializers import ParadaSerializer
+
+RADIO_TIERRA = 6371000
+
+
+def a_cartesianas(latitud, longitud):
+    lat, lon = math.radians(latitud), math.radians(longitud)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def cuerda_a_metros(cuerda):
+    return 2 * RADIO_TIERRA * math.asin(min(1.0, cuerda / 2))
+
+
+def metros_a_cuerda(metros):
+    return 2 * math.sin(min(metros / (2 * RADIO_TIERRA), math.pi / 2))
+
+
+class ArbolKD:
+    """
+    KD-tree balanceado e inmutable. Los nodos se guardan implícitamente: el
+    nodo de un rango `[inicio, fin)` es su elemento del medio.
+    """
+
+    def __init__(self, puntos, datos):
+        elementos = list(zip(puntos, datos))
+        self._ordenar(elementos, 0, len(elementos), 0)
+        self.puntos = [punto for punto, _ in elementos]
+        self.datos = [dato for _, dato in elementos]
+
+    def _ordenar(self, elementos, inicio, fin, eje):
+        if fin - inicio < 2:
+            return
+        elementos[inicio:fin] = sorted(elementos[inicio:fin], key=lambda elemento: elemento[0][eje])
+        medio = (inicio + fin) // 2
+        self._ordenar(elementos, inicio, medio, (eje + 1) % 3)
+        self._ordenar(elementos, medio + 1, fin, (eje + 1) % 3)
+
+    def __len__(self):
+        return len(self.puntos)
+
+    def vecinos(self, punto, k, limite=math.inf):
+        """
+        Los `k` puntos más cercanos a `punto` con distancia al cuadrado hasta
+        `limite`, como `(distancia², dato)` ordenados de menor a mayor.
+        """
+        puntos = self.puntos
+        mejores = []  # max-heap de (-distancia², índice)
+
+        def buscar(inicio, fin, eje):
+            if inicio >= fin:
+                return
+            medio = (inicio + fin) // 2
+            nodo = puntos[medio]
+            distancia = (
+                (nodo[0] - punto[0]) ** 2 + (nodo[1] - punto[1]) ** 2 + (nodo[2] - punto[2]) ** 2
+            )
+            if distancia <= limite:
+                if len(mejores) < k:
+                    heappush(mejores, (-distancia, medio))
+                elif distancia < -mejores[0][0]:
+                    heapreplace(mejores, (-distancia, medio))
+            delta = punto[eje] - nodo[eje]
+            siguiente = (eje + 1) % 3
+            if delta < 0:
+                buscar(inicio, medio, siguiente)
+                lejos = (medio + 1, fin)
+            else:
+                buscar(medio + 1, fin, siguiente)
+                lejos = (inicio, medio)
+            cota = -mejores[0][0] if len(mejores) == k else limite
+            if delta * delta <= cota:
+                buscar(*lejos, siguiente)
+
+        if k > 0:
+            buscar(0, len(puntos), 0)
+        return [(-distancia, self.datos[indice]) for distancia, indice in sorted(mejores, reverse=True)]
+
+
+class IndiceParadas:
+    """Índice de paradas con coordenadas compartido por el proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arbol = None
+        self._construido_en = 0.0
+
+    def invalidar(self):
+        with self._lock:
+            self._arbol = None
+
+    def arbol(self):
+        with self._lock:
+            max_edad = getattr(settings, 'PARADAS_CERCANAS_MAX_EDAD', 300)
+            if self._arbol is None or time.monotonic() - self._construido_en > max_edad:
+                self._arbol = self._construir()
+                self._construido_en = time.monotonic()
+            return self._arbol
+
+    def _construir(self):
+        paradas = Parada.objects.filter(latitud__isnull=False, longitud__isnull=False)
+        datos = [dict(parada) for parada in ParadaSerializer(paradas, many=True).data]
+        puntos = [a_cartesianas(float(dato['latitud']), float(dato['longitud'])) for dato in datos]
+        return ArbolKD(puntos, datos)
+
+    def cercanas(self, latitud, longitud, k, radio=None):
+        """
+        Hasta `k` paradas ordenadas por distancia a (latitud, longitud), a lo
+        sumo a `radio` metros si se indica. Cada una lleva `distancia` en metros.
+        """
+        limite = math.inf if radio is None else metros_a_cuerda(radio) ** 2 * (1 + 1e-9)
+        return [
+            {**dato, 'distancia': round(cuerda_a_metros(math.sqrt(distancia)), 1)}
+            for distancia, dato in self.arbol().vecinos(a_cartesianas(latitud, longitud), k, limite)
+        ]
+
+
+indice = IndiceParadas()
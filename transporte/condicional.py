@@ -0,0 +1,241 @@
+"""
+GET condicional (`ETag` / `Last-Modified`) para los listados y detalles.
+
+Los validadores se calculan antes de serializar, a partir de
+`fecha_actualizacion` del modelo principal y de cada relación expandida en la
+respuesta. Con paginación por cursor se usan solo las filas de la página
+pedida (el mismo orden y límite que la paginación, más la fila que indica si
+hay otra página): sus ids y fechas salen en una consulta que recorre el índice
+del orden. Sin ella se usan agregados sobre todo el queryset filtrado:
+`Max(fecha_actualizacion)` y la cantidad de filas. Cada relación expandida a
+muchos se agrega en una consulta propia. Un cambio en cualquier fila sube la
+fecha y un alta o baja cambia las filas o la cantidad, así que el `ETag`
+cambia siempre que cambia el contenido. Si la request trae `If-None-Match` o
+`If-Modified-Since` que siguen vigentes se responde 304 sin serializar nada.
+
+Los totales (`total_boletos`, ...) no necesitan agregar su relación: un alta,
+una baja o un cambio de padre de la fila contada actualiza
+`fecha_actualizacion` del padre (`tocar_padres`, desde las señales).
+
+`Last-Modified` no refleja las bajas (el máximo puede no cambiar), así que
+los clientes deberían preferir `If-None-Match`.
+
+`alist` y `aretrieve` son las versiones para las lecturas asíncronas
+(`transporte.asincrono`): calculan los mismos agregados con el ORM asíncrono.
+"""
+import hashlib
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .expansion import _serializer_hijo, arbol_expansion, campos_expandibles, nombres_totales
+
+CAMPO_ACTUALIZACION = 'fecha_actualizacion'
+PREFIJO_TOTAL = 'total_'
+
+
+def relaciones_dependientes(serializer_class, arbol, campos=None, prefijo=''):
+    """
+    Caminos de relaciones (`boletos`, `ruta__linea`) cuyas filas forman parte
+    de la representación de `serializer_class` con el árbol de expansión dado.
+    """
+    if campos is None:
+        campos = serializer_class.Meta.fields
+    # Los totales no aparecen: sus altas y bajas ya actualizan al padre
+    caminos = []
+    expandibles = campos_expandibles(serializer_class)
+    for nombre, subarbol in arbol.items():
+        if nombre not in expandibles or expandibles[nombre][0] not in campos:
+            continue
+        _, campo = expandibles[nombre]
+        camino = prefijo + campo.source
+        caminos.append(camino)
+        caminos += relaciones_dependientes(type(_serializer_hijo(campo)), subarbol, prefijo=camino + '__')
+    return caminos
+
+
+def _multiplica_filas(modelo, camino):
+    """Si el camino pasa por una relación a muchos (su JOIN repite las filas)"""
+    for nombre in camino.split('__'):
+        campo = modelo._meta.get_field(nombre)
+        if campo.one_to_many or campo.many_to_many:
+            return True
+        modelo = campo.related_model
+    return False
+
+
+def _agregaciones(queryset, caminos):
+    """
+    Consultas `(queryset, agregados)` de los validadores; con `agregados` en
+    `None` la consulta se lee completa. De una página (un queryset con límite)
+    se leen los ids y las fechas de sus filas y de sus relaciones a uno; de un
+    queryset sin límite, el máximo y la cantidad. Cada relación a muchos
+    necesita una consulta propia, restringida a las filas de la página.
+    """
+    a_uno = [camino for camino in caminos if not _multiplica_filas(queryset.model, camino)]
+    a_muchos = [camino for camino in caminos if camino not in a_uno]
+
+    if queryset.query.is_sliced:
+        consultas = [(queryset.values_list(
+            'pk', CAMPO_ACTUALIZACION, *(f'{camino}__{CAMPO_ACTUALIZACION}' for camino in a_uno)
+        ), None)]
+        filas = queryset.model._default_manager.filter(pk__in=queryset.values('pk')).values('pk')
+    else:
+        filas = queryset.order_by().values('pk')
+        agregados = {'max': Max(CAMPO_ACTUALIZACION), 'cantidad': Count('pk')}
+        for i, camino in enumerate(a_uno):
+            agregados[f'max_{i}'] = Max(f'{camino}__{CAMPO_ACTUALIZACION}')
+            agregados[f'cantidad_{i}'] = Count(camino, distinct=True)
+        consultas = [(filas, agregados)]
+    for camino in a_muchos:
+        consultas.append((filas, {
+            'max': Max(f'{camino}__{CAMPO_ACTUALIZACION}'), 'cantidad': Count(camino, distinct=True),
+        }))
+    return consultas
+
+
+def _firmar(caminos, resultados):
+    fechas = []
+    for resultado in resultados:
+        if isinstance(resultado, dict):
+            fechas += [valor for clave, valor in resultado.items() if clave.startswith('max')]
+        else:
+            # Filas `(pk, fecha, fechas de las relaciones a uno...)`
+            fechas += [valor for fila in resultado for valor in fila[1:]]
+    firma = repr((caminos, resultados))
+    return hashlib.sha256(firma.encode()).hexdigest()[:32], max(filter(None, fechas), default=None)
+
+
+def validadores(queryset, caminos):
+    """`(etag, ultima_modificacion)` del queryset y de las relaciones indicadas"""
+    return _firmar(caminos, [
+        list(consulta) if agregados is None else consulta.aggregate(**agregados)
+        for consulta, agregados in _agregaciones(queryset, caminos)
+    ])
+
+
+async def avalidadores(queryset, caminos):
+    """`validadores` con el ORM asíncrono"""
+    return _firmar(caminos, [
+        [fila async for fila in consulta] if agregados is None else await consulta.aaggregate(**agregados)
+        for consulta, agregados in _agregaciones(queryset, caminos)
+    ])
+
+
+@lru_cache(maxsize=None)
+def claves_contadas(modelo):
+    """Claves foráneas de `modelo` hacia padres que cuentan sus filas en un total"""
+    return tuple(
+        campo for campo in modelo._meta.concrete_fields
+        if campo.many_to_one and PREFIJO_TOTAL + campo.remote_field.get_accessor_name()
+        in nombres_totales(campo.related_model)
+    )
+
+
+def tocar_padres(modelo, ids):
+    """
+    Actualiza `fecha_actualizacion` de los padres cuyo total de filas de
+    `modelo` cambió; `ids` mapea cada clave de `claves_contadas` (por nombre)
+    a los ids de esos padres.
+    """
+    ahora = timezone.now()
+    for campo in claves_contadas(modelo):
+        padres = set(ids.get(campo.name, ())) - {None}
+        if padres:
+            # Con `update`: no es un cambio del padre para las señales
+            campo.related_model._default_manager.filter(pk__in=padres).update(**{CAMPO_ACTUALIZACION: ahora})
+
+
+class CondicionalViewSetMixin:
+    """
+    Agrega `ETag` y `Last-Modified` a `list` y `retrieve` y responde 304
+    cuando el cliente ya tiene la versión vigente. El `ETag` también depende
+    de los parámetros de la consulta (página, campos, expansiones).
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.consulta_validadores(self.filter_queryset(self.get_queryset()), request)
+        return self.respuesta_condicional(super().list, queryset, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        queryset = self.consulta_detalle(self.filter_queryset(self.get_queryset()), kwargs)
+        if queryset is None:
+            # Identificador mal formado: que lo resuelva `retrieve` (404)
+            return super().retrieve(request, *args, **kwargs)
+        return self.respuesta_condicional(super().retrieve, queryset, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.consulta_validadores(await self.aconsulta(), request)
+        return await self.arespuesta_condicional(super().alist, queryset, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        queryset = self.consulta_detalle(await self.aconsulta(), kwargs)
+        if queryset is None:
+            return await super().aretrieve(request, *args, **kwargs)
+        return await self.arespuesta_condicional(super().aretrieve, queryset, request, *args, **kwargs)
+
+    def consulta_detalle(self, queryset, kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return queryset.filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+    def consulta_validadores(self, queryset, request):
+        """
+        Filas de las que dependen los validadores del listado: con paginación
+        por cursor, las de la página pedida (más la que indica si hay otra).
+        """
+        if self.paginator is None or not hasattr(self.paginator, 'consulta_pagina'):
+            return queryset
+        queryset = self.paginator.consulta_pagina(queryset, request)
+        return queryset[:self.paginator.page_size + 1]
+
+    def caminos_dependientes(self, request):
+        serializer_class = self.get_serializer_class()
+        return relaciones_dependientes(
+            serializer_class, arbol_expansion(request), self.campos_pedidos(serializer_class)
+        )
+
+    def condiciones(self, request, version, ultima_modificacion):
+        """`(etag, ultima_modificacion, respuesta 304 o None)` para la versión calculada"""
+        parametros = sorted(request.query_params.lists())
+        etag = '"%s"' % hashlib.sha256(repr((version, parametros)).encode()).hexdigest()[:32]
+        # HTTP-date tiene resolución de segundos
+        ultima_modificacion = ultima_modificacion and int(ultima_modificacion.timestamp())
+
+        no_modificada = get_conditional_response(
+            request._request, etag=etag, last_modified=ultima_modificacion
+        )
+        if no_modificada is not None:
+            no_modificada['ETag'] = etag
+        return etag, ultima_modificacion, no_modificada
+
+    def agregar_validadores(self, response, etag, ultima_modificacion):
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if ultima_modificacion:
+                response['Last-Modified'] = http_date(ultima_modificacion)
+        return response
+
+    def respuesta_condicional(self, vista, queryset, request, *args, **kwargs):
+        version = validadores(queryset, self.caminos_dependientes(request))
+        etag, ultima_modificacion, no_modificada = self.condiciones(request, *version)
+        if no_modificada is not None:
+            return no_modificada
+        # La cache de respuestas solo sirve lo guardado para esta misma versión
+        self.etag_vigente = etag
+        return self.agregar_validadores(vista(request, *args, **kwargs), etag, ultima_modificacion)
+
+    async def arespuesta_condicional(self, vista, queryset, request, *args, **kwargs):
+        version = await avalidadores(queryset, self.caminos_dependientes(request))
+        etag, ultima_modificacion, no_modificada = self.condiciones(request, *version)
+        if no_modificada is not None:
+            return no_modificada
+        # La cache de respuestas solo sirve lo guardado para esta misma versión
+        self.etag_vigente = etag
+        return self.agregar_validadores(await vista(request, *args, **kwargs), etag, ultima_modificacion)
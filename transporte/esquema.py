@@ -0,0 +1,31 @@
+"""
+Autenticaciones propias en el esquema OpenAPI (`/api/schema/`).
+
+drf-spectacular solo describe las clases de autenticación que conoce; para
+las de este proyecto hay que registrar una extensión por clase (se importa
+desde `TransporteConfig.ready`).
+"""
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+from drf_spectacular.plumbing import build_bearer_security_scheme_object
+
+
+class JWTCacheScheme(SimpleJWTScheme):
+    """El mismo esquema `jwtAuth` que `JWTAuthentication`"""
+    target_class = 'transporte.autenticacion.JWTCacheAuthentication'
+
+
+class TokenMetricasScheme(OpenApiAuthenticationExtension):
+    target_class = 'transporte.metricas.TokenMetricasAuthentication'
+    name = 'metricasToken'
+
+    def get_security_definition(self, auto_schema):
+        return build_bearer_security_scheme_object(header_name='AUTHORIZATION', token_prefix='Bearer')
+
+
+class TokenPosicionesScheme(OpenApiAuthenticationExtension):
+    target_class = 'transporte.posiciones.TokenPosicionesAuthentication'
+    name = 'posicionesToken'
+
+    def get_security_definition(self, auto_schema):
+        return build_bearer_security_scheme_object(header_name='AUTHORIZATION', token_prefix='Bearer')
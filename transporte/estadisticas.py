@@ -0,0 +1,220 @@
+"""
+Resúmenes de boletos (cantidad y recaudación) para estadísticas.
+
+Cada boleto suma en tres tablas de resumen, de la más chica a la más
+detallada: `ResumenBoletosDia` (día local, ruta, tipo de tarjeta),
+`ResumenBoletosParadaDia` (además la parada de subida) y `ResumenBoletosHora`
+(la hora en lugar del día). Los boletos de a uno se acumulan desde las señales
+de `Boleto` (alta, modificación y baja) y los lotes de `ingresar_boletos`
+llaman a `acumular_boletos` directamente porque `bulk_create` no emite
+señales. Los incrementos se calculan en la transacción del boleto pero se
+suman recién después del commit, en una transacción propia: el cobro no
+bloquea las filas de resumen que comparten todos los boletos de la misma
+hora y ruta, y un cobro que se revierte no las toca. Si el proceso termina
+entre ambos commits el resumen queda corto; la historia se reconstruye con
+`recalcular` (comando `recalcular_estadisticas`).
+
+Cada consulta usa la tabla más chica que tenga las dimensiones y el período
+pedidos, agrupa solo por ids y después trae los nombres de las filas
+resultantes, así un año de datos por línea o por parada se responde sin
+recorrer la tabla por hora.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate, TruncHour, TruncMonth
+from django.utils import timezone
+
+from .models import (
+    Linea, Parada, Ruta, Boleto, Viaje, Tarjeta,
+    ResumenBoletosHora, ResumenBoletosParadaDia, ResumenBoletosDia
+)
+
+PERIODOS = ('hora', 'dia', 'mes', 'total')
+# Nombre en la API -> columna en las tablas de resumen
+DIMENSIONES = {
+    'linea': 'linea_id',
+    'ruta': 'ruta_id',
+    'parada': 'parada_subida_id',
+    'tipo_tarjeta': 'tipo_tarjeta',
+}
+# Dimensión -> (clave del nombre en el resultado, modelo, campo con el nombre)
+NOMBRES = {
+    'linea': ('linea_numero', Linea, 'numero'),
+    'ruta': ('ruta_nombre', Ruta, 'nombre'),
+    'parada': ('parada_nombre', Parada, 'nombre'),
+}
+# Tablas de resumen de la más chica a la más detallada: (modelo, columna del período, dimensiones)
+NIVELES = (
+    (ResumenBoletosDia, 'dia', ('linea', 'ruta', 'tipo_tarjeta')),
+    (ResumenBoletosParadaDia, 'dia', ('linea', 'ruta', 'parada', 'tipo_tarjeta')),
+    (ResumenBoletosHora, 'hora', ('linea', 'ruta', 'parada', 'tipo_tarjeta')),
+)
+
+
+def _columnas(periodo, dimensiones):
+    return (periodo, *(DIMENSIONES[nombre] for nombre in dimensiones))
+
+
+def _incrementos(boletos):
+    """Por cada tabla de resumen, clave -> [cantidad, importe] de los `boletos`"""
+    viajes = {
+        pk: (ruta, linea) for pk, ruta, linea in Viaje.objects.filter(
+            pk__in={boleto.viaje_id for boleto in boletos}
+        ).values_list('pk', 'ruta_id', 'ruta__linea_id')
+    }
+    ids_tarjetas = {boleto.tarjeta_id for boleto in boletos if boleto.tarjeta_id is not None}
+    tipos = dict(
+        Tarjeta.objects.filter(pk__in=ids_tarjetas).values_list('pk', 'tipo')
+    ) if ids_tarjetas else {}
+
+    incrementos = {modelo: defaultdict(lambda: [0, Decimal('0')]) for modelo, _, _ in NIVELES}
+    for boleto in boletos:
+        if boleto.viaje_id not in viajes:
+            continue
+        ruta, linea = viajes[boleto.viaje_id]
+        valores = {
+            'hora': boleto.fecha_compra.replace(minute=0, second=0, microsecond=0),
+            'dia': timezone.localdate(boleto.fecha_compra),
+            'linea_id': linea,
+            'ruta_id': ruta,
+            'parada_subida_id': boleto.parada_subida_id,
+            'tipo_tarjeta': tipos.get(boleto.tarjeta_id, ''),
+        }
+        for modelo, periodo, dimensiones in NIVELES:
+            acumulado = incrementos[modelo][tuple(valores[columna] for columna in _columnas(periodo, dimensiones))]
+            acumulado[0] += 1
+            acumulado[1] += boleto.monto
+    return incrementos
+
+
+def _sumar(modelo, columnas, incrementos, signo):
+    for clave, (cantidad, importe) in incrementos.items():
+        filtro = dict(zip(columnas, clave))
+        cambios = {
+            'boletos': F('boletos') + signo * cantidad,
+            'recaudacion': F('recaudacion') + signo * importe,
+        }
+        if modelo.objects.filter(**filtro).update(**cambios):
+            continue
+        try:
+            with transaction.atomic():
+                modelo.objects.create(**filtro, boletos=signo * cantidad, recaudacion=signo * importe)
+        except IntegrityError:
+            # Otra transacción creó la fila entre el UPDATE y el INSERT
+            modelo.objects.filter(**filtro).update(**cambios)
+
+
+def _aplicar(incrementos, signo):
+    with transaction.atomic():
+        for modelo, periodo, dimensiones in NIVELES:
+            _sumar(modelo, _columnas(periodo, dimensiones), incrementos[modelo], signo)
+
+
+def acumular_boletos(boletos, signo=1):
+    """Suma (o resta, con `signo=-1`) `boletos` en los resúmenes cuando se confirma la transacción"""
+    boletos = [boleto for boleto in boletos if boleto.fecha_compra is not None]
+    if not boletos:
+        return
+    # Las claves se leen ahora: después del commit el viaje de un boleto borrado ya no existe
+    incrementos = _incrementos(boletos)
+    transaction.on_commit(lambda: _aplicar(incrementos, signo))
+
+
+def inicio_del_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def recalcular(desde, hasta):
+    """
+    Rehace los resúmenes de los días `desde` a `hasta` (inclusive, hora
+    local) a partir de los boletos. Devuelve la cantidad de boletos resumidos.
+    """
+    inicio, fin = inicio_del_dia(desde), inicio_del_dia(hasta + timedelta(days=1))
+    boletos = Boleto.objects.filter(fecha_compra__gte=inicio, fecha_compra__lt=fin).order_by().annotate(
+        linea_id=F('viaje__ruta__linea_id'),
+        ruta_id=F('viaje__ruta_id'),
+        tipo_tarjeta=Coalesce('tarjeta__tipo', Value('')),
+    )
+    truncar = {'hora': TruncHour('fecha_compra'), 'dia': TruncDate('fecha_compra')}
+    with transaction.atomic():
+        for modelo, periodo, dimensiones in NIVELES:
+            if periodo == 'hora':
+                modelo.objects.filter(hora__gte=inicio, hora__lt=fin).delete()
+            else:
+                modelo.objects.filter(dia__gte=desde, dia__lte=hasta).delete()
+            columnas = _columnas(periodo, dimensiones)
+            filas = (
+                boletos.annotate(**{periodo: truncar[periodo]})
+                .values(*columnas)
+                .annotate(cantidad=Count('pk'), importe=Sum('monto'))
+            )
+            resumidos = 0
+            resumenes = []
+            for fila in filas.iterator():
+                resumidos += fila['cantidad']
+                resumenes.append(modelo(
+                    **{columna: fila[columna] for columna in columnas},
+                    boletos=fila['cantidad'], recaudacion=fila['importe'],
+                ))
+            modelo.objects.bulk_create(resumenes, batch_size=1000)
+    return resumidos
+
+
+def nivel_para(periodo, dimensiones):
+    """Tabla de resumen más chica con el `periodo` y las `dimensiones` pedidas"""
+    for modelo, columna_periodo, disponibles in NIVELES:
+        if (periodo != 'hora' or columna_periodo == 'hora') and set(dimensiones) <= set(disponibles):
+            return modelo, columna_periodo
+    raise ValueError(f'Ningún resumen tiene {periodo} y {dimensiones}')
+
+
+def consultar(desde, hasta, periodo='dia', agrupar=('linea',), filtros=None):
+    """
+    Boletos y recaudación entre `desde` y `hasta` (días locales, inclusive)
+    por `periodo` y por las dimensiones de `agrupar`. `filtros` restringe
+    dimensiones a un valor, p. ej. `{'linea': 3}`.
+    """
+    filtros = filtros or {}
+    modelo, columna_periodo = nivel_para(periodo, [*agrupar, *filtros])
+    if columna_periodo == 'hora':
+        queryset = modelo.objects.filter(
+            hora__gte=inicio_del_dia(desde), hora__lt=inicio_del_dia(hasta + timedelta(days=1))
+        )
+        periodos = {'hora': F('hora'), 'dia': TruncDate('hora'), 'mes': TruncMonth('hora')}
+    else:
+        queryset = modelo.objects.filter(dia__gte=desde, dia__lte=hasta)
+        periodos = {'dia': F('dia'), 'mes': TruncMonth('dia')}
+    queryset = queryset.filter(**{DIMENSIONES[nombre]: valor for nombre, valor in filtros.items()})
+
+    totales = {'boletos': Sum('boletos'), 'recaudacion': Sum('recaudacion')}
+    columnas = [DIMENSIONES[nombre] for nombre in agrupar]
+    expresiones = {'periodo': periodos[periodo]} if periodo != 'total' else {}
+    if not columnas and not expresiones:
+        total = queryset.aggregate(**totales)
+        return [total] if total['boletos'] is not None else []
+
+    filas = list(
+        queryset.order_by().values(*columnas, **expresiones).annotate(**totales)
+        .order_by(*expresiones, *columnas)
+    )
+    for fila in filas:
+        for nombre, columna in zip(agrupar, columnas):
+            fila[nombre] = fila.pop(columna)
+
+    # Los nombres se buscan después de agrupar: una consulta chica por dimensión
+    for nombre in agrupar:
+        if nombre in NOMBRES:
+            clave, modelo_nombre, campo = NOMBRES[nombre]
+            nombres = dict(modelo_nombre.objects.filter(
+                pk__in={fila[nombre] for fila in filas}
+            ).values_list('pk', campo))
+            for fila in filas:
+                fila[clave] = nombres.get(fila[nombre])
+    if periodo == 'hora':
+        for fila in filas:
+            fila['periodo'] = timezone.localtime(fila['periodo'])
+    return filas
@@ -0,0 +1,336 @@
+"""
+Tiempos estimados de llegada (ETA) a las paradas a partir de los viajes hechos.
+
+Los perfiles se calculan con NumPy sobre los viajes con `hora_salida_real` y
+`hora_llegada_real` de los últimos `ETA_DIAS_HISTORIAL` días: la duración de
+cada viaje se agrupa por ruta, día de la semana y franja horaria de la salida
+(`ETA_FRANJA_MINUTOS`) y de cada grupo se guardan la mediana, el percentil 90
+y la cantidad de viajes. La lectura (`leer_viajes`) sí recorre las filas en
+Python para pasar las horas a segundos y la fecha a día de la semana; la
+agrupación y las estadísticas se resuelven con operaciones sobre arreglos
+(un ordenamiento y los límites de cada grupo), sin recorrer los viajes.
+
+Una celda con menos de `ETA_MINIMO_VIAJES` viajes usa la de la misma franja
+con todos los días y, si tampoco alcanza, la de toda la ruta; una ruta sin
+historial usa la duración de sus horarios. Esa elección también se hace al
+calcular, así que la consulta es un acceso a tres tablas `(ruta, día, franja)`.
+
+El tiempo hasta cada parada es la duración por la fracción del recorrido en
+la que está (por distancia si todas las paradas tienen coordenadas o por
+número de parada si no, como en el planificador). Los recorridos se
+invalidan desde las señales; los perfiles se recalculan cada `ETA_MAX_EDAD`
+segundos o, con `ETA_ARCHIVO`, se leen del archivo que deja
+`python manage.py calcular_eta`.
+
+Solo la primera consulta del proceso espera los perfiles. Cuando vencen se
+recalculan en un hilo aparte y mientras tanto se siguen usando los
+anteriores hasta reemplazarlos. Las lecturas de la base (perfiles y
+recorridos) nunca se hacen con el lock del índice tomado: otro hilo puede
+seguir estimando con lo que ya hay.
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .models import Horario, Parada, Ruta, RutaParada, Viaje
+from .planificador import SEGUNDOS_DIA, a_segundos, fracciones_recorrido
+
+# Viajes más largos (o de duración cero) se consideran mal registrados
+MAX_DURACION = 6 * 3600
+BITS_DURACION = MAX_DURACION.bit_length()
+FILAS_POR_LECTURA = 50000
+# Origen de la estimación de cada celda
+FUENTES = ('dia', 'franja', 'ruta')
+
+logger = logging.getLogger(__name__)
+
+
+def leer_viajes(desde, hasta):
+    """Arreglo `(n, 4)` con ruta, día de la semana (0 = lunes), salida y llegada en segundos"""
+    filas = Viaje.objects.filter(
+        fecha__range=(desde, hasta), hora_salida_real__isnull=False, hora_llegada_real__isnull=False
+    ).values_list('ruta_id', 'fecha', 'hora_salida_real', 'hora_llegada_real').order_by()
+    # Las funciones de fecha de SQLite corren en Python fila por fila: es más
+    # rápido traer los valores y convertirlos acá
+    dias = {}
+    valores = []
+    agregar = valores.extend
+    for ruta, fecha, salida, llegada in filas.iterator(chunk_size=FILAS_POR_LECTURA):
+        dia = dias.get(fecha)
+        if dia is None:
+            dia = dias[fecha] = fecha.weekday()
+        agregar((
+            ruta, dia,
+            salida.hour * 3600 + salida.minute * 60 + salida.second,
+            llegada.hour * 3600 + llegada.minute * 60 + llegada.second,
+        ))
+    return np.array(valores, dtype=np.int64).reshape(-1, 4)
+
+
+def _por_grupo(grupos, duraciones, cantidad_grupos):
+    """Mediana, percentil 90 y cantidad de `duraciones` por grupo (NaN donde no hay)"""
+    mediana = np.full(cantidad_grupos, np.nan)
+    p90 = np.full(cantidad_grupos, np.nan)
+    cantidad = np.zeros(cantidad_grupos, dtype=np.int64)
+    if not len(grupos):
+        return mediana, p90, cantidad
+    # Un solo ordenamiento por grupo y duración: la duración entra en los bits bajos
+    claves = np.sort(grupos << BITS_DURACION | duraciones)
+    grupos, duraciones = claves >> BITS_DURACION, claves & ((1 << BITS_DURACION) - 1)
+    inicio = np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]])
+    unicos, por_grupo = grupos[inicio], np.diff(np.r_[inicio, len(grupos)])
+    mediana[unicos] = (duraciones[inicio + (por_grupo - 1) // 2] + duraciones[inicio + por_grupo // 2]) / 2
+    p90[unicos] = duraciones[inicio + np.ceil(0.9 * por_grupo).astype(np.int64) - 1]
+    cantidad[unicos] = por_grupo
+    return mediana, p90, cantidad
+
+
+class Perfiles:
+    """Tablas `(ruta, día, franja)` de duración mediana, percentil 90, viajes y fuente"""
+
+    def __init__(self, rutas, franja, mediana, p90, viajes, fuente, calculado_en):
+        self.rutas = rutas  # id de ruta -> fila de las tablas
+        self.franja = franja  # segundos por franja
+        self.mediana = mediana
+        self.p90 = p90
+        self.viajes = viajes
+        self.fuente = fuente
+        self.calculado_en = calculado_en
+
+    @classmethod
+    def calcular(cls, viajes, franja_minutos, minimo):
+        franja = franja_minutos * 60
+        franjas = -(-SEGUNDOS_DIA // franja)
+        ruta, dia, salida, llegada = viajes.T
+        duracion = (llegada - salida) % SEGUNDOS_DIA
+        validos = (duracion > 0) & (duracion <= MAX_DURACION)
+        ruta, dia, salida, duracion = ruta[validos], dia[validos], salida[validos], duracion[validos]
+
+        ids, fila = np.unique(ruta, return_inverse=True)
+        cantidad_rutas = len(ids)
+        columna = salida // franja
+        por_dia = _por_grupo((fila * 7 + dia) * franjas + columna, duracion, cantidad_rutas * 7 * franjas)
+        por_franja = _por_grupo(fila * franjas + columna, duracion, cantidad_rutas * franjas)
+        por_ruta = _por_grupo(fila, duracion, cantidad_rutas)
+
+        forma = (cantidad_rutas, 7, franjas)
+        dia_m, dia_p, dia_n = (tabla.reshape(forma) for tabla in por_dia)
+        franja_m, franja_p, franja_n = (np.broadcast_to(tabla.reshape(cantidad_rutas, 1, franjas), forma)
+                                        for tabla in por_franja)
+        ruta_m, ruta_p, ruta_n = (np.broadcast_to(tabla.reshape(cantidad_rutas, 1, 1), forma) for tabla in por_ruta)
+
+        usar_dia = dia_n >= minimo
+        usar_franja = ~usar_dia & (franja_n >= minimo)
+        usar_ruta = ~usar_dia & ~usar_franja
+        elegir = lambda del_dia, de_franja, de_ruta: np.select(
+            [usar_dia, usar_franja], [del_dia, de_franja], de_ruta
+        )
+        return cls(
+            {int(pk): indice for indice, pk in enumerate(ids)}, franja,
+            elegir(dia_m, franja_m, ruta_m).astype(np.float32),
+            elegir(dia_p, franja_p, ruta_p).astype(np.float32),
+            elegir(dia_n, franja_n, ruta_n).astype(np.int32),
+            np.select([usar_dia, usar_franja, usar_ruta], [0, 1, 2]).astype(np.int8),
+            time.time(),
+        )
+
+    def guardar(self, archivo):
+        temporal = f'{archivo}.{os.getpid()}.tmp'
+        with open(temporal, 'wb') as salida:
+            np.savez(
+                salida, rutas=np.array(sorted(self.rutas, key=self.rutas.get), dtype=np.int64),
+                franja=self.franja, mediana=self.mediana, p90=self.p90, viajes=self.viajes,
+                fuente=self.fuente, calculado_en=self.calculado_en,
+            )
+        # Los workers nunca leen un archivo a medio escribir
+        os.replace(temporal, archivo)
+
+    @classmethod
+    def cargar(cls, archivo):
+        with np.load(archivo) as datos:
+            return cls(
+                {int(pk): indice for indice, pk in enumerate(datos['rutas'])}, int(datos['franja']),
+                datos['mediana'], datos['p90'], datos['viajes'], datos['fuente'], float(datos['calculado_en']),
+            )
+
+    def duracion(self, ruta, dia, salida):
+        """`(mediana, p90, viajes, fuente)` de la ruta para una salida, o `None` si no tiene historial"""
+        fila = self.rutas.get(ruta)
+        if fila is None:
+            return None
+        celda = (fila, dia, salida % SEGUNDOS_DIA // self.franja)
+        return (
+            float(self.mediana[celda]), float(self.p90[celda]), int(self.viajes[celda]),
+            FUENTES[self.fuente[celda]],
+        )
+
+
+def calcular_perfiles(hasta=None):
+    """Perfiles con los viajes de los `ETA_DIAS_HISTORIAL` días hasta `hasta` (por defecto hoy)"""
+    hasta = hasta or timezone.localdate()
+    viajes = leer_viajes(hasta - timedelta(days=settings.ETA_DIAS_HISTORIAL - 1), hasta)
+    return Perfiles.calcular(viajes, settings.ETA_FRANJA_MINUTOS, settings.ETA_MINIMO_VIAJES)
+
+
+def cargar_perfiles():
+    """Perfiles de `ETA_ARCHIVO` si existe o calculados de la base"""
+    archivo = settings.ETA_ARCHIVO
+    if archivo and os.path.exists(archivo):
+        return Perfiles.cargar(archivo)
+    return calcular_perfiles()
+
+
+class IndiceETA:
+    """Perfiles y recorridos de las rutas compartidos por el proceso"""
+
+    def __init__(self):
+        # `_lock` protege los atributos y se toma solo para leerlos o
+        # reemplazarlos; los `_lock_*` hacen que un solo hilo lea la base a la vez
+        self._lock = threading.Lock()
+        self._lock_perfiles = threading.Lock()
+        self._lock_recorridos = threading.Lock()
+        self._perfiles = None
+        self._perfiles_en = 0.0
+        self._recalculo = None
+        self._recorridos = None
+        # Suben con cada invalidación: lo leído antes ya no se guarda
+        self._version_perfiles = 0
+        self._version_recorridos = 0
+
+    def invalidar(self):
+        """Recalcular los recorridos (paradas y su orden) en la próxima consulta"""
+        with self._lock:
+            self._recorridos = None
+            self._version_recorridos += 1
+
+    def reiniciar(self):
+        with self._lock:
+            self._perfiles = None
+            self._recorridos = None
+            self._version_perfiles += 1
+            self._version_recorridos += 1
+
+    def perfiles(self):
+        with self._lock:
+            perfiles, version = self._perfiles, self._version_perfiles
+            vencidos = perfiles is not None and time.monotonic() - self._perfiles_en > settings.ETA_MAX_EDAD
+            if vencidos and self._recalculo is None:
+                self._recalculo = threading.Thread(
+                    target=self._recalcular, args=(version,), name='eta', daemon=True
+                )
+                self._recalculo.start()
+        if perfiles is not None:
+            return perfiles
+        # Primera consulta (o después de `reiniciar`): no hay perfiles que servir
+        with self._lock_perfiles:
+            with self._lock:
+                if self._perfiles is not None:
+                    return self._perfiles
+                version = self._version_perfiles
+            perfiles = cargar_perfiles()
+            self._reemplazar_perfiles(perfiles, version)
+            return perfiles
+
+    def _reemplazar_perfiles(self, perfiles, version):
+        with self._lock:
+            if version == self._version_perfiles:
+                self._perfiles = perfiles
+                self._perfiles_en = time.monotonic()
+
+    def _recalcular(self, version):
+        try:
+            with self._lock_perfiles:
+                self._reemplazar_perfiles(cargar_perfiles(), version)
+        except Exception:
+            logger.exception('No se pudieron recalcular los perfiles de ETA')
+            # Se siguen usando los anteriores y se reintenta en `ETA_MAX_EDAD` segundos
+            with self._lock:
+                if version == self._version_perfiles:
+                    self._perfiles_en = time.monotonic()
+        finally:
+            with self._lock:
+                self._recalculo = None
+            connections.close_all()
+
+    def recorridos(self):
+        with self._lock:
+            if self._recorridos is not None:
+                return self._recorridos
+        with self._lock_recorridos:
+            with self._lock:
+                if self._recorridos is not None:
+                    return self._recorridos
+                version = self._version_recorridos
+            recorridos = self._construir_recorridos()
+            with self._lock:
+                if version == self._version_recorridos:
+                    self._recorridos = recorridos
+            return recorridos
+
+    def _construir_recorridos(self):
+        """Por ruta: paradas (id -> orden y fracción del recorrido) y duración de sus horarios"""
+        coordenadas = {
+            pk: (float(latitud), float(longitud))
+            for pk, latitud, longitud in Parada.objects.filter(
+                latitud__isnull=False, longitud__isnull=False
+            ).values_list('pk', 'latitud', 'longitud')
+        }
+        paradas = defaultdict(list)
+        for ruta, parada, orden in RutaParada.objects.order_by('ruta_id', 'orden').values_list(
+            'ruta_id', 'parada_id', 'orden'
+        ):
+            paradas[ruta].append((parada, orden))
+        duraciones = defaultdict(list)
+        for ruta, salida, llegada in Horario.objects.values_list('ruta_id', 'hora_salida', 'hora_llegada'):
+            duraciones[ruta].append((a_segundos(llegada) - a_segundos(salida)) % SEGUNDOS_DIA)
+
+        recorridos = {}
+        for ruta in Ruta.objects.values_list('pk', flat=True):
+            ids = [parada for parada, _ in paradas[ruta]]
+            fracciones = fracciones_recorrido(ids, coordenadas)
+            recorridos[ruta] = {
+                'paradas': {
+                    parada: (orden, fraccion)
+                    for (parada, orden), fraccion in zip(paradas[ruta], fracciones)
+                },
+                'horario': float(np.median(duraciones[ruta])) if duraciones[ruta] else None,
+            }
+        return recorridos
+
+    def estimar(self, ruta, parada, salida, dia):
+        """
+        Llegada a `parada` de un viaje de `ruta` que sale a `salida` (segundos
+        desde medianoche) el día `dia` (0 = lunes). `None` si la ruta no pasa
+        por la parada o no hay con qué estimar.
+        """
+        recorrido = self.recorridos().get(ruta)
+        if recorrido is None or parada not in recorrido['paradas']:
+            return None
+        orden, fraccion = recorrido['paradas'][parada]
+        estimada = self.perfiles().duracion(ruta, dia, salida)
+        if estimada is None:
+            if recorrido['horario'] is None:
+                return None
+            estimada = (recorrido['horario'], recorrido['horario'], 0, 'horario')
+        mediana, p90, viajes, fuente = estimada
+        return {
+            'orden': orden,
+            'fraccion': round(fraccion, 4),
+            'duracion_recorrido': round(mediana),
+            'segundos': round(mediana * fraccion),
+            'segundos_p90': round(p90 * fraccion),
+            'llegada': round(salida + mediana * fraccion),
+            'viajes': viajes,
+            'fuente': fuente,
+        }
+
+
+indice = IndiceETA()
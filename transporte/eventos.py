@@ -0,0 +1,338 @@
+"""
+Eventos en vivo de viajes e incidentes (Server-Sent Events).
+
+Las señales de `Viaje` e `Incidente` publican cada alta, cambio y baja
+(después del commit) en el `Broker` del proceso, que los reparte entre los
+clientes conectados a `GET /api/eventos/` según sus filtros (`linea`, `ruta`,
+`vehiculo`, `tipo`). Cada cliente es una corrutina en el event loop de ASGI
+que espera en su propia cola; con WSGI el endpoint no está disponible porque
+cada conexión abierta ocuparía un hilo.
+
+Un cliente lento no frena a los demás: publicar solo agrega el evento a su
+cola. Mientras el servidor no puede enviarle más (el `send` de ASGI espera a
+que el cliente lea), la cola crece hasta `EVENTOS_MAX_PENDIENTES`; al
+desbordarse se vacía y el cliente recibe un evento `reinicio` para que vuelva
+a consultar el estado por la API y siga desde ahí.
+
+Mientras ningún cliente se suscribió al proceso (con WSGI, siempre) y no hay
+`EVENTOS_DIRECTORIO`, las señales no arman ni publican eventos.
+
+Cada evento lleva un id (`<instancia>-<número>`) y el broker guarda los
+últimos `EVENTOS_HISTORIAL`: un cliente que se reconecta con `Last-Event-ID`
+recibe los que se perdió o, si ya no están (o se conectó a otro proceso),
+un `reinicio`.
+
+Con varios workers, `EVENTOS_DIRECTORIO` reemplaza a un servicio de
+mensajería: cada proceso agrega sus eventos a un archivo propio en ese
+directorio y lee los de los demás cada `EVENTOS_INTERVALO` segundos. Los
+archivos que superan `TAMANIO_ARCHIVO` se reemplazan por uno nuevo y los que
+no se modifican hace `RETENCION_ARCHIVOS` segundos se borran.
+"""
+import asyncio
+import glob
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .models import Ruta, Viaje
+
+TAMANIO_ARCHIVO = 8 * 1024 * 1024
+RETENCION_ARCHIVOS = 60
+TIPOS = ('viaje', 'incidente')
+FILTROS = ('linea', 'ruta', 'vehiculo')
+
+
+def evento_viaje(viaje, accion):
+    try:
+        linea = viaje.ruta.linea_id
+    except Ruta.DoesNotExist:
+        linea = None
+    return {
+        'tipo': 'viaje',
+        'accion': accion,
+        'linea': linea,
+        'ruta': viaje.ruta_id,
+        'vehiculo': viaje.vehiculo_id,
+        'datos': {
+            'id': viaje.pk,
+            'ruta': viaje.ruta_id,
+            'vehiculo': viaje.vehiculo_id,
+            'chofer': viaje.chofer_id,
+            'fecha': viaje.fecha.isoformat(),
+            'hora_salida_real': viaje.hora_salida_real.isoformat() if viaje.hora_salida_real else None,
+            'hora_llegada_real': viaje.hora_llegada_real.isoformat() if viaje.hora_llegada_real else None,
+            'estado': viaje.estado,
+        },
+    }
+
+
+def evento_incidente(incidente, accion):
+    relaciones = None
+    if incidente.viaje_id is not None:
+        relaciones = Viaje.objects.filter(pk=incidente.viaje_id).values_list(
+            'ruta__linea_id', 'ruta_id', 'vehiculo_id'
+        ).first()
+    linea, ruta, vehiculo = relaciones or (None, None, None)
+    return {
+        'tipo': 'incidente',
+        'accion': accion,
+        'linea': linea,
+        'ruta': ruta,
+        'vehiculo': vehiculo,
+        'datos': {
+            'id': incidente.pk,
+            'viaje': incidente.viaje_id,
+            'fecha': incidente.fecha.isoformat() if incidente.fecha else None,
+            'descripcion': incidente.descripcion,
+            'gravedad': incidente.gravedad,
+            'resuelto': incidente.resuelto,
+        },
+    }
+
+
+def formato_sse(evento):
+    datos = {clave: valor for clave, valor in evento.items() if clave not in ('id', 'tipo')}
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+def reinicio_sse(motivo):
+    return f'event: reinicio\ndata: {json.dumps({"motivo": motivo})}\n\n'
+
+
+class Suscripcion:
+    """Cola de eventos de un cliente; se llena desde cualquier hilo y se lee en su event loop"""
+
+    def __init__(self, loop, filtros, tipos):
+        self.loop = loop
+        self.filtros = filtros  # campo -> conjunto de ids aceptados
+        self.tipos = tipos
+        self.maximo = settings.EVENTOS_MAX_PENDIENTES
+        self.pendientes = deque()
+        self.desbordada = False
+        self._aviso = asyncio.Event()
+
+    def acepta(self, evento):
+        return evento['tipo'] in self.tipos and all(
+            evento[campo] in valores for campo, valores in self.filtros.items()
+        )
+
+    def entregar(self, evento):
+        # Corre en el event loop del cliente
+        if len(self.pendientes) >= self.maximo:
+            self.pendientes.clear()
+            self.desbordada = True
+        else:
+            self.pendientes.append(evento)
+        self._aviso.set()
+
+    async def esperar(self, espera):
+        """`(eventos, desbordada)` apenas haya algo, o vacíos al pasar `espera` segundos"""
+        if not self.pendientes and not self.desbordada:
+            self._aviso.clear()
+            try:
+                await asyncio.wait_for(self._aviso.wait(), espera)
+            except asyncio.TimeoutError:
+                pass
+        eventos = list(self.pendientes)
+        self.pendientes.clear()
+        desbordada, self.desbordada = self.desbordada, False
+        return eventos, desbordada
+
+
+def _entregar(suscripciones, evento):
+    for suscripcion in suscripciones:
+        suscripcion.entregar(evento)
+
+
+class Broker:
+    """Reparte los eventos publicados entre las suscripciones del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.instancia = secrets.token_hex(4)
+        self._secuencia = 0
+        self._historial = deque()
+        self._suscripciones = set()
+        # Desde la primera suscripción el historial sirve para las reconexiones
+        self._con_historial = False
+        # (campo, id) -> suscripciones con ese id en el primer campo que filtran;
+        # publicar revisa solo esas y las que no filtran por ningún campo
+        self._indice = {}
+        self._sin_filtros = set()
+        self._archivo = None
+        self._lector = None
+        self._detener = threading.Event()
+
+    def clientes(self):
+        return len(self._suscripciones)
+
+    def escuchado(self):
+        """
+        Si publicar tiene algún efecto: con `EVENTOS_DIRECTORIO` o después de
+        que algún cliente se suscribió a este proceso (aunque ahora no haya
+        ninguno, el que se reconecte necesita los eventos en el historial).
+        """
+        return bool(settings.EVENTOS_DIRECTORIO) or self._con_historial
+
+    def suscribir(self, filtros, tipos, ultimo_id=None):
+        """
+        Registra un cliente en el event loop actual. Devuelve la suscripción y
+        los eventos posteriores a `ultimo_id`, o `None` si no se pueden
+        recuperar (el cliente tiene que reiniciar).
+        """
+        self._iniciar_lector()
+        suscripcion = Suscripcion(asyncio.get_running_loop(), filtros, tipos)
+        with self._lock:
+            self._con_historial = True
+            self._suscripciones.add(suscripcion)
+            for clave in self._claves(suscripcion):
+                self._indice.setdefault(clave, set()).add(suscripcion)
+            if not suscripcion.filtros:
+                self._sin_filtros.add(suscripcion)
+            if ultimo_id is None:
+                return suscripcion, []
+            return suscripcion, self._posteriores(ultimo_id, suscripcion)
+
+    @staticmethod
+    def _claves(suscripcion):
+        campo = next((campo for campo in FILTROS if campo in suscripcion.filtros), None)
+        return [(campo, valor) for valor in suscripcion.filtros.get(campo, ())]
+
+    def _posteriores(self, ultimo_id, suscripcion):
+        instancia, _, numero = ultimo_id.partition('-')
+        if instancia != self.instancia or not numero.isdigit() or int(numero) > self._secuencia:
+            return None
+        numero = int(numero)
+        primero = self._historial[0][0] if self._historial else self._secuencia + 1
+        if numero + 1 < primero:
+            return None
+        return [evento for secuencia, evento in self._historial
+                if secuencia > numero and suscripcion.acepta(evento)]
+
+    def desuscribir(self, suscripcion):
+        with self._lock:
+            if suscripcion not in self._suscripciones:
+                return
+            self._suscripciones.remove(suscripcion)
+            self._sin_filtros.discard(suscripcion)
+            for clave in self._claves(suscripcion):
+                self._indice[clave].discard(suscripcion)
+                if not self._indice[clave]:
+                    del self._indice[clave]
+
+    def publicar(self, evento):
+        """Entrega el evento a los clientes de este proceso y, con `EVENTOS_DIRECTORIO`, a los de los demás"""
+        if settings.EVENTOS_DIRECTORIO:
+            self._escribir(evento)
+        self._distribuir(evento)
+
+    def _distribuir(self, evento):
+        with self._lock:
+            self._secuencia += 1
+            evento = {'id': f'{self.instancia}-{self._secuencia}', **evento}
+            self._historial.append((self._secuencia, evento))
+            while len(self._historial) > settings.EVENTOS_HISTORIAL:
+                self._historial.popleft()
+            candidatas = set(self._sin_filtros)
+            for campo in FILTROS:
+                candidatas.update(self._indice.get((campo, evento[campo]), ()))
+            por_loop = {}
+            for suscripcion in candidatas:
+                if suscripcion.acepta(evento):
+                    por_loop.setdefault(suscripcion.loop, []).append(suscripcion)
+        # Un aviso por event loop y no uno por cliente
+        for loop, suscripciones in por_loop.items():
+            try:
+                loop.call_soon_threadsafe(_entregar, suscripciones, evento)
+            except RuntimeError:
+                # El event loop de esos clientes ya terminó
+                for suscripcion in suscripciones:
+                    self.desuscribir(suscripcion)
+
+    def _escribir(self, evento):
+        linea = json.dumps(evento, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._archivo is None or os.path.getsize(self._archivo) > TAMANIO_ARCHIVO:
+                os.makedirs(settings.EVENTOS_DIRECTORIO, exist_ok=True)
+                self._archivo = os.path.join(
+                    settings.EVENTOS_DIRECTORIO, f'{os.getpid()}-{secrets.token_hex(4)}.jsonl'
+                )
+            # Una sola escritura en modo append: los lectores nunca ven media línea de otra
+            with open(self._archivo, 'a', encoding='utf-8') as salida:
+                salida.write(linea)
+
+    def _iniciar_lector(self):
+        with self._lock:
+            if self._lector is None and settings.EVENTOS_DIRECTORIO:
+                directorio = settings.EVENTOS_DIRECTORIO
+                # Los archivos que ya existen se leen desde el final; los nuevos, completos
+                posiciones = {
+                    archivo: os.path.getsize(archivo)
+                    for archivo in glob.glob(os.path.join(directorio, '*.jsonl'))
+                }
+                self._lector = threading.Thread(
+                    target=self._leer, args=(directorio, posiciones), name='eventos', daemon=True
+                )
+                self._lector.start()
+
+    def detener(self):
+        """Termina la lectura de los archivos de los otros procesos"""
+        with self._lock:
+            lector, self._lector = self._lector, None
+        if lector is not None:
+            self._detener.set()
+            lector.join()
+            self._detener = threading.Event()
+
+    def _leer(self, directorio, posiciones):
+        """Reparte los eventos que los otros procesos agregan a sus archivos"""
+        detener = self._detener
+        while not detener.wait(settings.EVENTOS_INTERVALO):
+            limite = time.time() - RETENCION_ARCHIVOS
+            for archivo in glob.glob(os.path.join(directorio, '*.jsonl')):
+                if archivo == self._archivo:
+                    continue
+                try:
+                    if os.path.getmtime(archivo) < limite:
+                        os.remove(archivo)
+                        posiciones.pop(archivo, None)
+                        continue
+                    with open(archivo, 'rb') as entrada:
+                        entrada.seek(posiciones.get(archivo, 0))
+                        contenido = entrada.read()
+                except OSError:
+                    # Borrado por otro proceso mientras se leía
+                    posiciones.pop(archivo, None)
+                    continue
+                completo = contenido[:contenido.rfind(b'\n') + 1]
+                posiciones[archivo] = posiciones.get(archivo, 0) + len(completo)
+                for linea in completo.splitlines():
+                    try:
+                        self._distribuir(json.loads(linea))
+                    except ValueError:
+                        continue
+
+
+broker = Broker()
+
+
+async def flujo_sse(suscripcion, anteriores):
+    """Cuerpo de la respuesta: eventos a medida que llegan, con un comentario de latido si no hay"""
+    try:
+        yield f'retry: {settings.EVENTOS_REINTENTO_MS}\n\n'
+        if anteriores is None:
+            yield reinicio_sse('historial')
+        elif anteriores:
+            yield ''.join(formato_sse(evento) for evento in anteriores)
+        while True:
+            eventos, desbordada = await suscripcion.esperar(settings.EVENTOS_LATIDO)
+            partes = [reinicio_sse('desborde')] if desbordada else []
+            partes.extend(formato_sse(evento) for evento in eventos)
+            yield ''.join(partes) or ': latido\n\n'
+    finally:
+        broker.desuscribir(suscripcion)
@@ -0,0 +1,143 @@
+"""
+Representaciones anidadas bajo demanda (`?expand=`).
+
+Los bloques anidados de los serializers (`viaje_detalle`, `paradas`, ...) solo
+se incluyen cuando el cliente los pide, p. ej. `?expand=viaje.ruta,tarjeta`.
+El nombre a expandir es el del campo sin el sufijo `_detalle` y los niveles se
+separan con punto. A partir del mismo árbol se planifican los `select_related`
+y `prefetch_related` necesarios, así cada nivel pedido cuesta una consulta y
+los no pedidos no cuestan ninguna.
+"""
+from functools import lru_cache
+
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+EXPAND_PARAM = 'expand'
+SUFIJO_DETALLE = '_detalle'
+
+
+def parsear_expansion(valor):
+    """Convierte `viaje.ruta,tarjeta` en `{'viaje': {'ruta': {}}, 'tarjeta': {}}`"""
+    arbol = {}
+    for ruta in (valor or '').split(','):
+        nodo = arbol
+        for nombre in ruta.strip().split('.'):
+            if not nombre:
+                break
+            nodo = nodo.setdefault(nombre, {})
+    return arbol
+
+
+def arbol_expansion(request):
+    if request is None:
+        return {}
+    return parsear_expansion(request.query_params.get(EXPAND_PARAM))
+
+
+def nombre_expansion(field_name):
+    if field_name.endswith(SUFIJO_DETALLE):
+        return field_name[:-len(SUFIJO_DETALLE)]
+    return field_name
+
+
+def campos_expandibles(serializer_class):
+    """Campos anidados declarados en el serializer, indexados por su nombre de expansión"""
+    return {
+        nombre_expansion(nombre): (nombre, campo)
+        for nombre, campo in serializer_class._declared_fields.items()
+        if isinstance(campo, serializers.BaseSerializer)
+    }
+
+
+def _serializer_hijo(campo):
+    if isinstance(campo, serializers.ListSerializer):
+        return campo.child
+    return campo
+
+
+@lru_cache(maxsize=None)
+def nombres_totales(modelo):
+    """Nombres de las anotaciones que agrega `con_totales()` en el manager del modelo"""
+    queryset = modelo._default_manager.all()
+    if not hasattr(queryset, 'con_totales'):
+        return frozenset()
+    return frozenset(queryset.con_totales().query.annotations)
+
+
+def anotar_totales(queryset, campos):
+    """Aplica `con_totales()` solo si alguno de los `campos` serializados es un total"""
+    if nombres_totales(queryset.model) & set(campos):
+        queryset = queryset.con_totales()
+    return queryset
+
+
+def planificar_expansion(queryset, serializer_class, arbol, campos=None):
+    """
+    Agrega al queryset las cargas que necesita `serializer_class` para el árbol
+    de expansión dado y, si se indican, solo para los `campos` pedidos. Los
+    totales se anotan únicamente cuando se serializan. Las claves forward hacia
+    modelos sin totales ni niveles internos se resuelven con `select_related`;
+    el resto con un `Prefetch` cuyo queryset se planifica recursivamente.
+    """
+    if campos is None:
+        campos = serializer_class.Meta.fields
+    queryset = anotar_totales(queryset, campos)
+    expandibles = campos_expandibles(serializer_class)
+    for nombre, subarbol in arbol.items():
+        if nombre not in expandibles or expandibles[nombre][0] not in campos:
+            continue
+        _, campo = expandibles[nombre]
+        hijo = type(_serializer_hijo(campo))
+        relacion = queryset.model._meta.get_field(campo.source)
+        if relacion.many_to_one and not subarbol and not nombres_totales(relacion.related_model):
+            queryset = queryset.select_related(campo.source)
+            continue
+        interno = planificar_expansion(relacion.related_model._default_manager.all(), hijo, subarbol)
+        queryset = queryset.prefetch_related(Prefetch(campo.source, queryset=interno))
+    return queryset
+
+
+class ExpansionSerializerMixin:
+    """
+    Quita de la representación los serializers anidados que no fueron pedidos.
+    El serializer raíz lee el árbol de `?expand=` (o del argumento `expand`) y
+    le pasa a cada hijo su subárbol.
+    """
+
+    def __init__(self, *args, **kwargs):
+        expand = kwargs.pop('expand', None)
+        if isinstance(expand, str):
+            expand = parsear_expansion(expand)
+        self._expansion = expand
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        arbol = self._expansion
+        if arbol is None:
+            arbol = arbol_expansion(self.context.get('request'))
+        for nombre, (field_name, _) in campos_expandibles(type(self)).items():
+            if nombre not in arbol:
+                fields.pop(field_name, None)
+            elif field_name in fields:
+                _serializer_hijo(fields[field_name])._expansion = arbol[nombre]
+        return fields
+
+
+class ExpansionViewSetMixin:
+    """Planifica el queryset del viewset según el `?expand=` de la request"""
+
+    def get_queryset(self):
+        return self.expandir(super().get_queryset())
+
+    def expandir(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        return planificar_expansion(
+            queryset, serializer_class, arbol_expansion(self.request),
+            self.campos_pedidos(serializer_class)
+        )
+
+    def campos_pedidos(self, serializer_class):
+        """Campos que se van a serializar; `None` significa todos"""
+        return None
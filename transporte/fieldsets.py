@@ -0,0 +1,125 @@
+"""
+Fieldsets dispersos (`?fields=` / `?omit=`).
+
+`?fields=id,numero,saldo` limita la representación a esos campos y
+`?omit=total_boletos` quita los indicados. La selección aplica al serializer
+raíz y además se traslada al queryset: solo se traen las columnas que esos
+campos necesitan (`.only()`), no se anotan totales que no se muestran y no se
+planifican expansiones de campos omitidos.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+from .expansion import ExpansionSerializerMixin, ExpansionViewSetMixin, nombres_totales
+from .instrumentacion import medir_serializacion
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def _lista(valor):
+    return [nombre.strip() for nombre in (valor or '').split(',') if nombre.strip()]
+
+
+def seleccionar_campos(disponibles, fields=None, omit=None):
+    """Filtra `disponibles` (en su orden) según las listas `fields` y `omit`"""
+    fields, omit = _lista(fields), set(_lista(omit))
+    return [
+        nombre for nombre in disponibles
+        if (not fields or nombre in fields) and nombre not in omit
+    ]
+
+
+def campos_de_request(request, disponibles):
+    """Selección pedida en la request, o `None` si no se restringió ningún campo"""
+    if request is None:
+        return None
+    fields = request.query_params.get(FIELDS_PARAM)
+    omit = request.query_params.get(OMIT_PARAM)
+    if not fields and not omit:
+        return None
+    return seleccionar_campos(disponibles, fields, omit)
+
+
+def columnas_necesarias(serializer_class, campos):
+    """
+    Columnas del modelo que hacen falta para serializar `campos`, o `None` si
+    no se pueden determinar (p. ej. un `SerializerMethodField` que no declara
+    en `Meta.campos_requeridos` qué columnas lee).
+    """
+    modelo = serializer_class.Meta.model
+    requeridos = getattr(serializer_class.Meta, 'campos_requeridos', {})
+    declarados = serializer_class._declared_fields
+    columnas = {modelo._meta.pk.name}
+    for nombre in campos:
+        if nombre in nombres_totales(modelo):
+            continue
+        if nombre in requeridos:
+            columnas.update(requeridos[nombre])
+            continue
+        campo = declarados.get(nombre)
+        fuente = nombre if campo is None else (campo.source or nombre)
+        if fuente == '*':
+            return None
+        try:
+            campo_modelo = modelo._meta.get_field(fuente.split('.')[0])
+        except FieldDoesNotExist:
+            return None
+        if campo_modelo.concrete:
+            columnas.add(campo_modelo.name)
+    return columnas
+
+
+class FieldsetSerializerMixin(ExpansionSerializerMixin):
+    """
+    Recorta los campos del serializer raíz según `?fields=`/`?omit=` o los
+    argumentos `fields`/`omit`. Los serializers anidados no se recortan.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._fieldset = (kwargs.pop('fields', None), kwargs.pop('omit', None))
+        super().__init__(*args, **kwargs)
+
+    def _es_raiz(self):
+        padre = self.parent
+        if isinstance(padre, serializers.ListSerializer):
+            padre = padre.parent
+        return padre is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._es_raiz():
+            return fields
+        if any(self._fieldset):
+            seleccion = seleccionar_campos(fields, *self._fieldset)
+        else:
+            seleccion = campos_de_request(self.context.get('request'), list(fields))
+        if seleccion is None:
+            return fields
+        for nombre in list(fields):
+            if nombre not in seleccion:
+                fields.pop(nombre)
+        return fields
+
+    def to_representation(self, instance):
+        # Los anidados quedan dentro del tiempo de su raíz
+        with medir_serializacion():
+            return super().to_representation(instance)
+
+
+class FieldsetViewSetMixin(ExpansionViewSetMixin):
+    """Planifica el queryset con la selección de campos y poda las columnas en los GET"""
+
+    def campos_pedidos(self, serializer_class):
+        return campos_de_request(self.request, serializer_class.Meta.fields)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer_class = self.get_serializer_class()
+        campos = self.campos_pedidos(serializer_class)
+        if campos is None or self.request.method != 'GET':
+            return queryset
+        columnas = columnas_necesarias(serializer_class, campos)
+        if columnas is not None:
+            queryset = queryset.only(*columnas)
+        return queryset
@@ -0,0 +1,222 @@
+"""
+Instrumentación de consultas por solicitud.
+
+`InstrumentacionMiddleware` envuelve la ejecución de SQL de todas las
+conexiones durante la solicitud y registra cantidad de consultas, tiempo en
+la base, tiempo de serialización (serializers raíz y renderizado, sin las
+consultas que disparan) y la huella de cada consulta (el SQL sin valores).
+El resultado sale en el encabezado `Server-Timing` y en una línea JSON del
+logger `transporte.instrumentacion`, y se acumula en las métricas
+(`transporte.metricas`) por vista y acción.
+
+Una huella repetida más de `CONSULTAS_REPETIDAS_MAXIMO` veces en una
+solicitud suele ser un N+1 (una consulta por fila en un serializer anidado).
+Con `CONSULTAS_REPETIDAS_ERROR` (por defecto en DEBUG y en los tests) la
+solicitud falla con `ConsultasRepetidas`; si no, se registra una advertencia.
+Las vistas que repiten consultas a propósito (p. ej. un lote que actualiza
+una fila por elemento) declaran `consultas_repetidas_maximo`, como atributo
+o en el `@action` que las repite.
+
+Las respuestas en streaming ejecutan sus consultas después del middleware y
+no se cuentan.
+
+La medición de la solicitud vive en una `ContextVar` y cada conexión tiene
+instalado desde que se abre (`connection_created`) un wrapper que la consulta.
+Así también se miden las consultas que el ORM asíncrono ejecuta en otro hilo
+(`sync_to_async` copia el contexto) y el middleware funciona igual con WSGI y
+con ASGI, sin pasar a un hilo para instalar nada.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metricas import registro as registro_metricas
+
+logger = logging.getLogger(__name__)
+
+_medicion = ContextVar('medicion_consultas', default=None)
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTAS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+# Sentencias de control de transacciones: se repiten sin ser un N+1
+_CONTROL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT', 'ROLLBACK')
+# Cabecera `X-Cache` de la cache de respuestas -> resultado en las métricas
+CACHE = {'HIT': 'acierto', 'MISS': 'fallo'}
+
+
+class ConsultasRepetidas(Exception):
+    pass
+
+
+def huella(sql):
+    """El SQL sin valores literales ni largo de las listas `IN`, con espacios normalizados"""
+    sql = _LITERALES.sub('?', sql.replace('%s', '?'))
+    return ' '.join(_LISTAS.sub('(...)', sql).split())
+
+
+class Medicion:
+    """Consultas y tiempos de una solicitud; también es el execute wrapper de las conexiones"""
+
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo_db = 0.0
+        self.tiempo_serializacion = 0.0
+        self.huellas = Counter()
+        self._serializando = False
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tiempo_db += time.perf_counter() - inicio
+            self.consultas += 1
+            if not sql.lstrip().upper().startswith(_CONTROL):
+                self.huellas[huella(sql)] += 1
+
+    def repetidas(self, maximo):
+        return [(sql, veces) for sql, veces in self.huellas.most_common() if veces > maximo]
+
+
+def _registrar_consulta(execute, sql, params, many, context):
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    return medicion(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def instalar_medicion(sender, connection, **kwargs):
+    # Al principio de la lista: `execute_wrapper()` quita el último al salir y
+    # la conexión puede abrirse dentro de uno
+    if _registrar_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _registrar_consulta)
+
+
+@contextmanager
+def medir_serializacion():
+    """Suma al tiempo de serialización de la solicitud el del bloque, sin sus consultas"""
+    medicion = _medicion.get()
+    if medicion is None or medicion._serializando:
+        yield
+        return
+    medicion._serializando = True
+    inicio, db = time.perf_counter(), medicion.tiempo_db
+    try:
+        yield
+    finally:
+        medicion._serializando = False
+        medicion.tiempo_serializacion += time.perf_counter() - inicio - (medicion.tiempo_db - db)
+
+
+class InstrumentacionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Con hooks síncronos Django pasaría a un hilo antes de cada vista
+            self.process_view = self._aprocess_view
+            self.process_template_response = self._aprocess_template_response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        medicion = Medicion()
+        token = _medicion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicion.reset(token)
+        return self.terminar(request, response, medicion, time.perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        medicion = Medicion()
+        token = _medicion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicion.reset(token)
+        return self.terminar(request, response, medicion, time.perf_counter() - inicio)
+
+    def terminar(self, request, response, medicion, total):
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={medicion.tiempo_db * 1000:.1f};desc="{medicion.consultas} consultas"',
+            f'serializacion;dur={medicion.tiempo_serializacion * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        maximo = getattr(request, 'consultas_repetidas_maximo', settings.CONSULTAS_REPETIDAS_MAXIMO)
+        repetidas = medicion.repetidas(maximo)
+        registro = {
+            'metodo': request.method,
+            'ruta': request.path,
+            'estado': response.status_code,
+            'consultas': medicion.consultas,
+            'db_ms': round(medicion.tiempo_db * 1000, 2),
+            'serializacion_ms': round(medicion.tiempo_serializacion * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'repetidas': [{'sql': sql, 'veces': veces} for sql, veces in repetidas],
+        }
+        logger.log(
+            logging.WARNING if repetidas else logging.INFO,
+            json.dumps(registro, ensure_ascii=False), extra={'instrumentacion': registro},
+        )
+        vista, accion = getattr(request, 'metricas_vista', ('sin_ruta', request.method.lower()))
+        registro_metricas.registrar(
+            vista, accion, request.method, response.status_code, total,
+            None if response.streaming else len(response.content),
+            medicion.consultas, medicion.tiempo_db, CACHE.get(response.get('X-Cache')),
+        )
+        if repetidas and settings.CONSULTAS_REPETIDAS_ERROR:
+            sql, veces = repetidas[0]
+            raise ConsultasRepetidas(
+                f'{request.method} {request.path} ejecutó {veces} veces (máximo {maximo}): {sql}'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Las vistas de DRF exponen su clase en `cls`; las de los viewsets, su
+        # basename y las acciones por método
+        vista = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        initkwargs = getattr(view_func, 'initkwargs', {})
+        maximo = initkwargs.get('consultas_repetidas_maximo', getattr(vista, 'consultas_repetidas_maximo', None))
+        if maximo is not None:
+            request.consultas_repetidas_maximo = maximo
+        metodo = request.method.lower()
+        basename = initkwargs.get('basename')
+        acciones = getattr(view_func, 'actions', None)
+        if basename and acciones:
+            request.metricas_vista = (basename, acciones.get(metodo, metodo))
+        else:
+            request.metricas_vista = (request.resolver_match.url_name or view_func.__name__, metodo)
+
+    def process_template_response(self, request, response):
+        # Las respuestas de DRF se renderizan después de este hook
+        medicion = _medicion.get()
+        if medicion is not None:
+            inicio, db = time.perf_counter(), medicion.tiempo_db
+
+            def renderizada(response):
+                medicion.tiempo_serializacion += time.perf_counter() - inicio - (medicion.tiempo_db - db)
+
+            response.add_post_render_callback(renderizada)
+        return response
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return type(self).process_view(self, request, view_func, view_args, view_kwargs)
+
+    async def _aprocess_template_response(self, request, response):
+        return type(self).process_template_response(self, request, response)
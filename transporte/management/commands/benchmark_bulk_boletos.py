@@ -0,0 +1,86 @@
+import json
+import random
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIClient
+
+from transporte.models import Linea, Ruta, Parada, Vehiculo, Chofer, Viaje, Tarjeta
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Mide toques/segundo de /api/boletos/bulk/ frente a un POST por boleto'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--toques', type=int, default=10000, help='Toques por lote')
+        parser.add_argument('--tarjetas', type=int, default=2000)
+        parser.add_argument('--individuales', type=int, default=200, help='Toques enviados de a uno')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                cliente, toques = self.preparar(options)
+                self.medir_individual(cliente, toques[:options['individuales']])
+                self.medir_bulk(cliente, toques, 'application/json')
+                self.medir_bulk(cliente, toques, 'application/x-ndjson')
+                raise Rollback
+        except Rollback:
+            pass
+
+    def preparar(self, options):
+        linea = Linea.objects.create(numero=990003, nombre='Benchmark bulk')
+        ruta = Ruta.objects.create(linea=linea, nombre='Benchmark bulk')
+        paradas = Parada.objects.bulk_create(
+            Parada(nombre=f'Parada {i}', direccion=f'Calle {i}') for i in range(30)
+        )
+        vehiculo = Vehiculo.objects.create(patente='BENCH03', capacidad=40)
+        chofer = Chofer.objects.create(
+            nombre='Bench', apellido='Bulk', dni='BENCH03', licencia='D1',
+            fecha_contratacion=date(2024, 1, 1)
+        )
+        viaje = Viaje.objects.create(ruta=ruta, vehiculo=vehiculo, chofer=chofer, fecha=date.today())
+        tarjetas = Tarjeta.objects.bulk_create(
+            Tarjeta(numero=f'BULK{i:08d}', tipo='normal', saldo=Decimal('100000'))
+            for i in range(options['tarjetas'])
+        )
+        usuario = User.objects.create_user(username='benchmark-bulk')
+        cliente = APIClient()
+        cliente.force_authenticate(usuario)
+        toques = [
+            {
+                'viaje': viaje.pk,
+                'tarjeta': random.choice(tarjetas).pk,
+                'parada_subida': random.choice(paradas).pk,
+                'monto': '1.25',
+            }
+            for _ in range(options['toques'])
+        ]
+        return cliente, toques
+
+    def medir_individual(self, cliente, toques):
+        inicio = time.perf_counter()
+        for toque in toques:
+            cliente.post('/api/boletos/', toque, format='json')
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(f'{"POST individual":<28} toques={len(toques):<7} toques/s={len(toques) / duracion:10.1f}')
+
+    def medir_bulk(self, cliente, toques, content_type):
+        if content_type == 'application/json':
+            cuerpo = json.dumps(toques)
+        else:
+            cuerpo = '\n'.join(json.dumps(toque) for toque in toques)
+        inicio = time.perf_counter()
+        response = cliente.post('/api/boletos/bulk/', cuerpo, content_type=content_type)
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(
+            f'{"bulk " + content_type:<28} toques={len(toques):<7} toques/s={len(toques) / duracion:10.1f} '
+            f'creados={response.data["creados"]}'
+        )
@@ -0,0 +1,98 @@
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from transporte.models import Linea, Ruta, Vehiculo, Chofer, Viaje, Tarjeta, Boleto
+from transporte.serializers import BoletoSerializer
+
+
+class BoletoSerializerAnterior(BoletoSerializer):
+    """Cobro previo: lectura, resta en memoria y `save()` de la fila completa"""
+
+    def create(self, validated_data):
+        tarjeta = validated_data.get('tarjeta')
+        monto = validated_data.get('monto')
+        if tarjeta:
+            tarjeta.saldo -= monto
+            tarjeta.save()
+        return super(BoletoSerializer, self).create(validated_data)
+
+
+class Command(BaseCommand):
+    help = 'Compara el cobro de boletos concurrente sobre una misma tarjeta (anterior vs UPDATE condicional)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=16)
+        parser.add_argument('--boletos', type=int, default=50, help='Boletos por hilo')
+        parser.add_argument('--monto', default='1.00')
+
+    def handle(self, *args, **options):
+        monto = Decimal(options['monto'])
+        total = options['hilos'] * options['boletos']
+        # El saldo alcanza para la mitad de los intentos: también se mide el rechazo
+        saldo_inicial = monto * (total // 2)
+        for nombre, serializer_class in [
+            ('anterior', BoletoSerializerAnterior),
+            ('update condicional', BoletoSerializer),
+        ]:
+            viaje, tarjeta = self.preparar(saldo_inicial)
+            try:
+                duracion, errores = self.ejecutar(serializer_class, viaje, tarjeta, monto, options)
+                tarjeta.refresh_from_db()
+                emitidos = Boleto.objects.filter(tarjeta=tarjeta).count()
+                esperado = saldo_inicial - monto * emitidos
+                self.stdout.write(
+                    f'{nombre:<20} emitidos={emitidos:<6} saldo_final={tarjeta.saldo:<10} '
+                    f'saldo_esperado={esperado:<10} correcto={tarjeta.saldo == esperado and tarjeta.saldo >= 0} '
+                    f'errores_db={errores:<4} intentos/s={total / duracion:8.1f} '
+                    f'boletos/s={emitidos / duracion:8.1f}'
+                )
+            finally:
+                viaje.ruta.linea.delete()
+                viaje.vehiculo.delete()
+                viaje.chofer.delete()
+                tarjeta.delete()
+
+    def preparar(self, saldo):
+        linea = Linea.objects.create(numero=990002, nombre='Benchmark cobro')
+        ruta = Ruta.objects.create(linea=linea, nombre='Benchmark cobro')
+        vehiculo = Vehiculo.objects.create(patente='BENCH02', capacidad=40)
+        chofer = Chofer.objects.create(
+            nombre='Bench', apellido='Cobro', dni='BENCH02', licencia='D1',
+            fecha_contratacion=date(2024, 1, 1)
+        )
+        viaje = Viaje.objects.create(ruta=ruta, vehiculo=vehiculo, chofer=chofer, fecha=date.today())
+        tarjeta = Tarjeta.objects.create(numero='BENCH-COBRO', tipo='normal', saldo=saldo)
+        return viaje, tarjeta
+
+    def ejecutar(self, serializer_class, viaje, tarjeta, monto, options):
+        errores = []
+        barrera = threading.Barrier(options['hilos'])
+
+        def trabajar():
+            barrera.wait()
+            try:
+                for _ in range(options['boletos']):
+                    serializer = serializer_class(data={
+                        'viaje': viaje.pk, 'tarjeta': tarjeta.pk, 'monto': str(monto)
+                    })
+                    try:
+                        if serializer.is_valid():
+                            serializer.save()
+                    except Exception as exc:
+                        if not hasattr(exc, 'detail'):
+                            errores.append(exc)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajar) for _ in range(options['hilos'])]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return time.perf_counter() - inicio, len(errores)
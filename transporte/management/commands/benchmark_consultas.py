@@ -0,0 +1,263 @@
+import json
+import random
+import statistics
+import time
+from datetime import date, datetime, time as hora, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from transporte.models import (
+    Linea, Parada, Ruta, RutaParada, Vehiculo, Chofer, Horario, Viaje, Tarjeta,
+    Boleto, Mantenimiento, Incidente
+)
+from transporte.views import (
+    BoletoViewSet, HorarioViewSet, IncidenteViewSet, MantenimientoViewSet, ViajeViewSet
+)
+
+# (recurso, viewset, parámetros del listado); '{viaje}' y similares se
+# reemplazan por valores que existen en la base
+ESCENARIOS = [
+    ('viajes', ViajeViewSet, {}),
+    ('viajes', ViajeViewSet, {'estado': 'en_curso'}),
+    ('viajes', ViajeViewSet, {'fecha': '{fecha}'}),
+    ('viajes', ViajeViewSet, {'ruta': '{ruta}'}),
+    ('boletos', BoletoViewSet, {}),
+    ('boletos', BoletoViewSet, {'viaje': '{viaje}'}),
+    ('boletos', BoletoViewSet, {'tarjeta': '{tarjeta}'}),
+    ('incidentes', IncidenteViewSet, {}),
+    ('incidentes', IncidenteViewSet, {'resuelto': 'false'}),
+    ('incidentes', IncidenteViewSet, {'resuelto': 'false', 'gravedad': 'alta'}),
+    ('mantenimientos', MantenimientoViewSet, {}),
+    ('mantenimientos', MantenimientoViewSet, {'vehiculo': '{vehiculo}'}),
+    ('horarios', HorarioViewSet, {'ruta': '{ruta}'}),
+]
+ESTADOS = ('finalizado',) * 17 + ('cancelado', 'en_curso', 'programado')
+GRAVEDADES = ('baja', 'media', 'alta')
+
+
+def nodos_postgres(plan):
+    """Nodos del plan de PostgreSQL resumidos como 'Index Scan using idx on tabla'"""
+    nodo = plan['Node Type']
+    if 'Index Name' in plan:
+        nodo += f" using {plan['Index Name']}"
+    if 'Relation Name' in plan:
+        nodo += f" on {plan['Relation Name']}"
+    yield nodo
+    for hijo in plan.get('Plans', []):
+        yield from nodos_postgres(hijo)
+
+
+def explicar(sql):
+    """`(plan completo, resumen)` de una consulta ya interpolada"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return plan, list(nodos_postgres(plan[0]['Plan']))
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        filas = cursor.fetchall()
+        return [fila[-1] for fila in filas], [fila[-1] for fila in filas]
+
+
+def recorre_tabla(nodo):
+    """Si el nodo lee una tabla completa sin índice u ordena en memoria"""
+    if nodo.startswith('SCAN '):
+        return ' USING ' not in nodo
+    return nodo.startswith(('Seq Scan', 'Sort', 'Incremental Sort')) or (
+        nodo.startswith('USE TEMP B-TREE') and 'ORDER BY' in nodo
+    )
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide latencia y planes (EXPLAIN) de las consultas de los listados con sus filtros y orden; '
+        'con --comparar informa regresiones contra un resultado guardado'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poblar', type=int, default=0,
+            help='Genera esta cantidad de viajes sintéticos (con boletos e incidentes) y los descarta al terminar'
+        )
+        parser.add_argument('--repeticiones', type=int, default=10)
+        parser.add_argument('--guardar', help='Archivo JSON donde guardar el resultado')
+        parser.add_argument('--comparar', help='Resultado guardado contra el cual buscar regresiones')
+        parser.add_argument(
+            '--tolerancia', type=float, default=0.5,
+            help='Aumento relativo de la mediana que se considera regresión (0.5 = 50%%)'
+        )
+        parser.add_argument('--planes', action='store_true', help='Muestra el plan de cada consulta')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['poblar']:
+                    self.poblar(options['poblar'])
+                resultado = self.medir_todo(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options['guardar']:
+            with open(options['guardar'], 'w', encoding='utf-8') as archivo:
+                json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as archivo:
+                base = json.load(archivo)
+            regresiones = self.comparar(base, resultado, options['tolerancia'])
+            if regresiones:
+                raise CommandError('Regresiones:\n' + '\n'.join(regresiones))
+            self.stdout.write(self.style.SUCCESS('Sin regresiones'))
+
+    def poblar(self, cantidad):
+        aleatorio = random.Random(1)
+        inicio = time.perf_counter()
+        lineas = Linea.objects.bulk_create(
+            Linea(numero=990200 + i, nombre=f'Benchmark {i}') for i in range(10)
+        )
+        rutas = Ruta.objects.bulk_create(Ruta(linea=linea, nombre=f'Benchmark {linea.numero}') for linea in lineas)
+        paradas = Parada.objects.bulk_create(
+            Parada(nombre=f'Parada {i}', direccion=f'Calle {i}') for i in range(200)
+        )
+        RutaParada.objects.bulk_create(
+            RutaParada(ruta=ruta, parada=parada, orden=orden)
+            for ruta in rutas for orden, parada in enumerate(aleatorio.sample(paradas, 20))
+        )
+        Horario.objects.bulk_create(
+            Horario(ruta=ruta, hora_salida=hora(h, m), hora_llegada=hora(h + 1, m), dias_semana='L,M,X,J,V')
+            for ruta in rutas for h in range(5, 23) for m in (0, 20, 40)
+        )
+        vehiculos = Vehiculo.objects.bulk_create(
+            Vehiculo(patente=f'BCH{i:04d}', capacidad=40) for i in range(50)
+        )
+        choferes = Chofer.objects.bulk_create(
+            Chofer(nombre='Bench', apellido=f'C{i}', dni=f'BCH{i:05d}', licencia='D1',
+                   fecha_contratacion=date(2024, 1, 1))
+            for i in range(50)
+        )
+        Mantenimiento.objects.bulk_create(
+            Mantenimiento(vehiculo=vehiculo, tipo='preventivo', descripcion='Service',
+                          fecha=date(2025, 1, 1) + timedelta(days=30 * i))
+            for vehiculo in vehiculos for i in range(12)
+        )
+        tarjetas = Tarjeta.objects.bulk_create(
+            Tarjeta(numero=f'BCH{i:09d}', tipo='normal', saldo=Decimal('100')) for i in range(cantidad)
+        )
+
+        hoy = timezone.localdate()
+        for desde in range(0, cantidad, 5000):
+            viajes = Viaje.objects.bulk_create(
+                Viaje(
+                    ruta=aleatorio.choice(rutas), vehiculo=aleatorio.choice(vehiculos),
+                    chofer=aleatorio.choice(choferes), fecha=hoy - timedelta(days=aleatorio.randrange(90)),
+                    hora_salida_real=hora(aleatorio.randrange(5, 23), aleatorio.randrange(60)),
+                    estado=aleatorio.choice(ESTADOS),
+                )
+                for _ in range(desde, min(desde + 5000, cantidad))
+            )
+            boletos = []
+            for viaje in viajes:
+                salida = timezone.make_aware(datetime.combine(viaje.fecha, viaje.hora_salida_real))
+                boletos += [
+                    Boleto(viaje=viaje, tarjeta=aleatorio.choice(tarjetas), monto=Decimal('10'),
+                           fecha_compra=salida + timedelta(minutes=i))
+                    for i in range(20)
+                ]
+            Boleto.objects.bulk_create(boletos, batch_size=5000)
+            Incidente.objects.bulk_create(
+                Incidente(viaje=viaje, descripcion='Demora', gravedad=aleatorio.choice(GRAVEDADES),
+                          resuelto=aleatorio.random() > 0.05)
+                for viaje in viajes[::20]
+            )
+        with connection.cursor() as cursor:
+            # Estadísticas para el planificador sobre las filas recién insertadas
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'{cantidad} viajes generados en {time.perf_counter() - inicio:.1f} s')
+
+    def valores(self):
+        viaje = Viaje.objects.order_by('-pk').first()
+        if viaje is None:
+            raise CommandError('No hay viajes: cargar datos o usar --poblar')
+        return {
+            'viaje': viaje.pk,
+            'fecha': viaje.fecha.isoformat(),
+            'ruta': viaje.ruta_id,
+            'tarjeta': Boleto.objects.filter(viaje=viaje).values_list('tarjeta_id', flat=True).first(),
+            'vehiculo': viaje.vehiculo_id,
+        }
+
+    def medir_todo(self, options):
+        valores = self.valores()
+        resultado = {'motor': connection.vendor, 'escenarios': {}}
+        for recurso, viewset, params in ESCENARIOS:
+            params = {nombre: str(valor).format(**valores) for nombre, valor in params.items()}
+            nombre = recurso + ''.join(f'?{clave}' if i == 0 else f'&{clave}' for i, clave in enumerate(params))
+            tiempos, consultas = self.medir(recurso, viewset, params, options['repeticiones'])
+            planes = []
+            for sql, _ in consultas:
+                completo, resumen = explicar(sql)
+                planes.append(resumen)
+                if options['planes']:
+                    self.stdout.write(f'  {sql}\n  ' + json.dumps(completo, indent=2, ensure_ascii=False))
+            resultado['escenarios'][nombre] = {
+                'consultas': len(consultas),
+                'mediana_ms': round(statistics.median(tiempos), 2),
+                'maximo_ms': round(max(tiempos), 2),
+                'consultas_ms': [duracion for _, duracion in consultas],
+                'planes': planes,
+            }
+            recorridos = sorted({nodo for plan in planes for nodo in plan if recorre_tabla(nodo)})
+            self.stdout.write(
+                f'{nombre:<40} consultas={len(consultas):<3} mediana={statistics.median(tiempos):8.2f} ms '
+                f'máximo={max(tiempos):8.2f} ms consulta más lenta={max(duracion for _, duracion in consultas):8.2f} ms'
+                + (f"  [{'; '.join(recorridos)}]" if recorridos else '')
+            )
+        return resultado
+
+    def medir(self, recurso, viewset, params, repeticiones):
+        # Sin la cache de respuestas: se miden las consultas
+        initkwargs = {'acciones_cache': ()} if hasattr(viewset, 'acciones_cache') else {}
+        vista = viewset.as_view({'get': 'list'}, **initkwargs)
+        tiempos = []
+        for _ in range(repeticiones):
+            request = APIRequestFactory().get(f'/api/{recurso}/', params)
+            with CaptureQueriesContext(connection) as ctx:
+                inicio = time.perf_counter()
+                response = vista(request)
+                response.render()
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'/api/{recurso}/ {params} respondió {response.status_code}')
+        # Las consultas de la última repetición con su duración
+        return tiempos, [
+            (consulta['sql'], round(float(consulta['time']) * 1000, 2)) for consulta in ctx.captured_queries
+        ]
+
+    def comparar(self, base, resultado, tolerancia):
+        regresiones = []
+        if base.get('motor') != resultado['motor']:
+            raise CommandError(f"El resultado guardado es de {base.get('motor')}, no de {resultado['motor']}")
+        for nombre, actual in resultado['escenarios'].items():
+            anterior = base['escenarios'].get(nombre)
+            if anterior is None:
+                continue
+            if actual['consultas'] > anterior['consultas']:
+                regresiones.append(f"{nombre}: {anterior['consultas']} -> {actual['consultas']} consultas")
+            if actual['mediana_ms'] > anterior['mediana_ms'] * (1 + tolerancia) + 1:
+                regresiones.append(f"{nombre}: mediana {anterior['mediana_ms']} -> {actual['mediana_ms']} ms")
+            antes = {nodo for plan in anterior['planes'] for nodo in plan if recorre_tabla(nodo)}
+            nuevos = {nodo for plan in actual['planes'] for nodo in plan if recorre_tabla(nodo)} - antes
+            if nuevos:
+                regresiones.append(f"{nombre}: el plan ahora incluye {'; '.join(sorted(nuevos))}")
+        return regresiones
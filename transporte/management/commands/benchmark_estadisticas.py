@@ -0,0 +1,117 @@
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from transporte.estadisticas import consultar
+from transporte.models import (
+    Linea, Ruta, Parada, ResumenBoletosHora, ResumenBoletosParadaDia, ResumenBoletosDia
+)
+
+TIPOS = ('normal', 'estudiante', 'jubilado')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Mide las consultas de /api/estadisticas/ sobre un año de resúmenes sintéticos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=365, help='Días de resúmenes diarios')
+        parser.add_argument('--dias-hora', type=int, default=31, help='Días de resúmenes por hora')
+        parser.add_argument('--lineas', type=int, default=10)
+        parser.add_argument('--rutas', type=int, default=2, help='Rutas por línea')
+        parser.add_argument('--paradas', type=int, default=10, help='Paradas por ruta')
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                hasta = self.preparar(options)
+                self.medir(hasta, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def preparar(self, options):
+        aleatorio = random.Random(1)
+        hasta = timezone.localdate()
+        rutas = []
+        for i in range(options['lineas']):
+            linea = Linea.objects.create(numero=990100 + i, nombre=f'Benchmark {i}')
+            for j in range(options['rutas']):
+                ruta = Ruta.objects.create(linea=linea, nombre=f'Benchmark {i}.{j}')
+                paradas = Parada.objects.bulk_create(
+                    Parada(nombre=f'Parada {i}.{j}.{k}', direccion='-') for k in range(options['paradas'])
+                )
+                rutas.append((linea.pk, ruta.pk, [parada.pk for parada in paradas]))
+
+        inicio = time.perf_counter()
+        ResumenBoletosDia.objects.bulk_create((
+            ResumenBoletosDia(
+                dia=hasta - timedelta(days=d), linea_id=linea, ruta_id=ruta, tipo_tarjeta=tipo,
+                boletos=aleatorio.randint(200, 2000), recaudacion=Decimal(aleatorio.randint(300, 3000)),
+            )
+            for d in range(options['dias']) for linea, ruta, _ in rutas for tipo in TIPOS
+        ), batch_size=5000)
+        ResumenBoletosParadaDia.objects.bulk_create((
+            ResumenBoletosParadaDia(
+                dia=hasta - timedelta(days=d), linea_id=linea, ruta_id=ruta, parada_subida_id=parada,
+                tipo_tarjeta=tipo, boletos=aleatorio.randint(20, 200),
+                recaudacion=Decimal(aleatorio.randint(30, 300)),
+            )
+            for d in range(options['dias']) for linea, ruta, paradas in rutas
+            for parada in paradas for tipo in TIPOS
+        ), batch_size=5000)
+
+        def por_hora():
+            for d in range(options['dias_hora']):
+                dia = hasta - timedelta(days=d)
+                for h in range(5, 23):
+                    hora = timezone.make_aware(datetime(dia.year, dia.month, dia.day, h))
+                    for linea, ruta, paradas in rutas:
+                        for parada in paradas:
+                            for tipo in TIPOS:
+                                yield ResumenBoletosHora(
+                                    hora=hora, linea_id=linea, ruta_id=ruta, parada_subida_id=parada,
+                                    tipo_tarjeta=tipo, boletos=aleatorio.randint(0, 20),
+                                    recaudacion=Decimal(aleatorio.randint(0, 30)),
+                                )
+
+        ResumenBoletosHora.objects.bulk_create(por_hora(), batch_size=5000)
+        self.stdout.write(
+            f'{ResumenBoletosDia.objects.count()} filas diarias, '
+            f'{ResumenBoletosParadaDia.objects.count()} por parada y día y '
+            f'{ResumenBoletosHora.objects.count()} por hora generadas en {time.perf_counter() - inicio:.1f} s'
+        )
+        return hasta
+
+    def medir(self, hasta, options):
+        anio = hasta - timedelta(days=options['dias'] - 1)
+        mes = hasta - timedelta(days=options['dias_hora'] - 1)
+        linea = Linea.objects.get(numero=990100).pk
+        consultas = [
+            ('año por línea y día', anio, 'dia', ['linea'], {}),
+            ('año por ruta y mes', anio, 'mes', ['ruta'], {}),
+            ('año por tipo de tarjeta', anio, 'total', ['tipo_tarjeta'], {}),
+            ('mes de una línea por hora', mes, 'hora', [], {'linea': linea}),
+            ('mes por parada', mes, 'total', ['parada'], {}),
+            ('año por parada', anio, 'total', ['parada'], {}),
+        ]
+        for nombre, desde, periodo, agrupar, filtros in consultas:
+            tiempos = []
+            for _ in range(options['repeticiones']):
+                inicio = time.perf_counter()
+                filas = consultar(desde, hasta, periodo, agrupar, filtros)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            self.stdout.write(
+                f'{nombre:<28} filas={len(filas):<6} mediana={statistics.median(tiempos):8.1f} ms '
+                f'máximo={max(tiempos):8.1f} ms'
+            )
@@ -0,0 +1,100 @@
+import time
+from datetime import date, time as hora
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from transporte.models import (
+    Linea, Parada, Ruta, RutaParada, Vehiculo, Chofer, Viaje, Tarjeta, Boleto
+)
+from transporte.views import TarjetaViewSet, ViajeViewSet
+
+ESCENARIOS = [
+    ('tarjetas', TarjetaViewSet, [
+        ('completo', {}),
+        ('fields=id,numero,saldo', {'fields': 'id,numero,saldo'}),
+    ]),
+    ('viajes', ViajeViewSet, [
+        ('expand completo (anterior)', {'expand': 'ruta.linea,ruta.paradas.parada,vehiculo,chofer'}),
+        ('completo', {}),
+        ('fields=id,estado,fecha', {'fields': 'id,estado,fecha'}),
+    ]),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Mide tamaño del payload y tiempo de consulta/serialización con y sin fieldsets dispersos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=500, help='Filas por listado')
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.poblar(options['filas'])
+                for recurso, viewset, casos in ESCENARIOS:
+                    for nombre, params in casos:
+                        self.medir(recurso, viewset, nombre, params, options['repeticiones'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def poblar(self, filas):
+        linea = Linea.objects.create(numero=990001, nombre='Benchmark')
+        ruta = Ruta.objects.create(linea=linea, nombre='Benchmark')
+        paradas = Parada.objects.bulk_create(
+            Parada(nombre=f'Parada {i}', direccion=f'Calle {i}') for i in range(20)
+        )
+        RutaParada.objects.bulk_create(
+            RutaParada(ruta=ruta, parada=parada, orden=i) for i, parada in enumerate(paradas)
+        )
+        vehiculo = Vehiculo.objects.create(patente='BENCH01', capacidad=40)
+        chofer = Chofer.objects.create(
+            nombre='Bench', apellido='Mark', dni='BENCH01', licencia='D1',
+            fecha_contratacion=date(2024, 1, 1)
+        )
+        viajes = Viaje.objects.bulk_create(
+            Viaje(ruta=ruta, vehiculo=vehiculo, chofer=chofer, fecha=date(2025, 1, 1),
+                  hora_salida_real=hora(i % 24, 0))
+            for i in range(filas)
+        )
+        tarjetas = Tarjeta.objects.bulk_create(
+            Tarjeta(numero=f'BENCH{i:08d}', tipo='normal', saldo=Decimal('100')) for i in range(filas)
+        )
+        Boleto.objects.bulk_create(
+            Boleto(viaje=viaje, tarjeta=tarjeta, monto=Decimal('10'))
+            for viaje, tarjeta in zip(viajes, tarjetas)
+        )
+
+    def medir(self, recurso, viewset, nombre, params, repeticiones):
+        django_request = APIRequestFactory().get(f'/api/{recurso}/', params)
+        view = viewset(action_map={'get': 'list'}, format_kwarg=None, kwargs={}, args=())
+        request = view.initialize_request(django_request)
+        view.request = request
+
+        mejor_consulta = mejor_serializacion = float('inf')
+        for _ in range(repeticiones):
+            with CaptureQueriesContext(connection) as ctx:
+                inicio = time.perf_counter()
+                filas = list(view.filter_queryset(view.get_queryset()))
+                medio = time.perf_counter()
+                data = view.get_serializer(filas, many=True).data
+                fin = time.perf_counter()
+            mejor_consulta = min(mejor_consulta, medio - inicio)
+            mejor_serializacion = min(mejor_serializacion, fin - medio)
+        payload = JSONRenderer().render(data)
+
+        self.stdout.write(
+            f'{recurso:<10} {nombre:<30} filas={len(filas):<6} bytes={len(payload):<10} '
+            f'consultas={len(ctx):<3} consulta={mejor_consulta * 1000:8.2f} ms '
+            f'serializacion={mejor_serializacion * 1000:8.2f} ms'
+        )
@@ -0,0 +1,53 @@
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from transporte.eta import FUENTES, Perfiles, leer_viajes
+
+
+def _fecha(valor):
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise CommandError(f'Fecha inválida: {valor} (se espera AAAA-MM-DD)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Calcula los perfiles de duración de los viajes por ruta, día y franja horaria '
+        'para /api/rutas/{id}/eta/ y los guarda en ETA_ARCHIVO para los workers'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hasta', type=_fecha, help='Último día (AAAA-MM-DD); por defecto hoy')
+        parser.add_argument('--dias', type=int, help='Días de historial; por defecto ETA_DIAS_HISTORIAL')
+        parser.add_argument('--archivo', help='Archivo de salida; por defecto ETA_ARCHIVO')
+
+    def handle(self, *args, **options):
+        dias = options['dias'] or settings.ETA_DIAS_HISTORIAL
+        if dias < 1:
+            raise CommandError('--dias debe ser mayor que cero')
+        hasta = options['hasta'] or timezone.localdate()
+        desde = hasta - timedelta(days=dias - 1)
+
+        inicio = time.perf_counter()
+        viajes = leer_viajes(desde, hasta)
+        leido = time.perf_counter()
+        perfiles = Perfiles.calcular(viajes, settings.ETA_FRANJA_MINUTOS, settings.ETA_MINIMO_VIAJES)
+        calculado = time.perf_counter()
+        fuentes = [int((perfiles.fuente == indice).sum()) for indice in range(len(FUENTES))]
+        self.stdout.write(
+            f'{desde} a {hasta}: {len(viajes)} viajes de {len(perfiles.rutas)} rutas '
+            f'(lectura {leido - inicio:.2f} s, cálculo {calculado - leido:.2f} s)'
+        )
+        self.stdout.write('Celdas por fuente: ' + ', '.join(
+            f'{fuente} {cantidad}' for fuente, cantidad in zip(FUENTES, fuentes)
+        ))
+
+        archivo = options['archivo'] or settings.ETA_ARCHIVO
+        if archivo:
+            perfiles.guardar(archivo)
+            self.stdout.write(self.style.SUCCESS(f'Perfiles guardados en {archivo}'))
@@ -0,0 +1,362 @@
+import math
+import random
+import secrets
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as hora, timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from transporte.cache import incrementar_generacion
+from transporte.estadisticas import recalcular
+from transporte.models import (
+    Linea, Parada, Ruta, RutaParada, Vehiculo, Chofer, Horario, Viaje, Tarjeta,
+    Boleto, Mantenimiento, Incidente
+)
+from transporte.planificador import DIAS
+
+# Centro de la red (Buenos Aires) y metros por grado de latitud
+CENTRO = (-34.6037, -58.3816)
+METROS_POR_GRADO = 111_320
+CUADRA = 400
+CALLES_NS = (
+    'San Martín', 'Belgrano', 'Rivadavia', 'Mitre', 'Sarmiento', 'Moreno', 'Alsina', 'Güemes',
+    'Urquiza', 'Lavalle', 'Tucumán', 'Córdoba', 'Pueyrredón', 'Colón', 'Alvear', 'Brown',
+)
+CALLES_EO = (
+    'Av. 9 de Julio', 'Independencia', 'Santa Fe', 'Corrientes', 'Entre Ríos', 'Libertad',
+    'Maipú', 'Esmeralda', 'Suipacha', 'Paraná', 'Uruguay', 'Talcahuano', 'Junín', 'Ayacucho',
+    'Riobamba', 'Callao',
+)
+COLORES = ('rojo', 'azul', 'verde', 'amarillo', 'naranja', 'violeta', 'celeste', 'gris')
+NOMBRES = ('Juan', 'María', 'Carlos', 'Ana', 'Luis', 'Lucía', 'Jorge', 'Sofía', 'Martín', 'Valeria')
+APELLIDOS = ('González', 'Rodríguez', 'Gómez', 'Fernández', 'López', 'Díaz', 'Martínez', 'Pérez', 'Romero', 'Sosa')
+MARCAS = (('Mercedes-Benz', 'OF 1721'), ('Agrale', 'MT 17.0'), ('Volkswagen', '17.280 OD'), ('Iveco', '170E28'))
+TARIFAS = {'normal': Decimal('700.00'), 'estudiante': Decimal('350.00'), 'jubilado': Decimal('350.00')}
+TIPOS_TARJETA = (('normal', 70), ('estudiante', 20), ('jubilado', 10))
+GRAVEDADES = (('baja', 60), ('media', 30), ('alta', 10))
+INCIDENTES = (
+    'Demora por tránsito en el recorrido',
+    'Desperfecto mecánico, se cambió la unidad',
+    'Choque leve con un automóvil, sin heridos',
+    'Pasajero descompuesto, se llamó a emergencias',
+    'Corte de calle por obras, desvío del recorrido',
+    'Falla en el validador de tarjetas',
+    'Discusión entre pasajeros',
+    'Pinchadura de neumático',
+)
+MANTENIMIENTOS = {
+    'preventivo': ('Service de motor y cambio de aceite', 'Revisión de frenos', 'Control de luces y neumáticos'),
+    'correctivo': ('Reparación de la caja de cambios', 'Cambio de embrague', 'Reparación de puerta trasera'),
+}
+# Pasajeros relativos a la media según la hora de salida (horas pico a la mañana y a la tarde)
+DEMANDA_POR_HORA = {
+    5: 0.4, 6: 0.9, 7: 1.8, 8: 1.8, 9: 1.2, 10: 0.8, 11: 0.8, 12: 1.0, 13: 1.0, 14: 0.8,
+    15: 0.9, 16: 1.2, 17: 1.8, 18: 1.8, 19: 1.3, 20: 0.8, 21: 0.6, 22: 0.4, 23: 0.3,
+}
+VELOCIDAD = 20 / 3.6  # metros por segundo
+DETENCION = 30  # segundos en cada parada
+LOTE = 5000
+
+
+@contextmanager
+def fechas_explicitas(*campos):
+    """Respeta en `bulk_create` la fecha de los campos `auto_now_add` (datos históricos)"""
+    for campo in campos:
+        campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo in campos:
+            campo.auto_now_add = True
+
+
+def elegir(aleatorio, ponderados):
+    valores, pesos = zip(*ponderados)
+    return aleatorio.choices(valores, pesos)[0]
+
+
+def a_coordenadas(x, y, lado):
+    """Metros desde la esquina de la red -> `(latitud, longitud)` como Decimal"""
+    latitud = CENTRO[0] + (y - lado / 2) / METROS_POR_GRADO
+    longitud = CENTRO[1] + (x - lado / 2) / (METROS_POR_GRADO * math.cos(math.radians(latitud)))
+    return Decimal(f'{latitud:.8f}'), Decimal(f'{longitud:.8f}')
+
+
+def trazar_recorrido(aleatorio, puntos, cantidad, lado):
+    """
+    Índices de `cantidad` puntos a lo largo de una recta al azar que cruza la
+    red, en el orden en que los recorre.
+    """
+    cantidad = min(cantidad, len(puntos))
+    angulo = aleatorio.uniform(0, math.pi)
+    dx, dy = math.cos(angulo), math.sin(angulo)
+    cx, cy = aleatorio.uniform(0.3, 0.7) * lado, aleatorio.uniform(0.3, 0.7) * lado
+    ancho = lado * cantidad / len(puntos)
+    while True:
+        banda = sorted(
+            ((x - cx) * dx + (y - cy) * dy, indice) for indice, (x, y) in enumerate(puntos)
+            if abs((x - cx) * dy - (y - cy) * dx) <= ancho
+        )
+        if len(banda) >= cantidad:
+            break
+        ancho *= 1.5
+    paso = len(banda) / cantidad
+    return [banda[int(k * paso)][1] for k in range(cantidad)]
+
+
+def segundos_a_hora(segundos):
+    segundos = min(int(segundos), 24 * 3600 - 1)
+    return hora(segundos // 3600, segundos // 60 % 60, segundos % 60)
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera una red sintética (líneas, paradas, rutas y horarios) con su historia de viajes, '
+        'boletos, incidentes y mantenimientos, a la escala indicada'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lineas', type=int, default=10)
+        parser.add_argument('--ramales', type=int, default=1, help='Ramales por línea (cada uno con ida y vuelta)')
+        parser.add_argument('--paradas', type=int, default=300)
+        parser.add_argument('--paradas-por-ruta', type=int, default=25)
+        parser.add_argument(
+            '--frecuencia', type=int, default=15,
+            help='Minutos entre salidas en días hábiles (el doble los fines de semana)'
+        )
+        parser.add_argument('--dias', type=int, default=30, help='Días de historia hasta hoy')
+        parser.add_argument('--boletos-por-viaje', type=int, default=20, help='Media de boletos por viaje')
+        parser.add_argument('--incidentes', type=float, default=0.02, help='Probabilidad de incidente por viaje')
+        parser.add_argument('--tarjetas', type=int, default=5000)
+        parser.add_argument('--vehiculos', type=int, help='Por defecto 4 por ruta')
+        parser.add_argument('--choferes', type=int, help='Por defecto 2 por vehículo')
+        parser.add_argument('--semilla', type=int, default=1)
+        parser.add_argument(
+            '--sin-estadisticas', action='store_true',
+            help='No recalcular los resúmenes de boletos del período generado'
+        )
+
+    def handle(self, *args, **options):
+        if min(options['lineas'], options['ramales'], options['paradas'], options['frecuencia'], options['dias']) < 1 \
+                or options['paradas_por_ruta'] < 2:
+            raise CommandError('Las cantidades deben ser positivas y cada ruta debe tener al menos 2 paradas')
+        self.aleatorio = random.Random(options['semilla'])
+        # Los campos únicos llevan un prefijo por ejecución: se puede generar más de una vez sobre la misma base
+        self.corrida = secrets.token_hex(3).upper()
+        self.ahora = timezone.localtime()
+        self.hoy = self.ahora.date()
+        self.desde = self.hoy - timedelta(days=options['dias'] - 1)
+        inicio = time.perf_counter()
+
+        with transaction.atomic():
+            rutas = self.generar_red(options)
+            vehiculos, choferes = self.generar_flota(options, len(rutas))
+            tarjetas = self.generar_tarjetas(options)
+            self.informar('Red, flota y tarjetas', inicio)
+        totales = {'viajes': 0, 'boletos': 0, 'incidentes': 0}
+        campos = (Boleto._meta.get_field('fecha_compra'), Incidente._meta.get_field('fecha'))
+        with fechas_explicitas(*campos):
+            for dias in range(options['dias']):
+                with transaction.atomic():
+                    for nombre, cantidad in self.generar_dia(
+                        self.desde + timedelta(days=dias), rutas, vehiculos, choferes, tarjetas, options
+                    ).items():
+                        totales[nombre] += cantidad
+        self.stdout.write(', '.join(f'{cantidad} {nombre}' for nombre, cantidad in totales.items()))
+        self.informar('Historia', inicio)
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Estadísticas para el planificador sobre las filas recién insertadas
+                cursor.execute('ANALYZE')
+        if not options['sin_estadisticas']:
+            recalcular(self.desde, self.hoy)
+            self.informar('Resúmenes de boletos', inicio)
+        # `bulk_create` no emite señales: las respuestas cacheadas se invalidan acá
+        for modelo in apps.get_app_config('transporte').get_models():
+            incrementar_generacion(modelo)
+        self.stdout.write(self.style.SUCCESS(f'Datos sintéticos generados (corrida {self.corrida})'))
+
+    def informar(self, etapa, inicio):
+        self.stdout.write(f'{etapa}: {time.perf_counter() - inicio:.1f} s')
+
+    def generar_red(self, options):
+        """Paradas, líneas, rutas (ida y vuelta por ramal), sus paradas en orden y horarios"""
+        aleatorio = self.aleatorio
+        lado = math.sqrt(options['paradas']) * CUADRA
+        puntos = [(aleatorio.uniform(0, lado), aleatorio.uniform(0, lado)) for _ in range(options['paradas'])]
+        paradas = []
+        for x, y in puntos:
+            calle = CALLES_NS[int(x // CUADRA) % len(CALLES_NS)]
+            latitud, longitud = a_coordenadas(x, y, lado)
+            paradas.append(Parada(
+                nombre=f'{calle} y {CALLES_EO[int(y // CUADRA) % len(CALLES_EO)]}',
+                direccion=f'{calle} {int(y) + 100}', latitud=latitud, longitud=longitud,
+            ))
+        paradas = Parada.objects.bulk_create(paradas, batch_size=LOTE)
+
+        primer_numero = (Linea.objects.aggregate(maximo=Max('numero'))['maximo'] or 0) + 1
+        lineas = Linea.objects.bulk_create(
+            Linea(numero=primer_numero + i, nombre=f'Línea {primer_numero + i}',
+                  color=COLORES[i % len(COLORES)], descripcion='Línea sintética')
+            for i in range(options['lineas'])
+        )
+        recorridos = []
+        for linea in lineas:
+            for ramal in range(options['ramales']):
+                ida = trazar_recorrido(aleatorio, puntos, options['paradas_por_ruta'], lado)
+                origen, destino = paradas[ida[0]].nombre, paradas[ida[-1]].nombre
+                recorridos.append((Ruta(linea=linea, nombre=f'{linea.numero}{"ABCDEFGH"[ramal % 8]} - {origen} a {destino}'), ida))
+                recorridos.append((Ruta(linea=linea, nombre=f'{linea.numero}{"ABCDEFGH"[ramal % 8]} - {destino} a {origen}'), ida[::-1]))
+        Ruta.objects.bulk_create([ruta for ruta, _ in recorridos])
+
+        rutas = []
+        relaciones, horarios = [], []
+        for ruta, indices in recorridos:
+            # Segundos desde la salida hasta cada parada
+            acumulados = [0.0]
+            for anterior, siguiente in zip(indices, indices[1:]):
+                (x1, y1), (x2, y2) = puntos[anterior], puntos[siguiente]
+                acumulados.append(acumulados[-1] + math.hypot(x2 - x1, y2 - y1) / VELOCIDAD + DETENCION)
+            relaciones += [
+                RutaParada(ruta=ruta, parada=paradas[indice], orden=orden + 1) for orden, indice in enumerate(indices)
+            ]
+            salidas = {}
+            for dias, frecuencia in (('L,M,X,J,V', options['frecuencia']), ('S,D', options['frecuencia'] * 2)):
+                salida = 5 * 3600 + aleatorio.randrange(frecuencia) * 60
+                while salida < 23 * 3600:
+                    horarios.append(Horario(
+                        ruta=ruta, hora_salida=segundos_a_hora(salida),
+                        hora_llegada=segundos_a_hora(salida + acumulados[-1]), dias_semana=dias,
+                    ))
+                    salidas.setdefault(dias, []).append(salida)
+                    salida += frecuencia * 60
+            rutas.append({
+                'ruta': ruta,
+                'paradas': [paradas[indice].pk for indice in indices],
+                'acumulados': acumulados,
+                'salidas': salidas,
+            })
+        RutaParada.objects.bulk_create(relaciones, batch_size=LOTE)
+        Horario.objects.bulk_create(horarios, batch_size=LOTE)
+        self.stdout.write(
+            f'{len(paradas)} paradas, {len(lineas)} líneas, {len(rutas)} rutas, {len(horarios)} horarios'
+        )
+        return rutas
+
+    def generar_flota(self, options, cantidad_rutas):
+        aleatorio = self.aleatorio
+        cantidad = options['vehiculos'] or cantidad_rutas * 4
+        vehiculos = []
+        for i in range(cantidad):
+            marca, modelo = aleatorio.choice(MARCAS)
+            vehiculos.append(Vehiculo(
+                patente=f'S{self.corrida}{i:05d}', marca=marca, modelo=modelo,
+                anio=aleatorio.randint(2012, self.hoy.year), capacidad=aleatorio.choice((60, 70, 80)),
+            ))
+        vehiculos = Vehiculo.objects.bulk_create(vehiculos, batch_size=LOTE)
+        choferes = Chofer.objects.bulk_create((
+            Chofer(
+                nombre=aleatorio.choice(NOMBRES), apellido=aleatorio.choice(APELLIDOS),
+                dni=f'S{self.corrida}{i:06d}', licencia='D1',
+                fecha_contratacion=self.hoy - timedelta(days=aleatorio.randrange(30, 3650)),
+            )
+            for i in range(options['choferes'] or cantidad * 2)
+        ), batch_size=LOTE)
+
+        mantenimientos = []
+        for vehiculo in vehiculos:
+            fecha = self.desde + timedelta(days=aleatorio.randrange(30))
+            while fecha <= self.hoy:
+                tipo = 'correctivo' if aleatorio.random() < 0.25 else 'preventivo'
+                mantenimientos.append(Mantenimiento(
+                    vehiculo=vehiculo, tipo=tipo, fecha=fecha,
+                    descripcion=aleatorio.choice(MANTENIMIENTOS[tipo]),
+                    costo=Decimal(aleatorio.randrange(50, 800) * 1000),
+                ))
+                fecha += timedelta(days=aleatorio.randint(20, 40))
+        Mantenimiento.objects.bulk_create(mantenimientos, batch_size=LOTE)
+        self.stdout.write(f'{len(vehiculos)} vehículos, {len(choferes)} choferes, {len(mantenimientos)} mantenimientos')
+        return [vehiculo.pk for vehiculo in vehiculos], [chofer.pk for chofer in choferes]
+
+    def generar_tarjetas(self, options):
+        aleatorio = self.aleatorio
+        tarjetas = Tarjeta.objects.bulk_create((
+            Tarjeta(
+                numero=f'S{self.corrida}{i:010d}', tipo=elegir(aleatorio, TIPOS_TARJETA),
+                saldo=Decimal(aleatorio.randrange(0, 200) * 100),
+            )
+            for i in range(options['tarjetas'])
+        ), batch_size=LOTE)
+        return [(tarjeta.pk, tarjeta.tipo) for tarjeta in tarjetas]
+
+    def generar_dia(self, dia, rutas, vehiculos, choferes, tarjetas, options):
+        """Viajes del día según los horarios, con sus boletos e incidentes"""
+        aleatorio = self.aleatorio
+        letra = DIAS[dia.weekday()]
+        es_hoy = dia == self.hoy
+        medianoche = timezone.make_aware(datetime.combine(dia, hora.min))
+
+        viajes, detalles = [], []
+        for datos in rutas:
+            salidas = next(salidas for dias, salidas in datos['salidas'].items() if letra in dias)
+            for programada in salidas:
+                duracion = datos['acumulados'][-1]
+                salida = max(0.0, programada + aleatorio.gauss(90, 120))
+                llegada = salida + duracion * aleatorio.uniform(0.9, 1.3)
+                if es_hoy and medianoche + timedelta(seconds=salida) > self.ahora:
+                    estado = 'programado'
+                elif es_hoy and medianoche + timedelta(seconds=llegada) > self.ahora:
+                    estado = 'en_curso'
+                else:
+                    estado = 'cancelado' if aleatorio.random() < 0.02 else 'finalizado'
+                viajes.append(Viaje(
+                    ruta=datos['ruta'], vehiculo_id=aleatorio.choice(vehiculos), chofer_id=aleatorio.choice(choferes),
+                    fecha=dia, estado=estado,
+                    hora_salida_real=segundos_a_hora(salida) if estado in ('en_curso', 'finalizado') else None,
+                    hora_llegada_real=segundos_a_hora(llegada) if estado == 'finalizado' else None,
+                ))
+                detalles.append((datos, programada, salida, llegada))
+        viajes = Viaje.objects.bulk_create(viajes, batch_size=LOTE)
+
+        fin_de_semana = dia.weekday() >= 5
+        boletos, incidentes = [], []
+        for viaje, (datos, programada, salida, llegada) in zip(viajes, detalles):
+            if viaje.estado not in ('en_curso', 'finalizado'):
+                continue
+            media = options['boletos_por_viaje'] * DEMANDA_POR_HORA.get(programada // 3600, 0.3)
+            cantidad = round(media * (0.6 if fin_de_semana else 1) * aleatorio.uniform(0.5, 1.5))
+            paradas, acumulados = datos['paradas'], datos['acumulados']
+            for _ in range(cantidad):
+                # Más subidas en las primeras paradas del recorrido
+                orden = int((len(paradas) - 1) * aleatorio.random() ** 1.5)
+                compra = medianoche + timedelta(seconds=salida + acumulados[orden] + aleatorio.uniform(0, DETENCION))
+                if compra > self.ahora:
+                    continue
+                if aleatorio.random() < 0.15:
+                    tarjeta, tipo = None, 'normal'
+                else:
+                    tarjeta, tipo = aleatorio.choice(tarjetas)
+                boletos.append(Boleto(
+                    viaje=viaje, tarjeta_id=tarjeta, monto=TARIFAS[tipo],
+                    fecha_compra=compra, parada_subida_id=paradas[orden],
+                ))
+            if aleatorio.random() < options['incidentes']:
+                fecha = medianoche + timedelta(seconds=aleatorio.uniform(salida, llegada))
+                if fecha > self.ahora:
+                    continue
+                antiguo = fecha < self.ahora - timedelta(days=2)
+                incidentes.append(Incidente(
+                    viaje=viaje, fecha=fecha, descripcion=aleatorio.choice(INCIDENTES),
+                    gravedad=elegir(aleatorio, GRAVEDADES),
+                    resuelto=aleatorio.random() < (0.95 if antiguo else 0.3),
+                ))
+        Boleto.objects.bulk_create(boletos, batch_size=LOTE)
+        Incidente.objects.bulk_create(incidentes, batch_size=LOTE)
+        return {'viajes': len(viajes), 'boletos': len(boletos), 'incidentes': len(incidentes)}
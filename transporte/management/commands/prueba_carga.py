@@ -0,0 +1,439 @@
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from transporte.metricas import estado_pools
+from transporte.models import Linea, Parada, Ruta, Viaje, Tarjeta, Vehiculo
+
+
+def _palabra(valores, aleatorio):
+    return aleatorio.choice(aleatorio.choice(valores['paradas_nombres']).split())
+
+
+# (nombre, peso, requiere usuario, solicitud); cada solicitud recibe los
+# valores tomados de la base y devuelve `(método, ruta, parámetros o cuerpo)`
+MEZCLA = [
+    ('lineas', 8, False, lambda v, a: ('GET', '/api/lineas/', {})),
+    ('linea', 4, False, lambda v, a: ('GET', f"/api/lineas/{a.choice(v['lineas'])}/", {})),
+    ('ruta_expandida', 4, False, lambda v, a: (
+        'GET', f"/api/rutas/{a.choice(v['rutas'])}/", {'expand': 'linea,paradas.parada'}
+    )),
+    ('paradas_busqueda', 8, False, lambda v, a: ('GET', '/api/paradas/', {'search': _palabra(v, a)})),
+    ('paradas_cercanas', 10, False, lambda v, a: ('GET', '/api/paradas/cercanas/', {
+        'lat': f"{a.choice(v['coordenadas'])[0] + a.uniform(-0.005, 0.005):.6f}",
+        'lon': f"{a.choice(v['coordenadas'])[1] + a.uniform(-0.005, 0.005):.6f}",
+        'k': 5,
+    })),
+    ('proximas_salidas', 12, False, lambda v, a: (
+        'GET', f"/api/paradas/{a.choice(v['paradas'])}/proximas-salidas/", {}
+    )),
+    ('planificador', 10, False, lambda v, a: ('GET', '/api/planificador/', {
+        'origen': a.choice(v['paradas']), 'destino': a.choice(v['paradas']),
+        'hora': f'{a.randrange(6, 22):02d}:{a.randrange(60):02d}',
+    })),
+    ('horarios_ruta', 5, False, lambda v, a: ('GET', '/api/horarios/', {'ruta': a.choice(v['rutas'])})),
+    ('viajes_fecha', 8, False, lambda v, a: ('GET', '/api/viajes/', {'fecha': a.choice(v['fechas'])})),
+    ('viajes_en_curso', 5, False, lambda v, a: ('GET', '/api/viajes/', {'estado': 'en_curso'})),
+    ('viaje', 5, False, lambda v, a: ('GET', f"/api/viajes/{a.choice(v['viajes'])}/", {})),
+    ('boletos_viaje', 5, False, lambda v, a: ('GET', '/api/boletos/', {'viaje': a.choice(v['viajes'])})),
+    ('incidentes_pendientes', 5, False, lambda v, a: ('GET', '/api/incidentes/', {'resuelto': 'false'})),
+    ('estadisticas', 3, True, lambda v, a: ('GET', '/api/estadisticas/', {'agrupar': 'linea', 'periodo': 'dia'})),
+    ('posiciones_flota', 3, False, lambda v, a: ('GET', '/api/vehiculos/posiciones/', {'max_edad': 60})),
+    ('enviar_posiciones', 3, True, lambda v, a: ('POST', '/api/vehiculos/posiciones/', [
+        {'vehiculo': vehiculo, 'latitud': round(latitud + a.uniform(-0.01, 0.01), 6),
+         'longitud': round(longitud + a.uniform(-0.01, 0.01), 6), 'velocidad': round(a.uniform(0, 60), 1)}
+        for vehiculo, (latitud, longitud) in zip(
+            a.sample(v['vehiculos'], min(100, len(v['vehiculos']))), a.choices(v['coordenadas'], k=100)
+        )
+    ])),
+    ('comprar_boleto', 4, True, lambda v, a: ('POST', '/api/boletos/', {
+        'viaje': a.choice(v['viajes_en_curso'] or v['viajes']), 'tarjeta': a.choice(v['tarjetas']),
+        'monto': '700.00',
+    })),
+]
+
+
+def percentil(valores, p):
+    """Percentil `p` (0 a 100) por rango más cercano de `valores` ordenados"""
+    if not valores:
+        return None
+    return valores[max(0, math.ceil(p / 100 * len(valores)) - 1)]
+
+
+def consultas_server_timing(valor):
+    """Cantidad de consultas informada por `InstrumentacionMiddleware` en `Server-Timing`"""
+    coincidencia = re.search(r'desc="(\d+) consultas"', valor or '')
+    return int(coincidencia.group(1)) if coincidencia else None
+
+
+def parsear_mezcla(texto):
+    """`'lineas=20,planificador=0'` -> `{'lineas': 20, 'planificador': 0}`"""
+    pesos = {}
+    for parte in texto.split(','):
+        nombre, _, peso = parte.partition('=')
+        pesos[nombre.strip()] = int(peso)
+    return pesos
+
+
+class ClienteLocal:
+    """Solicitudes a la aplicación en el mismo proceso, contando las consultas de cada una"""
+
+    def __init__(self, token):
+        self.cliente = Client(**({'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}))
+
+    def solicitar(self, metodo, ruta, datos):
+        with CaptureQueriesContext(connection) as ctx:
+            if metodo == 'GET':
+                response = self.cliente.get(ruta, datos)
+            else:
+                response = self.cliente.post(ruta, datos, content_type='application/json')
+            # Recorre las respuestas en streaming como lo haría el servidor
+            b''.join(response) if response.streaming else response.content
+        return response.status_code, len(ctx.captured_queries)
+
+    def cerrar(self):
+        # Cada hilo abre su conexión; la del hilo principal queda abierta
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+class ClienteAsgi:
+    """
+    Solicitudes a la aplicación por su handler ASGI en el mismo proceso, como
+    las pasaría uvicorn o daphne (cada una en su contexto, con su hilo para el
+    código síncrono); las consultas se leen de `Server-Timing`
+    """
+
+    def __init__(self, aplicacion, token):
+        self.aplicacion = aplicacion
+        self.encabezados = [(b'host', b'localhost')]
+        if token:
+            self.encabezados.append((b'authorization', f'Bearer {token}'.encode()))
+
+    async def solicitar(self, metodo, ruta, datos):
+        encabezados, cuerpo, consulta = self.encabezados, b'', ''
+        if metodo == 'GET':
+            consulta = urllib.parse.urlencode(datos)
+        else:
+            encabezados = [*encabezados, (b'content-type', b'application/json')]
+            cuerpo = json.dumps(datos).encode()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': metodo,
+            'scheme': 'http', 'path': ruta, 'raw_path': ruta.encode(), 'query_string': consulta.encode(),
+            'root_path': '', 'headers': encabezados, 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        mensajes = [{'type': 'http.request', 'body': cuerpo, 'more_body': False}]
+        respuesta = {}
+
+        async def recibir():
+            if mensajes:
+                return mensajes.pop()
+            # El cliente no se desconecta: Django deja de esperar al responder
+            await asyncio.Future()
+
+        async def enviar(mensaje):
+            if mensaje['type'] == 'http.response.start':
+                respuesta['estado'] = mensaje['status']
+                respuesta['encabezados'] = {nombre.lower(): valor for nombre, valor in mensaje['headers']}
+
+        await self.aplicacion(scope, recibir, enviar)
+        server_timing = respuesta['encabezados'].get(b'server-timing', b'').decode()
+        return respuesta['estado'], consultas_server_timing(server_timing)
+
+
+class ClienteRemoto:
+    """Solicitudes HTTP a un servidor en ejecución; las consultas se leen de `Server-Timing`"""
+
+    def __init__(self, url, token):
+        self.url = url.rstrip('/')
+        self.encabezados = {'Authorization': f'Bearer {token}'} if token else {}
+
+    def solicitar(self, metodo, ruta, datos):
+        if metodo == 'GET':
+            request = urllib.request.Request(
+                f'{self.url}{ruta}?{urllib.parse.urlencode(datos)}', headers=self.encabezados
+            )
+        else:
+            request = urllib.request.Request(
+                f'{self.url}{ruta}', data=json.dumps(datos).encode(), method=metodo,
+                headers={**self.encabezados, 'Content-Type': 'application/json'},
+            )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                return response.status, consultas_server_timing(response.headers.get('Server-Timing'))
+        except urllib.error.HTTPError as error:
+            return error.code, consultas_server_timing(error.headers.get('Server-Timing'))
+
+    def cerrar(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga: reproduce una mezcla ponderada de solicitudes a la API e informa '
+        'latencia (p50, p95, p99), rendimiento y consultas por solicitud'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--solicitudes', type=int, default=1000, help='Solicitudes medidas en total')
+        parser.add_argument('--calentamiento', type=int, default=50, help='Solicitudes previas que no se miden')
+        parser.add_argument(
+            '--concurrencia', type=int, default=1,
+            help='Clientes en paralelo (hilos con WSGI, corrutinas con ASGI)'
+        )
+        parser.add_argument(
+            '--interfaz', choices=['wsgi', 'asgi'], default='wsgi',
+            help='Handler con el que se ejecuta la aplicación en este proceso (sin --url)'
+        )
+        parser.add_argument(
+            '--url', help='Servidor en ejecución (p. ej. http://localhost:8000); por defecto la aplicación '
+                          'se ejecuta en este proceso y se cuentan las consultas'
+        )
+        parser.add_argument(
+            '--usuario', help='Usuario con el que se autentican las solicitudes que lo requieren; '
+                              'sin usuario esas solicitudes no se incluyen'
+        )
+        parser.add_argument('--mezcla', help='Pesos a reemplazar, p. ej. "planificador=30,comprar_boleto=0"')
+        parser.add_argument('--semilla', type=int, default=1)
+        parser.add_argument('--guardar', help='Archivo JSON donde guardar el resultado')
+
+    def handle(self, *args, **options):
+        if options['concurrencia'] < 1 or options['solicitudes'] < 1:
+            raise CommandError('--solicitudes y --concurrencia deben ser positivos')
+        if options['url'] and options['interfaz'] != 'wsgi':
+            raise CommandError('--interfaz no se aplica a un servidor en ejecución (--url)')
+        if options['interfaz'] == 'asgi' and not settings.LECTURAS_ASINCRONAS:
+            self.stderr.write(
+                'LECTURAS_ASINCRONAS está apagado: los listados y detalles se atienden con las vistas síncronas'
+            )
+        token = None
+        if options['usuario']:
+            try:
+                usuario = get_user_model().objects.get(username=options['usuario'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No existe el usuario {options['usuario']}")
+            token = str(RefreshToken.for_user(usuario).access_token)
+
+        pesos = {nombre: peso for nombre, peso, autenticada, _ in MEZCLA if token or not autenticada}
+        if options['mezcla']:
+            try:
+                cambios = parsear_mezcla(options['mezcla'])
+            except ValueError:
+                raise CommandError('--mezcla debe tener la forma nombre=peso,nombre=peso')
+            desconocidos = cambios.keys() - {nombre for nombre, *_ in MEZCLA}
+            if desconocidos:
+                raise CommandError(f"Solicitudes desconocidas: {', '.join(sorted(desconocidos))}")
+            sin_usuario = {nombre for nombre, _, autenticada, _ in MEZCLA if autenticada and cambios.get(nombre)}
+            if sin_usuario and not token:
+                raise CommandError(f"{', '.join(sorted(sin_usuario))} requiere --usuario")
+            pesos.update(cambios)
+        pesos = {nombre: peso for nombre, peso in pesos.items() if peso > 0}
+        if not pesos:
+            raise CommandError('La mezcla no tiene solicitudes con peso positivo')
+        solicitudes = {nombre: solicitud for nombre, _, _, solicitud in MEZCLA}
+
+        valores = self.valores()
+        aleatorio = random.Random(options['semilla'])
+        nombres = aleatorio.choices(list(pesos), list(pesos.values()), k=options['calentamiento'] + options['solicitudes'])
+        plan = [(nombre, *solicitudes[nombre](valores, aleatorio)) for nombre in nombres]
+        calentamiento, medidas = plan[:options['calentamiento']], plan[options['calentamiento']:]
+
+        if options['interfaz'] == 'asgi':
+            aplicacion = get_asgi_application()
+
+            def ejecutar(plan):
+                cliente = ClienteAsgi(aplicacion, token)
+                return asyncio.run(self.ejecutar_asgi(cliente, plan, options['concurrencia']))
+        else:
+            def crear_cliente():
+                return ClienteRemoto(options['url'], token) if options['url'] else ClienteLocal(token)
+
+            def ejecutar(plan):
+                return self.ejecutar(crear_cliente, plan, options['concurrencia'])
+
+        ejecutar(calentamiento)
+        pools = estado_pools()
+        inicio = time.perf_counter()
+        resultados = ejecutar(medidas)
+        duracion = time.perf_counter() - inicio
+
+        # Con --url los pools son los del servidor: se ven en /api/metrics
+        pools = {} if options['url'] else self.uso_pools(pools, estado_pools())
+        resultado = self.informe(resultados, duracion, options, pools)
+        if options['guardar']:
+            with open(options['guardar'], 'w', encoding='utf-8') as archivo:
+                json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+
+    def valores(self):
+        """Ids y textos de la base con los que se arman las solicitudes"""
+        hoy = timezone.localdate()
+        viajes = list(Viaje.objects.filter(fecha__gte=hoy - timedelta(days=7)).values_list('pk', flat=True)[:500])
+        valores = {
+            'lineas': list(Linea.objects.values_list('pk', flat=True)[:500]),
+            'rutas': list(Ruta.objects.values_list('pk', flat=True)[:500]),
+            'paradas': list(Parada.objects.values_list('pk', flat=True)[:2000]),
+            'paradas_nombres': list(Parada.objects.values_list('nombre', flat=True)[:2000]),
+            'coordenadas': [
+                (float(latitud), float(longitud)) for latitud, longitud in Parada.objects.filter(
+                    latitud__isnull=False, longitud__isnull=False
+                ).values_list('latitud', 'longitud')[:2000]
+            ],
+            'viajes': viajes or list(Viaje.objects.order_by('-pk').values_list('pk', flat=True)[:500]),
+            'viajes_en_curso': list(Viaje.objects.filter(estado='en_curso').values_list('pk', flat=True)[:500]),
+            'fechas': [(hoy - timedelta(days=dias)).isoformat() for dias in range(7)],
+            'tarjetas': list(Tarjeta.objects.filter(activa=True, saldo__gte=1000).values_list('pk', flat=True)[:2000]),
+            'vehiculos': list(Vehiculo.objects.values_list('pk', flat=True)[:5000]),
+        }
+        faltantes = [nombre for nombre in ('lineas', 'rutas', 'paradas', 'coordenadas', 'viajes', 'tarjetas', 'vehiculos')
+                     if not valores[nombre]]
+        if faltantes:
+            raise CommandError(
+                f"Faltan datos ({', '.join(faltantes)}): generarlos con `python manage.py generar_datos`"
+            )
+        return valores
+
+    def ejecutar(self, crear_cliente, plan, concurrencia):
+        """Ejecuta el plan repartido entre `concurrencia` clientes: `(nombre, estado, ms, consultas)`"""
+        resultados = []
+        pendientes = iter(plan)
+        lock = threading.Lock()
+
+        def trabajar():
+            cliente = crear_cliente()
+            propios = []
+            try:
+                while True:
+                    with lock:
+                        siguiente = next(pendientes, None)
+                    if siguiente is None:
+                        break
+                    nombre, metodo, ruta, datos = siguiente
+                    inicio = time.perf_counter()
+                    try:
+                        estado, consultas = cliente.solicitar(metodo, ruta, datos)
+                    except Exception as error:  # noqa: BLE001 - se informa como error de la solicitud
+                        self.stderr.write(f'{nombre} {ruta}: {error!r}')
+                        estado, consultas = None, None
+                    propios.append((nombre, estado, (time.perf_counter() - inicio) * 1000, consultas))
+            finally:
+                cliente.cerrar()
+            with lock:
+                resultados.extend(propios)
+
+        if concurrencia == 1:
+            trabajar()
+        else:
+            with ThreadPoolExecutor(concurrencia) as ejecutor:
+                for futuro in [ejecutor.submit(trabajar) for _ in range(concurrencia)]:
+                    futuro.result()
+        return resultados
+
+    async def ejecutar_asgi(self, cliente, plan, concurrencia):
+        """`ejecutar` con `concurrencia` corrutinas que comparten el cliente en un event loop"""
+        resultados = []
+        pendientes = iter(plan)
+
+        async def trabajar():
+            for nombre, metodo, ruta, datos in pendientes:
+                inicio = time.perf_counter()
+                try:
+                    estado, consultas = await cliente.solicitar(metodo, ruta, datos)
+                except Exception as error:  # noqa: BLE001 - se informa como error de la solicitud
+                    self.stderr.write(f'{nombre} {ruta}: {error!r}')
+                    estado, consultas = None, None
+                resultados.append((nombre, estado, (time.perf_counter() - inicio) * 1000, consultas))
+
+        await asyncio.gather(*(trabajar() for _ in range(concurrencia)))
+        return resultados
+
+    def uso_pools(self, antes, despues):
+        """Uso de los pools de conexiones de este proceso durante la medición"""
+        uso = {}
+        for alias, estadisticas in despues.items():
+            previas = antes.get(alias, {})
+
+            def durante(nombre):
+                return estadisticas.get(nombre, 0) - previas.get(nombre, 0)
+
+            uso[alias] = {
+                'maximo': estadisticas.get('pool_max'),
+                'conexiones': estadisticas.get('pool_size'),
+                'pedidos': durante('requests_num'),
+                'esperas': durante('requests_queued'),
+                'espera_ms': durante('requests_wait_ms'),
+                'errores': durante('requests_errors'),
+                'conexiones_abiertas': durante('connections_num'),
+            }
+        return uso
+
+    def informe(self, resultados, duracion, options, pools):
+        por_nombre = defaultdict(list)
+        for resultado in resultados:
+            por_nombre[resultado[0]].append(resultado)
+        filas = {}
+        for nombre, grupo in [*sorted(por_nombre.items()), ('total', resultados)]:
+            tiempos = sorted(ms for _, _, ms, _ in grupo)
+            consultas = [cantidad for _, _, _, cantidad in grupo if cantidad is not None]
+            filas[nombre] = {
+                'solicitudes': len(grupo),
+                'errores': sum(1 for _, estado, _, _ in grupo if estado is None or estado >= 400),
+                'p50_ms': round(percentil(tiempos, 50), 2),
+                'p95_ms': round(percentil(tiempos, 95), 2),
+                'p99_ms': round(percentil(tiempos, 99), 2),
+                'consultas_media': round(sum(consultas) / len(consultas), 2) if consultas else None,
+                'consultas_max': max(consultas) if consultas else None,
+            }
+        resultado = {
+            'motor': connection.vendor if not options['url'] else None,
+            'url': options['url'],
+            'interfaz': None if options['url'] else options['interfaz'],
+            'lecturas_asincronas': None if options['url'] else settings.LECTURAS_ASINCRONAS,
+            'concurrencia': options['concurrencia'],
+            'duracion_s': round(duracion, 2),
+            'solicitudes_por_segundo': round(len(resultados) / duracion, 1),
+            'pools': pools,
+            'solicitudes': filas,
+        }
+
+        self.stdout.write(
+            f"{'solicitud':<24}{'n':>6}{'errores':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'consultas':>11}"
+        )
+        for nombre, fila in filas.items():
+            consultas = '-' if fila['consultas_media'] is None else f"{fila['consultas_media']:.1f}"
+            self.stdout.write(
+                f"{nombre:<24}{fila['solicitudes']:>6}{fila['errores']:>9}{fila['p50_ms']:>10.1f}"
+                f"{fila['p95_ms']:>10.1f}{fila['p99_ms']:>10.1f}{consultas:>11}"
+            )
+        self.stdout.write(
+            f"{len(resultados)} solicitudes en {duracion:.1f} s con concurrencia {options['concurrencia']}"
+            f"{'' if options['url'] else ' (' + options['interfaz'].upper() + ')'}: "
+            f"{resultado['solicitudes_por_segundo']} solicitudes/s"
+        )
+        for alias, uso in pools.items():
+            self.stdout.write(
+                f"Pool {alias}: {uso['conexiones']}/{uso['maximo']} conexiones, {uso['esperas']} de "
+                f"{uso['pedidos']} pedidos esperaron ({uso['espera_ms']} ms en total), "
+                f"{uso['conexiones_abiertas']} conexiones nuevas, {uso['errores']} errores"
+            )
+        return resultado
@@ -0,0 +1,52 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from transporte.estadisticas import recalcular
+from transporte.models import Boleto
+
+
+def _fecha(valor):
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise CommandError(f'Fecha inválida: {valor} (se espera AAAA-MM-DD)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye los resúmenes de boletos (por hora y por día) a partir de los '
+        'boletos registrados, de a un bloque de días por transacción'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=_fecha, help='Primer día (AAAA-MM-DD); por defecto el del primer boleto')
+        parser.add_argument('--hasta', type=_fecha, help='Último día (AAAA-MM-DD); por defecto el del último boleto')
+        parser.add_argument('--dias', type=int, default=31, help='Días por transacción')
+
+    def handle(self, *args, **options):
+        if options['dias'] < 1:
+            raise CommandError('--dias debe ser mayor que cero')
+        rango = Boleto.objects.aggregate(primero=Min('fecha_compra'), ultimo=Max('fecha_compra'))
+        if rango['primero'] is None and not (options['desde'] and options['hasta']):
+            self.stdout.write('No hay boletos para resumir')
+            return
+        desde = options['desde'] or timezone.localdate(rango['primero'])
+        hasta = options['hasta'] or timezone.localdate(rango['ultimo'])
+        if desde > hasta:
+            raise CommandError('--desde debe ser anterior a --hasta')
+
+        inicio = time.perf_counter()
+        total = 0
+        while desde <= hasta:
+            fin = min(desde + timedelta(days=options['dias'] - 1), hasta)
+            resumidos = recalcular(desde, fin)
+            total += resumidos
+            self.stdout.write(f'{desde} a {fin}: {resumidos} boletos')
+            desde = fin + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} boletos resumidos ({time.perf_counter() - inicio:.1f} s)'
+        ))
@@ -0,0 +1,76 @@
+import csv
+import sys
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transporte.bulk import acreditar_recargas
+
+COLUMNAS = ('numero', 'monto')
+
+
+class Command(BaseCommand):
+    help = (
+        'Aplica un archivo de recargas (CSV con columnas numero,monto) en bloques '
+        'transaccionales, agrupando los importes por tarjeta'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Ruta del CSV, o '-' para leer de stdin")
+        parser.add_argument('--bloque', type=int, default=10000, help='Líneas por transacción')
+        parser.add_argument('--rechazos', help='CSV donde escribir las líneas rechazadas (por defecto stderr)')
+
+    def handle(self, *args, **options):
+        if options['bloque'] < 1:
+            raise CommandError('--bloque debe ser mayor que cero')
+        if options['archivo'] == '-':
+            self.procesar(sys.stdin, options)
+        else:
+            try:
+                with open(options['archivo'], newline='', encoding='utf-8') as archivo:
+                    self.procesar(archivo, options)
+            except FileNotFoundError:
+                raise CommandError(f"No existe el archivo {options['archivo']}")
+
+    def procesar(self, archivo, options):
+        lector = csv.DictReader(archivo)
+        faltantes = [columna for columna in COLUMNAS if columna not in (lector.fieldnames or [])]
+        if faltantes:
+            raise CommandError(f"Faltan columnas en el archivo: {', '.join(faltantes)}")
+
+        if options['rechazos']:
+            salida_rechazos = open(options['rechazos'], 'w', newline='', encoding='utf-8')
+        else:
+            salida_rechazos = self.stderr
+        escritor = csv.writer(salida_rechazos)
+        escritor.writerow(['linea', 'numero', 'monto', 'motivo'])
+
+        inicio = time.perf_counter()
+        totales = {'lineas': 0, 'aplicadas': 0, 'rechazadas': 0, 'importe': Decimal('0')}
+        try:
+            bloque = []
+            for fila in lector:
+                bloque.append((lector.line_num, (fila['numero'] or '').strip(), fila['monto']))
+                if len(bloque) >= options['bloque']:
+                    self.aplicar_bloque(bloque, escritor, totales)
+                    bloque = []
+            if bloque:
+                self.aplicar_bloque(bloque, escritor, totales)
+        finally:
+            if options['rechazos']:
+                salida_rechazos.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{totales['lineas']} líneas: {totales['aplicadas']} recargas aplicadas por "
+            f"${totales['importe']}, {totales['rechazadas']} rechazadas "
+            f"({time.perf_counter() - inicio:.1f} s)"
+        ))
+
+    def aplicar_bloque(self, bloque, escritor, totales):
+        aplicadas, importe, rechazos = acreditar_recargas(bloque)
+        escritor.writerows(rechazos)
+        totales['lineas'] += len(bloque)
+        totales['aplicadas'] += aplicadas
+        totales['rechazadas'] += len(rechazos)
+        totales['importe'] += importe
@@ -0,0 +1,307 @@
+"""
+Métricas de la API en el formato de texto de Prometheus (`GET /api/metrics`).
+
+`InstrumentacionMiddleware` registra cada solicitud en el `Registro` del
+proceso, por vista (basename del router o nombre de la URL) y acción:
+solicitudes por método y estado, histogramas de latencia, tamaño de la
+respuesta y consultas, tiempo en la base y aciertos de la cache de
+respuestas (cabecera `X-Cache`). Registrar cuesta unos pocos microsegundos
+bajo un lock del proceso.
+
+Con varios workers cada proceso vuelca su registro cada `METRICAS_INTERVALO`
+segundos a un archivo propio en `METRICAS_DIRECTORIO` (con `os.replace`, así
+nunca se lee a medias) y el endpoint suma los archivos de todos: el resultado
+no depende de qué worker atiende el scrape y no hace falta ningún servicio
+externo. Los archivos sin actualizar en `METRICAS_RETENCION` segundos (de
+workers que terminaron) se borran; Prometheus lo ve como un reinicio de los
+contadores. Un solo hilo por proceso vuelca a la vez y un error al escribir
+el archivo se informa en el log: nunca hace fallar la solicitud que lo
+dispara. Los pools de conexiones de PostgreSQL (`OPTIONS['pool']`) se
+informan sumados entre procesos: sus estadísticas, la saturación (conexiones
+en uso sobre el máximo) y las esperas por una conexión libre.
+"""
+import glob
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from rest_framework.authentication import BaseAuthentication
+
+LATENCIAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TAMANIOS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# nombre interno -> (métrica, descripción, cubetas)
+HISTOGRAMAS = {
+    'latencia': ('transporte_solicitud_duracion_segundos', 'Duración de las solicitudes', LATENCIAS),
+    'tamanio': ('transporte_respuesta_bytes', 'Tamaño de las respuestas (sin las de streaming)', TAMANIOS),
+    'consultas': ('transporte_solicitud_consultas', 'Consultas SQL por solicitud', CONSULTAS),
+}
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+AUTH_METRICAS = 'metricas'
+
+logger = logging.getLogger(__name__)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(**valores):
+    return '{' + ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in valores.items()) + '}'
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def estado_pools():
+    """Estadísticas de los pools de conexiones ya creados en este proceso, por alias"""
+    pools = {}
+    for alias in connections:
+        creados = getattr(type(connections[alias]), '_connection_pools', {})
+        if alias in creados:
+            pools[alias] = {nombre: valor for nombre, valor in creados[alias].get_stats().items()
+                            if isinstance(valor, int)}
+    return pools
+
+
+def saturacion_pool(estadisticas):
+    """Conexiones en uso sobre el máximo del pool (con las de todos los procesos sumadas)"""
+    maximo = estadisticas.get('pool_max')
+    if not maximo:
+        return None
+    return (estadisticas.get('pool_size', 0) - estadisticas.get('pool_available', 0)) / maximo
+
+
+class Registro:
+    """Contadores e histogramas de las solicitudes atendidas por este proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Separado de `_lock`: escribir el archivo no frena a `registrar`
+        self._lock_guardado = threading.Lock()
+        self._archivo = None
+        self._guardado = time.monotonic()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.solicitudes = Counter()  # (vista, accion, metodo, estado)
+            self.db_segundos = Counter()  # (vista, accion)
+            self.cache = Counter()  # (vista, accion, resultado)
+            # (vista, accion) -> [una cuenta por cubeta y la de +Inf, suma, cantidad]
+            self.histogramas = {nombre: {} for nombre in HISTOGRAMAS}
+
+    def _observar(self, nombre, clave, valor):
+        cubetas = HISTOGRAMAS[nombre][2]
+        serie = self.histogramas[nombre].get(clave)
+        if serie is None:
+            serie = self.histogramas[nombre][clave] = [0] * (len(cubetas) + 3)
+        serie[bisect_left(cubetas, valor)] += 1
+        serie[-2] += valor
+        serie[-1] += 1
+
+    def registrar(self, vista, accion, metodo, estado, duracion, tamanio, consultas, db, cache=None):
+        clave = (vista, accion)
+        with self._lock:
+            self.solicitudes[(vista, accion, metodo, estado)] += 1
+            self.db_segundos[clave] += db
+            self._observar('latencia', clave, duracion)
+            self._observar('consultas', clave, consultas)
+            if tamanio is not None:
+                self._observar('tamanio', clave, tamanio)
+            if cache is not None:
+                self.cache[(vista, accion, cache)] += 1
+            vencido = time.monotonic() - self._guardado >= settings.METRICAS_INTERVALO
+        if vencido and settings.METRICAS_DIRECTORIO:
+            self.guardar()
+
+    def exportar(self):
+        """Copia serializable en JSON del registro"""
+        with self._lock:
+            return {
+                'solicitudes': [[*clave, cantidad] for clave, cantidad in self.solicitudes.items()],
+                'db_segundos': [[*clave, segundos] for clave, segundos in self.db_segundos.items()],
+                'cache': [[*clave, cantidad] for clave, cantidad in self.cache.items()],
+                'histogramas': {
+                    nombre: [[*clave, list(serie)] for clave, serie in series.items()]
+                    for nombre, series in self.histogramas.items()
+                },
+                'pools': estado_pools(),
+            }
+
+    def archivo(self):
+        if self._archivo is None:
+            self._archivo = os.path.join(
+                settings.METRICAS_DIRECTORIO, f'{os.getpid()}-{secrets.token_hex(4)}.json'
+            )
+        return self._archivo
+
+    def guardar(self):
+        """Vuelca el registro al archivo de este proceso, salvo que otro hilo ya lo esté haciendo"""
+        if not self._lock_guardado.acquire(blocking=False):
+            return
+        try:
+            self._guardado = time.monotonic()
+            datos = self.exportar()
+            archivo = self.archivo()
+            os.makedirs(os.path.dirname(archivo), exist_ok=True)
+            temporal = f'{archivo}.tmp'
+            with open(temporal, 'w', encoding='utf-8') as salida:
+                json.dump(datos, salida)
+            os.replace(temporal, archivo)
+        except OSError:
+            logger.exception('No se pudieron guardar las métricas en %s', settings.METRICAS_DIRECTORIO)
+        finally:
+            self._lock_guardado.release()
+
+
+registro = Registro()
+
+
+def combinar(exportados):
+    """Suma los registros exportados por varios procesos"""
+    solicitudes, db_segundos, cache = Counter(), Counter(), Counter()
+    histogramas = {nombre: {} for nombre in HISTOGRAMAS}
+    pools = {}
+    for datos in exportados:
+        for *clave, cantidad in datos['solicitudes']:
+            solicitudes[tuple(clave)] += cantidad
+        for *clave, segundos in datos['db_segundos']:
+            db_segundos[tuple(clave)] += segundos
+        for *clave, cantidad in datos['cache']:
+            cache[tuple(clave)] += cantidad
+        for nombre, series in datos['histogramas'].items():
+            for vista, accion, serie in series:
+                actual = histogramas[nombre].setdefault((vista, accion), [0] * len(serie))
+                for indice, valor in enumerate(serie):
+                    actual[indice] += valor
+        for alias, estadisticas in datos.get('pools', {}).items():
+            suma = pools.setdefault(alias, Counter())
+            suma.update(estadisticas)
+    return {
+        'solicitudes': solicitudes, 'db_segundos': db_segundos, 'cache': cache,
+        'histogramas': histogramas, 'pools': pools, 'procesos': len(exportados),
+    }
+
+
+def recolectar():
+    """Registros de todos los procesos: el propio en memoria y los demás desde sus archivos"""
+    exportados = [registro.exportar()]
+    directorio = settings.METRICAS_DIRECTORIO
+    if not directorio:
+        return combinar(exportados)
+    registro.guardar()
+    propio = registro.archivo()
+    limite = time.time() - settings.METRICAS_RETENCION
+    for archivo in glob.glob(os.path.join(directorio, '*.json')):
+        if archivo == propio:
+            continue
+        try:
+            if os.path.getmtime(archivo) < limite:
+                os.remove(archivo)
+                continue
+            with open(archivo, encoding='utf-8') as entrada:
+                exportados.append(json.load(entrada))
+        except (OSError, ValueError):
+            # Borrado o reemplazado por otro proceso mientras se leía
+            continue
+    return combinar(exportados)
+
+
+def formato_prometheus(datos):
+    lineas = []
+
+    def metrica(nombre, tipo, descripcion):
+        lineas.append(f'# HELP {nombre} {descripcion}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+
+    metrica('transporte_solicitudes_total', 'counter', 'Solicitudes atendidas')
+    for (vista, accion, metodo, estado), cantidad in sorted(datos['solicitudes'].items()):
+        etiquetas = _etiquetas(vista=vista, accion=accion, metodo=metodo, estado=estado)
+        lineas.append(f'transporte_solicitudes_total{etiquetas} {cantidad}')
+
+    for nombre, (metrica_nombre, descripcion, cubetas) in HISTOGRAMAS.items():
+        metrica(metrica_nombre, 'histogram', descripcion)
+        for (vista, accion), serie in sorted(datos['histogramas'][nombre].items()):
+            acumulado = 0
+            for limite, cantidad in zip((*cubetas, '+Inf'), serie):
+                acumulado += cantidad
+                etiquetas = _etiquetas(vista=vista, accion=accion, le=limite)
+                lineas.append(f'{metrica_nombre}_bucket{etiquetas} {acumulado}')
+            etiquetas = _etiquetas(vista=vista, accion=accion)
+            lineas.append(f'{metrica_nombre}_sum{etiquetas} {_numero(serie[-2])}')
+            lineas.append(f'{metrica_nombre}_count{etiquetas} {serie[-1]}')
+
+    metrica('transporte_db_segundos_total', 'counter', 'Tiempo de ejecución de SQL')
+    for (vista, accion), segundos in sorted(datos['db_segundos'].items()):
+        lineas.append(f'transporte_db_segundos_total{_etiquetas(vista=vista, accion=accion)} {_numero(float(segundos))}')
+
+    metrica('transporte_cache_respuestas_total', 'counter', 'Consultas a la cache de respuestas')
+    por_vista = {}
+    for (vista, accion, resultado), cantidad in sorted(datos['cache'].items()):
+        lineas.append(
+            f'transporte_cache_respuestas_total{_etiquetas(vista=vista, accion=accion, resultado=resultado)} {cantidad}'
+        )
+        aciertos, total = por_vista.get((vista, accion), (0, 0))
+        por_vista[(vista, accion)] = (aciertos + cantidad * (resultado == 'acierto'), total + cantidad)
+    metrica('transporte_cache_respuestas_tasa_aciertos', 'gauge', 'Proporción de aciertos de la cache de respuestas')
+    for (vista, accion), (aciertos, total) in sorted(por_vista.items()):
+        lineas.append(
+            f'transporte_cache_respuestas_tasa_aciertos{_etiquetas(vista=vista, accion=accion)} {_numero(aciertos / total)}'
+        )
+
+    if datos['pools']:
+        metrica('transporte_db_pool', 'gauge', 'Estadísticas de los pools de conexiones (suma de los procesos)')
+        for alias, estadisticas in sorted(datos['pools'].items()):
+            for nombre, valor in sorted(estadisticas.items()):
+                lineas.append(f'transporte_db_pool{_etiquetas(alias=alias, estadistica=nombre)} {valor}')
+        metrica('transporte_db_pool_saturacion', 'gauge', 'Proporción de las conexiones máximas del pool en uso')
+        for alias, estadisticas in sorted(datos['pools'].items()):
+            saturacion = saturacion_pool(estadisticas)
+            if saturacion is not None:
+                lineas.append(f'transporte_db_pool_saturacion{_etiquetas(alias=alias)} {_numero(saturacion)}')
+        metrica('transporte_db_pool_esperando', 'gauge', 'Solicitudes esperando una conexión del pool')
+        for alias, estadisticas in sorted(datos['pools'].items()):
+            lineas.append(
+                f"transporte_db_pool_esperando{_etiquetas(alias=alias)} {estadisticas.get('requests_waiting', 0)}"
+            )
+        metrica('transporte_db_pool_esperas_total', 'counter', 'Pedidos de conexión que tuvieron que esperar')
+        for alias, estadisticas in sorted(datos['pools'].items()):
+            lineas.append(
+                f"transporte_db_pool_esperas_total{_etiquetas(alias=alias)} {estadisticas.get('requests_queued', 0)}"
+            )
+        metrica('transporte_db_pool_espera_segundos_total', 'counter', 'Tiempo esperando una conexión del pool')
+        for alias, estadisticas in sorted(datos['pools'].items()):
+            segundos = estadisticas.get('requests_wait_ms', 0) / 1000
+            lineas.append(f'transporte_db_pool_espera_segundos_total{_etiquetas(alias=alias)} {_numero(segundos)}')
+
+    metrica('transporte_procesos', 'gauge', 'Procesos cuyas métricas se sumaron')
+    lineas.append(f"transporte_procesos {datos['procesos']}")
+    return '\n'.join(lineas) + '\n'
+
+
+class TokenMetricasAuthentication(BaseAuthentication):
+    """
+    `Authorization: Bearer <METRICAS_TOKEN>` (el scraper de Prometheus): deja
+    `request.auth = 'metricas'` sin usuario. Va antes que JWT, que rechazaría
+    el token.
+    """
+
+    def authenticate(self, request):
+        token = settings.METRICAS_TOKEN
+        if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return AnonymousUser(), AUTH_METRICAS
+        return None
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="api"'
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0002_fecha_actualizacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenBoletosDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo_tarjeta', models.CharField(blank=True, max_length=20)),
+                ('boletos', models.IntegerField(default=0)),
+                ('recaudacion', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('linea', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transporte.linea')),
+                ('ruta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transporte.ruta')),
+            ],
+            options={
+                'verbose_name': 'Resumen de boletos por día',
+                'verbose_name_plural': 'Resúmenes de boletos por día',
+                'db_table': 'resumen_boletos_dia',
+                'indexes': [models.Index(fields=['linea', 'dia'], name='resumen_bol_linea_i_dcdc46_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dia', 'ruta', 'tipo_tarjeta'), name='resumen_boletos_dia_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenBoletosHora',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hora', models.DateTimeField()),
+                ('tipo_tarjeta', models.CharField(blank=True, max_length=20)),
+                ('boletos', models.IntegerField(default=0)),
+                ('recaudacion', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('linea', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transporte.linea')),
+                ('parada_subida', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transporte.parada')),
+                ('ruta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transporte.ruta')),
+            ],
+            options={
+                'verbose_name': 'Resumen de boletos por hora',
+                'verbose_name_plural': 'Resúmenes de boletos por hora',
+                'db_table': 'resumen_boletos_hora',
+                'indexes': [models.Index(fields=['linea', 'hora'], name='resumen_bol_linea_i_2a78ff_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hora', 'ruta', 'parada_subida', 'tipo_tarjeta'), name='resumen_boletos_hora_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenBoletosParadaDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo_tarjeta', models.CharField(blank=True, max_length=20)),
+                ('boletos', models.IntegerField(default=0)),
+                ('recaudacion', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('linea', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transporte.linea')),
+                ('parada_subida', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transporte.parada')),
+                ('ruta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transporte.ruta')),
+            ],
+            options={
+                'verbose_name': 'Resumen de boletos por parada y día',
+                'verbose_name_plural': 'Resúmenes de boletos por parada y día',
+                'db_table': 'resumen_boletos_parada_dia',
+                'indexes': [models.Index(fields=['parada_subida', 'dia'], name='resumen_bol_parada__76f326_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dia', 'ruta', 'parada_subida', 'tipo_tarjeta'), name='resumen_boletos_parada_dia_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-17 12:00
+
+import transporte.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0003_resumen_boletos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='boleto',
+            index=models.Index(fields=['-fecha_compra', '-id'], name='boletos_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boleto',
+            index=models.Index(fields=['viaje', '-fecha_compra', '-id'], name='boletos_viaje_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boleto',
+            index=models.Index(fields=['tarjeta', '-fecha_compra', '-id'], name='boletos_tarjeta_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='horario',
+            index=models.Index(fields=['ruta', 'hora_salida'], name='horarios_ruta_salida_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(fields=['-fecha', '-id'], name='incidentes_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(fields=['resuelto', 'gravedad', '-fecha', '-id'], name='incidentes_estado_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(condition=models.Q(('resuelto', False)), fields=['-fecha', '-id'], name='incidentes_pendientes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mantenimiento',
+            index=models.Index(fields=['-fecha'], name='mantenimientos_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mantenimiento',
+            index=models.Index(fields=['vehiculo', '-fecha'], name='mantenimientos_vehiculo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='viaje',
+            index=transporte.models.IndiceOrden(models.OrderBy(models.F('fecha'), descending=True), models.OrderBy(models.F('hora_salida_real'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='viajes_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='viaje',
+            index=transporte.models.IndiceOrden(models.F('estado'), models.OrderBy(models.F('fecha'), descending=True), models.OrderBy(models.F('hora_salida_real'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='viajes_estado_orden_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-17 13:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+import transporte.busqueda
+from django.db import migrations, models
+
+
+# Las extensiones quedan instaladas al revertir: otras bases de la misma
+# instancia u otros objetos pueden usarlas
+CREAR_SQL = '''
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE TEXT SEARCH CONFIGURATION transporte_es (COPY = pg_catalog.spanish);
+ALTER TEXT SEARCH CONFIGURATION transporte_es
+    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+CREATE FUNCTION transporte_sin_acentos(text) RETURNS text
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+'''
+BORRAR_SQL = '''
+DROP FUNCTION transporte_sin_acentos(text);
+DROP TEXT SEARCH CONFIGURATION transporte_es;
+'''
+
+
+def ejecutar_en_postgres(sql):
+    # La configuración de búsqueda y la función solo existen en PostgreSQL
+    def ejecutar(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql, params=None)
+    return ejecutar
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0004_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.RunPython(ejecutar_en_postgres(CREAR_SQL), ejecutar_en_postgres(BORRAR_SQL)),
+        transporte.busqueda.AgregarIndicePostgres(
+            model_name='chofer',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(transporte.busqueda.SinAcentos(django.db.models.functions.text.Lower(django.db.models.functions.text.Concat(models.F('nombre'), models.Value(' '), models.F('apellido'), models.Value(' '), models.F('dni'), models.Value(' '), models.F('licencia'), output_field=models.TextField()))), name='gin_trgm_ops'), name='choferes_busqueda_trgm'),
+        ),
+        transporte.busqueda.AgregarIndicePostgres(
+            model_name='incidente',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('descripcion', config='transporte_es'), name='incidentes_busqueda_fts'),
+        ),
+        transporte.busqueda.AgregarIndicePostgres(
+            model_name='mantenimiento',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('descripcion', config='transporte_es'), name='mantenimientos_busqueda_fts'),
+        ),
+        transporte.busqueda.AgregarIndicePostgres(
+            model_name='parada',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(transporte.busqueda.SinAcentos(django.db.models.functions.text.Lower(django.db.models.functions.text.Concat(models.F('nombre'), models.Value(' '), models.F('direccion'), output_field=models.TextField()))), name='gin_trgm_ops'), name='paradas_busqueda_trgm'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0005_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PosicionVehiculo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_hora', models.DateTimeField()),
+                ('latitud', models.FloatField()),
+                ('longitud', models.FloatField()),
+                ('velocidad', models.FloatField(blank=True, null=True)),
+                ('rumbo', models.FloatField(blank=True, null=True)),
+                ('vehiculo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posiciones', to='transporte.vehiculo')),
+            ],
+            options={
+                'verbose_name': 'Posición de vehículo',
+                'verbose_name_plural': 'Posiciones de vehículos',
+                'db_table': 'posiciones_vehiculos',
+                'ordering': ['vehiculo', 'fecha_hora'],
+                'indexes': [models.Index(fields=['vehiculo', 'fecha_hora'], name='posiciones_vehiculo_idx')],
+            },
+        ),
+    ]
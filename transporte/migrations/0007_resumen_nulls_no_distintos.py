@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:10
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def unir_filas_sin_parada(apps, schema_editor):
+    """Con NULL distintos pudo haber varias filas por clave sin parada: se suman en una"""
+    for nombre, periodo in (('ResumenBoletosHora', 'hora'), ('ResumenBoletosParadaDia', 'dia')):
+        modelo = apps.get_model('transporte', nombre)
+        repetidas = (
+            modelo.objects.filter(parada_subida__isnull=True).order_by()
+            .values(periodo, 'ruta', 'tipo_tarjeta')
+            .annotate(filas=Count('pk'), primera=Min('pk'), boletos_total=Sum('boletos'), importe=Sum('recaudacion'))
+            .filter(filas__gt=1)
+        )
+        for fila in repetidas:
+            clave = {periodo: fila[periodo], 'ruta': fila['ruta'], 'tipo_tarjeta': fila['tipo_tarjeta']}
+            filas = modelo.objects.filter(parada_subida__isnull=True, **clave)
+            filas.exclude(pk=fila['primera']).delete()
+            filas.filter(pk=fila['primera']).update(boletos=fila['boletos_total'], recaudacion=fila['importe'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0006_posiciones_vehiculos'),
+    ]
+
+    operations = [
+        migrations.RunPython(unir_filas_sin_parada, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='resumenboletoshora',
+            name='resumen_boletos_hora_unico',
+        ),
+        migrations.RemoveConstraint(
+            model_name='resumenboletosparadadia',
+            name='resumen_boletos_parada_dia_unico',
+        ),
+        migrations.AddConstraint(
+            model_name='resumenboletoshora',
+            constraint=models.UniqueConstraint(fields=('hora', 'ruta', 'parada_subida', 'tipo_tarjeta'), name='resumen_boletos_hora_unico', nulls_distinct=False),
+        ),
+        migrations.AddConstraint(
+            model_name='resumenboletosparadadia',
+            constraint=models.UniqueConstraint(fields=('dia', 'ruta', 'parada_subida', 'tipo_tarjeta'), name='resumen_boletos_parada_dia_unico', nulls_distinct=False),
+        ),
+    ]
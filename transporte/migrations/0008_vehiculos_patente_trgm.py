@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:00
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+import transporte.busqueda
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0007_resumen_nulls_no_distintos'),
+    ]
+
+    operations = [
+        transporte.busqueda.AgregarIndicePostgres(
+            model_name='vehiculo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(transporte.busqueda.SinAcentos(django.db.models.functions.text.Lower(models.F('patente'))), name='gin_trgm_ops'), name='vehiculos_patente_trgm'),
+        ),
+    ]
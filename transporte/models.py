@@ -1,5 +1,66 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex, OpClass
+
+from .busqueda import texto_trigramas, vector_busqueda
+
+
+def _total(modelo, campo):
+    """Subconsulta que cuenta las filas de `modelo` que apuntan a la fila externa por `campo`"""
+    conteo = (
+        modelo.objects.filter(**{campo: models.OuterRef('pk')})
+        .order_by()
+        .values(campo)
+        .annotate(total=models.Count('pk'))
+        .values('total')
+    )
+    return Coalesce(models.Subquery(conteo), 0)
+
+
+class IndiceOrden(models.Index):
+    """
+    Índice con el orden en que la paginación por cursor recorre la tabla,
+    con `NULLS LAST` en las columnas que admiten NULL. SQLite no acepta `NULLS
+    LAST` en un índice, pero ahí el NULL es el menor valor y `DESC` ya lo deja
+    al final, así que se omite.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'sqlite':
+            return super().create_sql(model, schema_editor, using=using, **kwargs)
+        indice = self.clone()
+        indice.expressions = tuple(
+            models.OrderBy(expresion.expression, descending=expresion.descending)
+            if isinstance(expresion, models.OrderBy) else expresion
+            for expresion in self.expressions
+        )
+        return super(IndiceOrden, indice).create_sql(model, schema_editor, using=using, **kwargs)
+
+
+class LineaQuerySet(models.QuerySet):
+    def con_totales(self):
+        return self.annotate(total_rutas=_total(Ruta, 'linea'))
+
+
+class VehiculoQuerySet(models.QuerySet):
+    def con_totales(self):
+        return self.annotate(total_viajes=_total(Viaje, 'vehiculo'))
+
+
+class ChoferQuerySet(models.QuerySet):
+    def con_totales(self):
+        return self.annotate(total_viajes=_total(Viaje, 'chofer'))
+
+
+class ViajeQuerySet(models.QuerySet):
+    def con_totales(self):
+        return self.annotate(total_boletos=_total(Boleto, 'viaje'))
+
+
+class TarjetaQuerySet(models.QuerySet):
+    def con_totales(self):
+        return self.annotate(total_boletos=_total(Boleto, 'tarjeta'))
 
 
 class Linea(models.Model):
@@ -8,6 +69,9 @@ class Linea(models.Model):
     nombre = models.CharField(max_length=100)
     color = models.CharField(max_length=50, blank=True, null=True)
     descripcion = models.TextField(blank=True, null=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = LineaQuerySet.as_manager()
     
     class Meta:
         db_table = 'lineas'
@@ -25,12 +89,20 @@ class Parada(models.Model):
     direccion = models.CharField(max_length=200)
     latitud = models.DecimalField(max_digits=10, decimal_places=8, blank=True, null=True)
     longitud = models.DecimalField(max_digits=11, decimal_places=8, blank=True, null=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         db_table = 'paradas'
         verbose_name = 'Parada'
         verbose_name_plural = 'Paradas'
         ordering = ['nombre']
+        # Búsqueda (`busqueda.BusquedaFilter`), con los campos de `search_fields`
+        indexes = [
+            GinIndex(
+                OpClass(texto_trigramas('nombre', 'direccion'), name='gin_trgm_ops'),
+                name='paradas_busqueda_trgm',
+            ),
+        ]
     
     def __str__(self):
         return self.nombre
@@ -41,6 +113,7 @@ class Ruta(models.Model):
     linea = models.ForeignKey(Linea, on_delete=models.CASCADE, related_name='rutas')
     nombre = models.CharField(max_length=100)
     descripcion = models.TextField(blank=True, null=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         db_table = 'rutas'
@@ -56,6 +129,7 @@ class RutaParada(models.Model):
     ruta = models.ForeignKey(Ruta, on_delete=models.CASCADE, related_name='paradas_orden')
     parada = models.ForeignKey(Parada, on_delete=models.CASCADE, related_name='rutas_orden')
     orden = models.IntegerField()
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         db_table = 'ruta_paradas'
@@ -75,12 +149,22 @@ class Vehiculo(models.Model):
     modelo = models.CharField(max_length=50, blank=True, null=True)
     anio = models.IntegerField(blank=True, null=True)
     capacidad = models.IntegerField()
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = VehiculoQuerySet.as_manager()
     
     class Meta:
         db_table = 'vehiculos'
         verbose_name = 'Vehículo'
         verbose_name_plural = 'Vehículos'
         ordering = ['patente']
+        # Búsqueda por patente desde otros modelos (`busqueda.ids_relacionados`)
+        indexes = [
+            GinIndex(
+                OpClass(texto_trigramas('patente'), name='gin_trgm_ops'),
+                name='vehiculos_patente_trgm',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.patente} - {self.marca} {self.modelo}"
@@ -95,12 +179,21 @@ class Chofer(models.Model):
     telefono = models.CharField(max_length=20, blank=True, null=True)
     email = models.EmailField(blank=True, null=True)
     fecha_contratacion = models.DateField()
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = ChoferQuerySet.as_manager()
     
     class Meta:
         db_table = 'choferes'
         verbose_name = 'Chofer'
         verbose_name_plural = 'Choferes'
         ordering = ['apellido', 'nombre']
+        indexes = [
+            GinIndex(
+                OpClass(texto_trigramas('nombre', 'apellido', 'dni', 'licencia'), name='gin_trgm_ops'),
+                name='choferes_busqueda_trgm',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.apellido}, {self.nombre}"
@@ -112,12 +205,14 @@ class Horario(models.Model):
     hora_salida = models.TimeField()
     hora_llegada = models.TimeField()
     dias_semana = models.CharField(max_length=50)  # L,M,X,J,V,S,D
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         db_table = 'horarios'
         verbose_name = 'Horario'
         verbose_name_plural = 'Horarios'
         ordering = ['ruta', 'hora_salida']
+        indexes = [models.Index(fields=['ruta', 'hora_salida'], name='horarios_ruta_salida_idx')]
     
     def __str__(self):
         return f"{self.ruta} - {self.hora_salida} a {self.hora_llegada}"
@@ -139,12 +234,27 @@ class Viaje(models.Model):
     hora_salida_real = models.TimeField(blank=True, null=True)
     hora_llegada_real = models.TimeField(blank=True, null=True)
     estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='programado')
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = ViajeQuerySet.as_manager()
     
     class Meta:
         db_table = 'viajes'
         verbose_name = 'Viaje'
         verbose_name_plural = 'Viajes'
         ordering = ['-fecha', '-hora_salida_real']
+        # Orden del listado paginado por cursor, sin filtro y filtrado por estado
+        indexes = [
+            IndiceOrden(
+                models.F('fecha').desc(), models.F('hora_salida_real').desc(nulls_last=True), models.F('id').desc(),
+                name='viajes_orden_idx',
+            ),
+            IndiceOrden(
+                models.F('estado'), models.F('fecha').desc(), models.F('hora_salida_real').desc(nulls_last=True),
+                models.F('id').desc(),
+                name='viajes_estado_orden_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"Viaje {self.id} - {self.ruta} - {self.fecha}"
@@ -163,6 +273,9 @@ class Tarjeta(models.Model):
     saldo = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     fecha_emision = models.DateField(auto_now_add=True)
     activa = models.BooleanField(default=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = TarjetaQuerySet.as_manager()
     
     class Meta:
         db_table = 'tarjetas'
@@ -187,12 +300,18 @@ class Boleto(models.Model):
         blank=True, 
         null=True
     )
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         db_table = 'boletos'
         verbose_name = 'Boleto'
         verbose_name_plural = 'Boletos'
         ordering = ['-fecha_compra']
+        indexes = [
+            models.Index(fields=['-fecha_compra', '-id'], name='boletos_orden_idx'),
+            models.Index(fields=['viaje', '-fecha_compra', '-id'], name='boletos_viaje_orden_idx'),
+            models.Index(fields=['tarjeta', '-fecha_compra', '-id'], name='boletos_tarjeta_orden_idx'),
+        ]
     
     def __str__(self):
         return f"Boleto {self.id} - ${self.monto}"
@@ -210,12 +329,18 @@ class Mantenimiento(models.Model):
     fecha = models.DateField()
     descripcion = models.TextField()
     costo = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         db_table = 'mantenimientos'
         verbose_name = 'Mantenimiento'
         verbose_name_plural = 'Mantenimientos'
         ordering = ['-fecha']
+        indexes = [
+            GinIndex(vector_busqueda('descripcion'), name='mantenimientos_busqueda_fts'),
+            models.Index(fields=['-fecha'], name='mantenimientos_fecha_idx'),
+            models.Index(fields=['vehiculo', '-fecha'], name='mantenimientos_vehiculo_idx'),
+        ]
     
     def __str__(self):
         return f"{self.vehiculo} - {self.tipo} - {self.fecha}"
@@ -232,12 +357,125 @@ class Incidente(models.Model):
         ('alta', 'Alta'),
     ])
     resuelto = models.BooleanField(default=False)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         db_table = 'incidentes'
         verbose_name = 'Incidente'
         verbose_name_plural = 'Incidentes'
         ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['-fecha', '-id'], name='incidentes_orden_idx'),
+            GinIndex(vector_busqueda('descripcion'), name='incidentes_busqueda_fts'),
+            models.Index(fields=['resuelto', 'gravedad', '-fecha', '-id'], name='incidentes_estado_orden_idx'),
+            # Los pendientes son pocos y son los que se consultan
+            models.Index(
+                fields=['-fecha', '-id'], condition=models.Q(resuelto=False), name='incidentes_pendientes_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"Incidente {self.id} - {self.gravedad} - {self.fecha.strftime('%d/%m/%Y')}"
+
+
+class PosicionVehiculo(models.Model):
+    """
+    Recorrido submuestreado de un vehículo. Las posiciones recientes viven en
+    memoria (ver `posiciones.RegistroPosiciones`); acá se guarda una cada
+    `POSICIONES_INTERVALO_GUARDADO` segundos por vehículo.
+    """
+    vehiculo = models.ForeignKey(Vehiculo, on_delete=models.CASCADE, related_name='posiciones')
+    fecha_hora = models.DateTimeField()
+    latitud = models.FloatField()
+    longitud = models.FloatField()
+    velocidad = models.FloatField(blank=True, null=True)  # km/h
+    rumbo = models.FloatField(blank=True, null=True)  # grados desde el norte
+    
+    class Meta:
+        db_table = 'posiciones_vehiculos'
+        verbose_name = 'Posición de vehículo'
+        verbose_name_plural = 'Posiciones de vehículos'
+        ordering = ['vehiculo', 'fecha_hora']
+        indexes = [models.Index(fields=['vehiculo', 'fecha_hora'], name='posiciones_vehiculo_idx')]
+    
+    def __str__(self):
+        return f"{self.vehiculo} - {self.fecha_hora}"
+
+
+class ResumenBoletosHora(models.Model):
+    """
+    Boletos y recaudación por hora, ruta, parada de subida y tipo de tarjeta.
+    Se mantiene al registrar boletos (ver `estadisticas.acumular_boletos`).
+    """
+    hora = models.DateTimeField()
+    linea = models.ForeignKey(Linea, on_delete=models.CASCADE, related_name='+')
+    ruta = models.ForeignKey(Ruta, on_delete=models.CASCADE, related_name='+')
+    parada_subida = models.ForeignKey(Parada, on_delete=models.SET_NULL, related_name='+', blank=True, null=True)
+    tipo_tarjeta = models.CharField(max_length=20, blank=True)  # vacío: sin tarjeta
+    boletos = models.IntegerField(default=0)
+    recaudacion = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'resumen_boletos_hora'
+        verbose_name = 'Resumen de boletos por hora'
+        verbose_name_plural = 'Resúmenes de boletos por hora'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hora', 'ruta', 'parada_subida', 'tipo_tarjeta'], name='resumen_boletos_hora_unico',
+                # Los boletos sin parada de subida van todos a la misma fila
+                nulls_distinct=False,
+            ),
+        ]
+        indexes = [models.Index(fields=['linea', 'hora'])]
+    
+    def __str__(self):
+        return f"{self.hora} - {self.ruta} - {self.boletos} boletos"
+
+
+class ResumenBoletosParadaDia(models.Model):
+    """Boletos y recaudación por día (hora local), ruta, parada de subida y tipo de tarjeta"""
+    dia = models.DateField()
+    linea = models.ForeignKey(Linea, on_delete=models.CASCADE, related_name='+')
+    ruta = models.ForeignKey(Ruta, on_delete=models.CASCADE, related_name='+')
+    parada_subida = models.ForeignKey(Parada, on_delete=models.SET_NULL, related_name='+', blank=True, null=True)
+    tipo_tarjeta = models.CharField(max_length=20, blank=True)  # vacío: sin tarjeta
+    boletos = models.IntegerField(default=0)
+    recaudacion = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'resumen_boletos_parada_dia'
+        verbose_name = 'Resumen de boletos por parada y día'
+        verbose_name_plural = 'Resúmenes de boletos por parada y día'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dia', 'ruta', 'parada_subida', 'tipo_tarjeta'], name='resumen_boletos_parada_dia_unico',
+                # Los boletos sin parada de subida van todos a la misma fila
+                nulls_distinct=False,
+            ),
+        ]
+        indexes = [models.Index(fields=['parada_subida', 'dia'])]
+    
+    def __str__(self):
+        return f"{self.dia} - {self.parada_subida} - {self.boletos} boletos"
+
+
+class ResumenBoletosDia(models.Model):
+    """Boletos y recaudación por día (hora local), ruta y tipo de tarjeta"""
+    dia = models.DateField()
+    linea = models.ForeignKey(Linea, on_delete=models.CASCADE, related_name='+')
+    ruta = models.ForeignKey(Ruta, on_delete=models.CASCADE, related_name='+')
+    tipo_tarjeta = models.CharField(max_length=20, blank=True)  # vacío: sin tarjeta
+    boletos = models.IntegerField(default=0)
+    recaudacion = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'resumen_boletos_dia'
+        verbose_name = 'Resumen de boletos por día'
+        verbose_name_plural = 'Resúmenes de boletos por día'
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'ruta', 'tipo_tarjeta'], name='resumen_boletos_dia_unico'),
+        ]
+        indexes = [models.Index(fields=['linea', 'dia'])]
+    
+    def __str__(self):
+        return f"{self.dia} - {self.ruta} - {self.boletos} boletos"
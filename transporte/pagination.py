@@ -0,0 +1,207 @@
+"""
+Paginación por cursor (keyset) para las tablas de alto volumen.
+
+A diferencia de `PageNumberPagination` no ejecuta `COUNT(*)` ni recorre un
+`OFFSET`: cada página filtra a partir de los valores de la última fila vista,
+por lo que su costo no depende de la profundidad. El cursor guarda los valores
+de todas las columnas de orden (`Meta.ordering` o `?ordering=`) más el `id`
+como desempate, así que el orden es total y el cursor es estable aunque se
+inserten filas nuevas. Los NULL se ordenan siempre como el menor valor.
+"""
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = 'Cursor inválido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.consulta_pagina(queryset, request)
+        return self.recibir_filas(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """`paginate_queryset` con el ORM asíncrono"""
+        queryset = self.consulta_pagina(queryset, request)
+        return self.recibir_filas([fila async for fila in queryset[:self.page_size + 1]])
+
+    def consulta_pagina(self, queryset, request):
+        """Queryset ordenado y filtrado a partir del cursor de la request"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.orden = self.get_orden(queryset)
+        self.posicion, self.reverso = self.decode_cursor(request)
+
+        queryset = self.cargar_columnas_orden(queryset)
+        queryset = queryset.order_by(*self.expresiones_orden(self.reverso))
+        if self.posicion is not None:
+            queryset = queryset.filter(self.filtro_posterior(self.posicion, self.reverso))
+        return queryset
+
+    def recibir_filas(self, filas):
+        """Página a partir de las filas traídas (una más que `page_size` para saber si hay más)"""
+        hay_mas = len(filas) > self.page_size
+        filas = filas[:self.page_size]
+        if self.reverso:
+            filas.reverse()
+            self.has_next, self.has_previous = True, hay_mas
+        else:
+            self.has_next, self.has_previous = hay_mas, self.posicion is not None
+        self.page = filas
+        return filas
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_orden(self, queryset):
+        """Lista de `(campo, descendente)` terminada en la clave primaria"""
+        modelo = queryset.model
+        nombres = list(queryset.query.order_by) or list(modelo._meta.ordering)
+        orden = []
+        for nombre in nombres:
+            descendente = nombre.startswith('-')
+            campo = modelo._meta.get_field(nombre.lstrip('-'))
+            orden.append((campo, descendente))
+        pk = modelo._meta.pk
+        if all(campo != pk for campo, _ in orden):
+            orden.append((pk, orden[-1][1] if orden else False))
+        return orden
+
+    def cargar_columnas_orden(self, queryset):
+        """Si el queryset usa `.only()`, agrega las columnas que necesita el cursor"""
+        nombres, diferidos = queryset.query.deferred_loading
+        if nombres and not diferidos:
+            queryset = queryset.only(*nombres, *(campo.name for campo, _ in self.orden))
+        return queryset
+
+    def expresiones_orden(self, reverso):
+        expresiones = []
+        for campo, descendente in self.orden:
+            descendente = descendente != reverso
+            expresion = F(campo.attname)
+            if campo.null:
+                expresion = expresion.desc(nulls_last=True) if descendente else expresion.asc(nulls_first=True)
+            else:
+                expresion = expresion.desc() if descendente else expresion.asc()
+            expresiones.append(expresion)
+        return expresiones
+
+    def filtro_posterior(self, posicion, reverso):
+        """
+        Condición lexicográfica "viene después de `posicion`":
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND id > z),
+        con el sentido de cada comparación según su dirección.
+        """
+        condicion = Q(pk__in=[])
+        iguales = Q()
+        for (campo, descendente), valor in zip(self.orden, posicion):
+            descendente = descendente != reverso
+            nombre = campo.attname
+            if valor is None:
+                if not descendente:
+                    condicion |= iguales & Q(**{f'{nombre}__isnull': False})
+                iguales &= Q(**{f'{nombre}__isnull': True})
+                continue
+            posterior = Q(**{f'{nombre}__{"lt" if descendente else "gt"}': valor})
+            if campo.null and descendente:
+                posterior |= Q(**{f'{nombre}__isnull': True})
+            condicion |= iguales & posterior
+            iguales &= Q(**{nombre: valor})
+        return condicion
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            datos = json.loads(b64decode(cursor.encode('ascii')).decode('utf-8'))
+            valores = datos['p']
+            if len(valores) != len(self.orden):
+                raise ValueError
+            posicion = [
+                None if valor is None else campo.to_python(valor)
+                for (campo, _), valor in zip(self.orden, valores)
+            ]
+            return posicion, bool(datos.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, fila, reverso):
+        valores = []
+        for campo, _ in self.orden:
+            valor = getattr(fila, campo.attname)
+            if valor is not None and not isinstance(valor, (int, str)):
+                valor = valor.isoformat() if hasattr(valor, 'isoformat') else str(valor)
+            valores.append(valor)
+        datos = json.dumps({'p': valores, 'r': reverso}, separators=(',', ':'))
+        cursor = b64encode(datos.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverso=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverso=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor de paginación devuelto en next/previous.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cantidad de resultados por página.',
+                'schema': {'type': 'integer'},
+            },
+        ]
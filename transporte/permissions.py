@@ -1,5 +1,8 @@
 from rest_framework import permissions
 
+from .metricas import AUTH_METRICAS
+from .posiciones import AUTH_POSICIONES
+
 
 class IsAdminOrReadOnly(permissions.BasePermission):
     """
@@ -40,3 +43,29 @@ class IsOwnerOrAdmin(permissions.BasePermission):
             return obj.user == request.user
         
         return False
+
+
+class IsAdminOrMetricsScraper(permissions.BasePermission):
+    """
+    Permiso para /api/metrics:
+    - Administradores autenticados
+    - El scraper autenticado con METRICAS_TOKEN (ver TokenMetricasAuthentication)
+    """
+    
+    def has_permission(self, request, view):
+        if request.auth == AUTH_METRICAS:
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+class IsAdminOrPositionsGateway(permissions.BasePermission):
+    """
+    Permiso para la ingesta de posiciones (POST /api/vehiculos/posiciones/):
+    - Administradores autenticados
+    - La pasarela autenticada con POSICIONES_TOKEN (ver TokenPosicionesAuthentication)
+    """
+    
+    def has_permission(self, request, view):
+        if request.auth == AUTH_POSICIONES:
+            return True
+        return bool(request.user and request.user.is_staff)
@@ -0,0 +1,436 @@
+"""
+Planificador de viajes sobre la red de rutas y horarios.
+
+La red se compila en memoria a partir de `Ruta`, `RutaParada` y `Horario`:
+cada horario es un viaje que recorre las paradas de su ruta en orden, con la
+hora de paso por cada parada interpolada entre `hora_salida` y `hora_llegada`
+(proporcional a la distancia si todas las paradas tienen coordenadas, o al
+número de parada si no). Los viajes de una ruta se agrupan en patrones en los
+que ningún viaje adelanta a otro, y por cada día de la semana se guardan
+ordenados junto con una columna de horas por parada para buscar con bisección.
+
+Las consultas usan RAPTOR (Delling et al.): rondas en las que cada una suma un
+viaje más, recorriendo solo los patrones que pasan por paradas mejoradas en la
+ronda anterior. Devuelve los itinerarios Pareto-óptimos por llegada y
+transbordos.
+
+El índice se invalida por ruta desde las señales de los modelos y se
+recompila solo lo invalidado en la próxima consulta. Como las señales solo
+llegan al proceso que hizo el cambio, el índice además se reconstruye entero
+cuando supera `PLANIFICADOR_MAX_EDAD` segundos: en un hilo aparte, mientras
+las consultas siguen usando la red anterior (solo la primera espera a que se
+compile).
+"""
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from heapq import merge
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Parada, Ruta, RutaParada, Horario
+
+DIAS = 'LMXJVSD'
+SEGUNDOS_DIA = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def dias_a_mascara(dias_semana):
+    """
+    Convierte `dias_semana` ("L,M,X,J,V", "L-V", "S D") en una máscara de bits
+    donde el bit 0 es el lunes (igual que `date.weekday()`).
+    """
+    mascara = 0
+    for parte in (dias_semana or '').upper().replace(' ', ',').split(','):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if '-' in parte:
+            desde, _, hasta = parte.partition('-')
+            if desde[:1] in DIAS and hasta[:1] in DIAS:
+                inicio, fin = DIAS.index(desde[:1]), DIAS.index(hasta[:1])
+                for dia in range(inicio, fin + 1) if inicio <= fin else [*range(inicio, 7), *range(fin + 1)]:
+                    mascara |= 1 << dia
+        elif parte[:1] in DIAS:
+            mascara |= 1 << DIAS.index(parte[:1])
+    return mascara
+
+
+def a_segundos(hora):
+    return hora.hour * 3600 + hora.minute * 60 + hora.second
+
+
+def formatear_hora(segundos):
+    segundos %= SEGUNDOS_DIA
+    return f'{segundos // 3600:02d}:{segundos // 60 % 60:02d}:{segundos % 60:02d}'
+
+
+def _haversine(a, b):
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+
+def fracciones_recorrido(paradas, coordenadas):
+    """Fracción del recorrido total en la que está cada parada"""
+    if len(paradas) < 2:
+        return [0.0] * len(paradas)
+    puntos = [coordenadas.get(parada) for parada in paradas]
+    if all(puntos):
+        acumulado = [0.0]
+        for anterior, siguiente in zip(puntos, puntos[1:]):
+            acumulado.append(acumulado[-1] + _haversine(anterior, siguiente))
+        if acumulado[-1] > 0:
+            return [distancia / acumulado[-1] for distancia in acumulado]
+    return [posicion / (len(paradas) - 1) for posicion in range(len(paradas))]
+
+
+class Patron:
+    """Secuencia de paradas con viajes que no se adelantan entre sí"""
+    __slots__ = ('ruta', 'paradas', 'por_dia')
+
+    def __init__(self, ruta, paradas):
+        self.ruta = ruta
+        self.paradas = paradas
+        # dia -> (horas de cada viaje, ids de horario, columnas de horas por parada)
+        self.por_dia = {}
+
+
+def compilar_ruta(ruta, paradas, horarios, coordenadas):
+    """
+    Compila una ruta en sus patrones. `horarios` son tuplas
+    `(horario_id, hora_salida, hora_llegada, dias_semana)`.
+    """
+    if not paradas:
+        return []
+    fracciones = fracciones_recorrido(paradas, coordenadas)
+    viajes = []
+    for horario_id, hora_salida, hora_llegada, dias_semana in horarios:
+        salida, llegada = a_segundos(hora_salida), a_segundos(hora_llegada)
+        if llegada < salida:
+            llegada += SEGUNDOS_DIA
+        horas = tuple(round(salida + (llegada - salida) * fraccion) for fraccion in fracciones)
+        viajes.append((horas, horario_id, dias_a_mascara(dias_semana)))
+    viajes.sort()
+
+    # Cada viaje va al primer grupo cuyo último viaje no lo adelanta en ninguna parada
+    grupos = []
+    for viaje in viajes:
+        for grupo in grupos:
+            if all(a <= b for a, b in zip(grupo[-1][0], viaje[0])):
+                grupo.append(viaje)
+                break
+        else:
+            grupos.append([viaje])
+
+    patrones = []
+    for grupo in grupos:
+        patron = Patron(ruta, tuple(paradas))
+        for dia in range(7):
+            del_dia = [(horas, horario_id) for horas, horario_id, mascara in grupo if mascara >> dia & 1]
+            if del_dia:
+                horas = [horas for horas, _ in del_dia]
+                patron.por_dia[dia] = (
+                    horas,
+                    [horario_id for _, horario_id in del_dia],
+                    [list(columna) for columna in zip(*horas)],
+                )
+        if patron.por_dia:
+            patrones.append(patron)
+    return patrones
+
+
+class Red:
+    """Vista inmutable del índice usada por las consultas"""
+
+    def __init__(self, patrones_por_ruta, rutas, paradas):
+        self.rutas = rutas
+        self.paradas = paradas
+        # (parada, dia) -> (horas ordenadas, [(hora, patron, viaje)]), compilado al consultar
+        self._salidas = {}
+        self.por_parada = defaultdict(list)
+        for patrones in patrones_por_ruta.values():
+            for patron in patrones:
+                for posicion, parada in enumerate(patron.paradas):
+                    self.por_parada[parada].append((patron, posicion))
+
+    def planificar(self, origen, destino, salida, dia, max_transbordos=3):
+        """
+        Itinerarios de `origen` a `destino` saliendo desde `salida` (segundos
+        desde medianoche) el `dia` (0 = lunes). Devuelve uno por cantidad de
+        viajes que mejora la llegada, del de menos transbordos al más rápido.
+        """
+        if origen == destino:
+            return []
+        llegadas = {origen: salida}
+        etiquetas = [{}]
+        marcadas = {origen}
+        for ronda in range(1, max_transbordos + 2):
+            anteriores = dict(llegadas)
+            cola = {}
+            for parada in marcadas:
+                for patron, posicion in self.por_parada.get(parada, ()):
+                    if dia in patron.por_dia and posicion < cola.get(patron, len(patron.paradas)):
+                        cola[patron] = posicion
+            marcadas = set()
+            etiquetas_ronda = {}
+            for patron, inicio in cola.items():
+                horas, _, columnas = patron.por_dia[dia]
+                viaje = subida = None
+                for posicion in range(inicio, len(patron.paradas)):
+                    parada = patron.paradas[posicion]
+                    if viaje is not None:
+                        llegada = horas[viaje][posicion]
+                        limite = min(llegadas.get(parada, math.inf), llegadas.get(destino, math.inf))
+                        if llegada < limite:
+                            llegadas[parada] = llegada
+                            etiquetas_ronda[parada] = (patron, viaje, subida, posicion)
+                            marcadas.add(parada)
+                    previa = anteriores.get(parada)
+                    if previa is not None and (viaje is None or previa <= horas[viaje][posicion]):
+                        candidato = bisect_left(columnas[posicion], previa)
+                        if candidato < len(horas) and (viaje is None or candidato < viaje):
+                            viaje, subida = candidato, posicion
+            etiquetas.append(etiquetas_ronda)
+            if not marcadas:
+                break
+        return [
+            self._reconstruir(etiquetas, ronda, destino, dia)
+            for ronda in range(1, len(etiquetas))
+            if destino in etiquetas[ronda]
+        ]
+
+    def salidas(self, parada, dia):
+        """Salidas de `parada` el `dia`, ordenadas por hora (sin las de fin de recorrido)"""
+        clave = (parada, dia)
+        if clave not in self._salidas:
+            salidas = sorted(
+                (hora, id(patron), patron, viaje)
+                for patron, posicion in self.por_parada.get(parada, ())
+                if dia in patron.por_dia and posicion < len(patron.paradas) - 1
+                for viaje, hora in enumerate(patron.por_dia[dia][2][posicion])
+            )
+            self._salidas[clave] = (
+                [hora for hora, *_ in salidas],
+                [(hora, patron, viaje) for hora, _, patron, viaje in salidas],
+            )
+        return self._salidas[clave]
+
+    def proximas_salidas(self, parada, desde, dia, cantidad):
+        """
+        Las próximas `cantidad` salidas de `parada` desde `desde` (segundos)
+        del `dia`, siguiendo en los días posteriores si hace falta. Incluye los
+        viajes del día anterior que pasan después de medianoche. Cada salida
+        lleva `dias`: cuántos días después del consultado ocurre.
+        """
+        def del_dia(desplazamiento):
+            servicio = (dia + desplazamiento) % 7
+            horas, salidas = self.salidas(parada, servicio)
+            inicio = bisect_left(horas, desde - desplazamiento * SEGUNDOS_DIA)
+            for hora, patron, viaje in islice(salidas, inicio, None):
+                yield hora + desplazamiento * SEGUNDOS_DIA, id(patron), viaje, patron, servicio
+
+        proximas = merge(*(del_dia(desplazamiento) for desplazamiento in range(-1, 8)))
+        resultado = []
+        for hora, _, viaje, patron, servicio in islice(proximas, cantidad):
+            ruta = self.rutas[patron.ruta]
+            resultado.append({
+                'dias': hora // SEGUNDOS_DIA,
+                'hora': formatear_hora(hora),
+                'ruta': patron.ruta,
+                'ruta_nombre': ruta['nombre'],
+                'linea': ruta['linea'],
+                'linea_numero': ruta['linea_numero'],
+                'horario': patron.por_dia[servicio][1][viaje],
+                'hacia': self.paradas[patron.paradas[-1]]['nombre'],
+            })
+        return resultado
+
+    def _reconstruir(self, etiquetas, ronda, destino, dia):
+        tramos = []
+        parada = destino
+        while ronda > 0:
+            patron, viaje, subida, bajada = etiquetas[ronda][parada]
+            horas, horarios, _ = patron.por_dia[dia]
+            ruta = self.rutas[patron.ruta]
+            tramos.append({
+                'ruta': patron.ruta,
+                'ruta_nombre': ruta['nombre'],
+                'linea': ruta['linea'],
+                'linea_numero': ruta['linea_numero'],
+                'horario': horarios[viaje],
+                'desde': patron.paradas[subida],
+                'desde_nombre': self.paradas[patron.paradas[subida]]['nombre'],
+                'hasta': patron.paradas[bajada],
+                'hasta_nombre': self.paradas[patron.paradas[bajada]]['nombre'],
+                'salida': formatear_hora(horas[viaje][subida]),
+                'llegada': formatear_hora(horas[viaje][bajada]),
+            })
+            parada = patron.paradas[subida]
+            ronda -= 1
+            while ronda > 0 and parada not in etiquetas[ronda]:
+                ronda -= 1
+        tramos.reverse()
+        return {
+            'llegada': tramos[-1]['llegada'],
+            'transbordos': len(tramos) - 1,
+            'tramos': tramos,
+        }
+
+
+class IndiceHorarios:
+    """Índice de la red compartido por el proceso, recompilado por ruta"""
+
+    def __init__(self):
+        # `_lock` protege los atributos y las recompilaciones por ruta;
+        # `_lock_construccion` hace que una sola reconstrucción completa lea la
+        # base a la vez, sin bloquear las consultas que usan la red vigente
+        self._lock = threading.Lock()
+        self._lock_construccion = threading.Lock()
+        self._red = None
+        self._patrones = {}
+        self._rutas = {}
+        self._paradas = {}
+        self._rutas_sucias = set()
+        self._paradas_sucias = set()
+        self._construido_en = 0.0
+        self._reconstruccion = None
+        # Sube con `invalidar`: una reconstrucción empezada antes se descarta
+        self._version = 0
+        # `(rutas, paradas)` invalidadas desde que empezó la reconstrucción en curso
+        self._sucias_durante = None
+
+    def invalidar(self):
+        with self._lock:
+            self._red = None
+            self._version += 1
+
+    def invalidar_ruta(self, ruta_id):
+        with self._lock:
+            self._rutas_sucias.add(ruta_id)
+            if self._sucias_durante is not None:
+                self._sucias_durante[0].add(ruta_id)
+
+    def invalidar_parada(self, parada_id):
+        with self._lock:
+            self._paradas_sucias.add(parada_id)
+            if self._sucias_durante is not None:
+                self._sucias_durante[1].add(parada_id)
+
+    def red(self):
+        with self._lock:
+            if self._red is not None:
+                max_edad = getattr(settings, 'PLANIFICADOR_MAX_EDAD', 300)
+                if time.monotonic() - self._construido_en > max_edad and self._reconstruccion is None:
+                    self._reconstruccion = threading.Thread(
+                        target=self._reconstruir_en_segundo_plano, name='planificador', daemon=True
+                    )
+                    self._reconstruccion.start()
+                if self._rutas_sucias or self._paradas_sucias:
+                    self._actualizar()
+                return self._red
+        # Primera consulta (o después de `invalidar`): no hay red que servir
+        with self._lock_construccion:
+            with self._lock:
+                if self._red is not None:
+                    return self._red
+            return self._reconstruir()
+
+    def _cargar_paradas(self):
+        paradas = {}
+        for pk, nombre, latitud, longitud in Parada.objects.values_list('pk', 'nombre', 'latitud', 'longitud'):
+            coordenadas = None
+            if latitud is not None and longitud is not None:
+                coordenadas = (float(latitud), float(longitud))
+            paradas[pk] = {'nombre': nombre, 'coordenadas': coordenadas}
+        return paradas
+
+    def _compilar(self, patrones, rutas_red, paradas_red, ruta_ids=None):
+        """Compila en `patrones` y `rutas_red` las rutas indicadas (todas con `ruta_ids` en `None`)"""
+        rutas = Ruta.objects.values_list('pk', 'nombre', 'linea_id', 'linea__numero')
+        paradas = RutaParada.objects.order_by('ruta_id', 'orden').values_list('ruta_id', 'parada_id')
+        horarios = Horario.objects.values_list('ruta_id', 'pk', 'hora_salida', 'hora_llegada', 'dias_semana')
+        if ruta_ids is not None:
+            rutas = rutas.filter(pk__in=ruta_ids)
+            paradas = paradas.filter(ruta_id__in=ruta_ids)
+            horarios = horarios.filter(ruta_id__in=ruta_ids)
+
+        paradas_por_ruta = defaultdict(list)
+        for ruta_id, parada_id in paradas:
+            paradas_por_ruta[ruta_id].append(parada_id)
+        horarios_por_ruta = defaultdict(list)
+        for ruta_id, *horario in horarios:
+            horarios_por_ruta[ruta_id].append(horario)
+        coordenadas = {pk: parada['coordenadas'] for pk, parada in paradas_red.items()}
+
+        for ruta_id in ruta_ids or ():
+            patrones.pop(ruta_id, None)
+            rutas_red.pop(ruta_id, None)
+        for ruta_id, nombre, linea_id, linea_numero in rutas:
+            rutas_red[ruta_id] = {'nombre': nombre, 'linea': linea_id, 'linea_numero': linea_numero}
+            patrones[ruta_id] = compilar_ruta(
+                ruta_id, paradas_por_ruta[ruta_id], horarios_por_ruta[ruta_id], coordenadas
+            )
+
+    def _reconstruir(self):
+        """Compila la red entera fuera de `_lock` y la reemplaza; devuelve la red a usar"""
+        with self._lock:
+            version = self._version
+            self._sucias_durante = (set(), set())
+        try:
+            paradas = self._cargar_paradas()
+            patrones, rutas = {}, {}
+            self._compilar(patrones, rutas, paradas)
+        except Exception:
+            with self._lock:
+                self._sucias_durante = None
+            raise
+        with self._lock:
+            rutas_sucias, paradas_sucias = self._sucias_durante
+            self._sucias_durante = None
+            if version != self._version:
+                # Invalidada mientras se compilaba: la próxima consulta la vuelve a construir
+                return self._red or Red(patrones, dict(rutas), paradas)
+            self._patrones, self._rutas, self._paradas = patrones, rutas, paradas
+            # Lo invalidado durante la compilación se recompila en la próxima consulta
+            self._rutas_sucias, self._paradas_sucias = rutas_sucias, paradas_sucias
+            self._publicar()
+            self._construido_en = time.monotonic()
+            return self._red
+
+    def _reconstruir_en_segundo_plano(self):
+        try:
+            with self._lock_construccion:
+                self._reconstruir()
+        except Exception:
+            logger.exception('No se pudo reconstruir la red del planificador')
+            # Se sigue usando la red anterior y se reintenta en `PLANIFICADOR_MAX_EDAD` segundos
+            with self._lock:
+                self._construido_en = time.monotonic()
+        finally:
+            with self._lock:
+                self._reconstruccion = None
+            connections.close_all()
+
+    def _actualizar(self):
+        sucias = set(self._rutas_sucias)
+        if self._paradas_sucias:
+            self._paradas = self._cargar_paradas()
+            for ruta_id, patrones in self._patrones.items():
+                if any(self._paradas_sucias.intersection(patron.paradas) for patron in patrones):
+                    sucias.add(ruta_id)
+        self._rutas_sucias, self._paradas_sucias = set(), set()
+        self._compilar(self._patrones, self._rutas, self._paradas, sucias)
+        self._publicar()
+
+    def _publicar(self):
+        self._red = Red(self._patrones, dict(self._rutas), self._paradas)
+
+
+indice = IndiceHorarios()
@@ -0,0 +1,323 @@
+"""
+Posiciones de los vehículos en tiempo real.
+
+Los equipos GPS (o una pasarela que los agrupa) envían lotes de posiciones a
+`POST /api/vehiculos/posiciones/`. Cada vehículo conserva en memoria sus
+últimas `POSICIONES_POR_VEHICULO` posiciones en un buffer circular sobre un
+`array('d')` (tiempo, latitud, longitud, velocidad y rumbo: 40 bytes por
+posición y ningún objeto por punto), y `GET /api/vehiculos/posiciones/` arma
+la foto de la flota sin consultar la base. Las posiciones de un vehículo solo
+se agregan: una que no es posterior a la última registrada se rechaza.
+
+A la base va un recorrido submuestreado, una posición por vehículo cada
+`POSICIONES_INTERVALO_GUARDADO` segundos. Se acumulan y se insertan con
+`bulk_create` cuando hay `POSICIONES_LOTE_GUARDADO` pendientes o pasó ese
+mismo intervalo desde el último guardado; si el proceso termina se pierden a
+lo sumo las pendientes.
+
+El registro es del proceso: con varios workers la ingesta y la foto tienen
+que llegar al mismo (p. ej. con una ruta propia en el balanceador), o cada
+uno ve solo los vehículos que le tocaron.
+
+La ingesta la hacen los administradores o la pasarela de los equipos con
+`Authorization: Bearer <POSICIONES_TOKEN>` (`TokenPosicionesAuthentication`):
+un usuario común no puede mover los vehículos del mapa.
+"""
+import hmac
+import math
+import threading
+import time
+from array import array
+from datetime import datetime, timezone as zona_horaria
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.authentication import BaseAuthentication
+
+from .models import PosicionVehiculo, Vehiculo
+
+MAX_POSICIONES = 20000
+BATCH_SIZE = 1000
+# tiempo (epoch), latitud, longitud, velocidad y rumbo (NaN si no vinieron)
+CAMPOS = 5
+# Tolerancia para los relojes de los equipos adelantados
+MAX_ADELANTO = 60
+AUTH_POSICIONES = 'posiciones'
+
+CAMPO_REQUERIDO = 'Este campo es requerido.'
+ID_INVALIDO = 'Tipo incorrecto. Se esperaba valor de clave primaria.'
+OBJETO_INEXISTENTE = 'Clave primaria "{pk}" inválida - objeto no existe.'
+NUMERO_INVALIDO = 'Se requiere un número válido.'
+FUERA_DE_RANGO = 'Debe estar entre {minimo} y {maximo}.'
+FECHA_INVALIDA = 'Fecha y hora con formato erróneo. Use ISO 8601.'
+FECHA_FUTURA = 'La fecha y hora no puede estar en el futuro.'
+POSICION_ANTERIOR = 'La posición no es posterior a la última registrada del vehículo.'
+
+# campo -> (mínimo, máximo incluido, requerido)
+RANGOS = {
+    'latitud': (-90.0, 90.0, True),
+    'longitud': (-180.0, 180.0, True),
+    'velocidad': (0.0, 1000.0, False),
+    'rumbo': (0.0, 360.0, False),
+}
+
+
+def _numero(fila, campo, errores):
+    minimo, maximo, requerido = RANGOS[campo]
+    valor = fila.get(campo)
+    if valor is None or valor == '':
+        if requerido:
+            errores[campo] = [CAMPO_REQUERIDO]
+        return math.nan
+    if isinstance(valor, bool):
+        errores[campo] = [NUMERO_INVALIDO]
+        return math.nan
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        errores[campo] = [NUMERO_INVALIDO]
+        return math.nan
+    if not minimo <= numero <= maximo:
+        errores[campo] = [FUERA_DE_RANGO.format(minimo=minimo, maximo=maximo)]
+    return numero
+
+
+def _tiempo(fila, ahora, errores):
+    valor = fila.get('fecha_hora')
+    if valor is None or valor == '':
+        return ahora
+    try:
+        fecha = parse_datetime(valor) if isinstance(valor, str) else None
+    except ValueError:
+        fecha = None
+    if fecha is None:
+        errores['fecha_hora'] = [FECHA_INVALIDA]
+        return None
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    tiempo = fecha.timestamp()
+    if tiempo > ahora + MAX_ADELANTO:
+        errores['fecha_hora'] = [FECHA_FUTURA]
+    return tiempo
+
+
+def validar_posicion(fila, ahora):
+    """Valida una posición; devuelve `(vehiculo, (tiempo, latitud, longitud, velocidad, rumbo), errores)`"""
+    if not isinstance(fila, dict):
+        return None, None, {'non_field_errors': ['Se esperaba un objeto.']}
+    errores = {}
+    vehiculo = fila.get('vehiculo')
+    if vehiculo is None or vehiculo == '':
+        errores['vehiculo'] = [CAMPO_REQUERIDO]
+    elif isinstance(vehiculo, bool):
+        errores['vehiculo'] = [ID_INVALIDO]
+    else:
+        try:
+            vehiculo = int(vehiculo)
+        except (TypeError, ValueError):
+            errores['vehiculo'] = [ID_INVALIDO]
+    valores = (
+        _tiempo(fila, ahora, errores),
+        _numero(fila, 'latitud', errores),
+        _numero(fila, 'longitud', errores),
+        _numero(fila, 'velocidad', errores),
+        _numero(fila, 'rumbo', errores),
+    )
+    return vehiculo, valores, errores
+
+
+def _opcional(valor):
+    return None if math.isnan(valor) else valor
+
+
+def formatear_fecha(tiempo, zona):
+    """Como `DateTimeField` de DRF: ISO 8601 en la zona horaria actual"""
+    texto = datetime.fromtimestamp(tiempo, zona).isoformat()
+    return texto[:-6] + 'Z' if texto.endswith('+00:00') else texto
+
+
+def representar(valores, zona):
+    tiempo, latitud, longitud, velocidad, rumbo = valores
+    return {
+        'fecha_hora': formatear_fecha(tiempo, zona),
+        'latitud': latitud,
+        'longitud': longitud,
+        'velocidad': _opcional(velocidad),
+        'rumbo': _opcional(rumbo),
+    }
+
+
+class BufferPosiciones:
+    """Últimas `capacidad` posiciones de un vehículo, en un arreglo circular de floats"""
+    __slots__ = ('datos', 'capacidad', 'siguiente', 'cantidad', 'guardado')
+
+    def __init__(self, capacidad):
+        self.datos = array('d', bytes(8 * CAMPOS * capacidad))
+        self.capacidad = capacidad
+        self.siguiente = 0
+        self.cantidad = 0
+        self.guardado = -math.inf  # tiempo de la última posición enviada a la base
+
+    def agregar(self, valores):
+        inicio = self.siguiente * CAMPOS
+        self.datos[inicio:inicio + CAMPOS] = array('d', valores)
+        self.siguiente = (self.siguiente + 1) % self.capacidad
+        self.cantidad = min(self.cantidad + 1, self.capacidad)
+
+    def ultima(self):
+        inicio = (self.siguiente - 1) % self.capacidad * CAMPOS
+        return tuple(self.datos[inicio:inicio + CAMPOS])
+
+    def ultimo_tiempo(self):
+        return self.datos[(self.siguiente - 1) % self.capacidad * CAMPOS] if self.cantidad else -math.inf
+
+    def posiciones(self):
+        """De la más antigua a la más reciente"""
+        primera = (self.siguiente - self.cantidad) % self.capacidad
+        for desplazamiento in range(self.cantidad):
+            inicio = (primera + desplazamiento) % self.capacidad * CAMPOS
+            yield tuple(self.datos[inicio:inicio + CAMPOS])
+
+
+class RegistroPosiciones:
+    """Buffers de posiciones de la flota compartidos por el proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._vehiculos = None
+        self._vehiculos_en = 0.0
+        self._pendientes = []
+        self._guardado_en = time.monotonic()
+
+    def reiniciar(self):
+        with self._lock:
+            self._buffers = {}
+            self._vehiculos = None
+            self._pendientes = []
+
+    def invalidar_vehiculos(self):
+        with self._lock:
+            self._vehiculos = None
+
+    def olvidar(self, vehiculo):
+        with self._lock:
+            self._buffers.pop(vehiculo, None)
+            self._vehiculos = None
+
+    def _vehiculos_existentes(self):
+        max_edad = settings.POSICIONES_VEHICULOS_MAX_EDAD
+        if self._vehiculos is None or time.monotonic() - self._vehiculos_en > max_edad:
+            self._vehiculos = frozenset(Vehiculo.objects.values_list('pk', flat=True))
+            self._vehiculos_en = time.monotonic()
+        return self._vehiculos
+
+    def agregar(self, filas):
+        """
+        Registra las posiciones válidas de `filas` en el orden del lote y
+        devuelve `(aceptadas, errores)` con un `{'indice', 'errores'}` por
+        cada rechazada.
+        """
+        ahora = time.time()
+        capacidad = settings.POSICIONES_POR_VEHICULO
+        intervalo = settings.POSICIONES_INTERVALO_GUARDADO
+        aceptadas, errores = 0, []
+        with self._lock:
+            existentes = self._vehiculos_existentes()
+            for indice, fila in enumerate(filas):
+                vehiculo, valores, errores_fila = validar_posicion(fila, ahora)
+                if not errores_fila and vehiculo not in existentes:
+                    errores_fila = {'vehiculo': [OBJETO_INEXISTENTE.format(pk=vehiculo)]}
+                if errores_fila:
+                    errores.append({'indice': indice, 'errores': errores_fila})
+                    continue
+                buffer = self._buffers.get(vehiculo)
+                if buffer is None:
+                    buffer = self._buffers[vehiculo] = BufferPosiciones(capacidad)
+                tiempo = valores[0]
+                if tiempo <= buffer.ultimo_tiempo():
+                    errores.append({'indice': indice, 'errores': {'fecha_hora': [POSICION_ANTERIOR]}})
+                    continue
+                buffer.agregar(valores)
+                aceptadas += 1
+                if tiempo - buffer.guardado >= intervalo:
+                    buffer.guardado = tiempo
+                    self._pendientes.append((vehiculo, valores))
+            vencido = time.monotonic() - self._guardado_en >= intervalo
+            lote = None
+            if self._pendientes and (vencido or len(self._pendientes) >= settings.POSICIONES_LOTE_GUARDADO):
+                lote, self._pendientes = self._pendientes, []
+                self._guardado_en = time.monotonic()
+        if lote:
+            self._guardar(lote)
+        return aceptadas, errores
+
+    def guardar_pendientes(self):
+        """Inserta ya las posiciones submuestreadas pendientes"""
+        with self._lock:
+            lote, self._pendientes = self._pendientes, []
+            self._guardado_en = time.monotonic()
+        if lote:
+            self._guardar(lote)
+
+    def _guardar(self, lote):
+        posiciones = [
+            PosicionVehiculo(
+                vehiculo_id=vehiculo, fecha_hora=datetime.fromtimestamp(tiempo, zona_horaria.utc),
+                latitud=latitud, longitud=longitud, velocidad=_opcional(velocidad), rumbo=_opcional(rumbo),
+            )
+            for vehiculo, (tiempo, latitud, longitud, velocidad, rumbo) in lote
+        ]
+        try:
+            with transaction.atomic():
+                PosicionVehiculo.objects.bulk_create(posiciones, batch_size=BATCH_SIZE)
+        except IntegrityError:
+            # Un vehículo se borró desde que se registraron sus posiciones
+            existentes = set(Vehiculo.objects.filter(
+                pk__in={posicion.vehiculo_id for posicion in posiciones}
+            ).values_list('pk', flat=True))
+            PosicionVehiculo.objects.bulk_create(
+                [posicion for posicion in posiciones if posicion.vehiculo_id in existentes], batch_size=BATCH_SIZE
+            )
+
+    def flota(self, max_edad=None):
+        """Última posición de cada vehículo, por id; con `max_edad`, solo las de los últimos segundos"""
+        zona = timezone.get_current_timezone()
+        limite = -math.inf if max_edad is None else time.time() - max_edad
+        with self._lock:
+            ultimas = [(vehiculo, buffer.ultima()) for vehiculo, buffer in self._buffers.items()]
+        return [
+            {'vehiculo': vehiculo, **representar(valores, zona)}
+            for vehiculo, valores in sorted(ultimas) if valores[0] >= limite
+        ]
+
+    def recorrido(self, vehiculo):
+        """Posiciones en memoria del vehículo, de la más antigua a la más reciente"""
+        zona = timezone.get_current_timezone()
+        with self._lock:
+            buffer = self._buffers.get(vehiculo)
+            valores = list(buffer.posiciones()) if buffer is not None else []
+        return [representar(posicion, zona) for posicion in valores]
+
+
+registro = RegistroPosiciones()
+
+
+class TokenPosicionesAuthentication(BaseAuthentication):
+    """
+    `Authorization: Bearer <POSICIONES_TOKEN>` (la pasarela de los equipos
+    GPS): deja `request.auth = 'posiciones'` sin usuario. Va antes que JWT,
+    que rechazaría el token.
+    """
+
+    def authenticate(self, request):
+        token = settings.POSICIONES_TOKEN
+        if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return AnonymousUser(), AUTH_POSICIONES
+        return None
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="api"'
@@ -1,9 +1,24 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from .models import (
     Linea, Parada, Ruta, RutaParada, Vehiculo, Chofer, 
-    Horario, Viaje, Tarjeta, Boleto, Mantenimiento, Incidente
+    Horario, Viaje, Tarjeta, Boleto, Mantenimiento, Incidente, PosicionVehiculo
 )
+from .fieldsets import FieldsetSerializerMixin
+
+
+def _total_anotado(obj, anotacion, relacion):
+    """
+    Devuelve el total que anotó el queryset del viewset (ver `con_totales`)
+    y solo si no está disponible lo consulta a la base de datos.
+    """
+    total = getattr(obj, anotacion, None)
+    if total is None:
+        total = getattr(obj, relacion).count()
+    return total
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -34,7 +49,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return user
 
 
-class LineaSerializer(serializers.ModelSerializer):
+class LineaSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Linea"""
     total_rutas = serializers.SerializerMethodField()
     
@@ -44,10 +59,10 @@ class LineaSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
     
     def get_total_rutas(self, obj):
-        return obj.rutas.count()
+        return _total_anotado(obj, 'total_rutas', 'rutas')
 
 
-class ParadaSerializer(serializers.ModelSerializer):
+class ParadaSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Parada"""
     class Meta:
         model = Parada
@@ -55,7 +70,7 @@ class ParadaSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class RutaParadaSerializer(serializers.ModelSerializer):
+class RutaParadaSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo RutaParada"""
     parada_detalle = ParadaSerializer(source='parada', read_only=True)
     
@@ -65,7 +80,7 @@ class RutaParadaSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class RutaSerializer(serializers.ModelSerializer):
+class RutaSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Ruta"""
     linea_detalle = LineaSerializer(source='linea', read_only=True)
     paradas = RutaParadaSerializer(source='paradas_orden', many=True, read_only=True)
@@ -76,7 +91,7 @@ class RutaSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class VehiculoSerializer(serializers.ModelSerializer):
+class VehiculoSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Vehiculo"""
     total_viajes = serializers.SerializerMethodField()
     
@@ -86,10 +101,10 @@ class VehiculoSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
     
     def get_total_viajes(self, obj):
-        return obj.viajes.count()
+        return _total_anotado(obj, 'total_viajes', 'viajes')
 
 
-class ChoferSerializer(serializers.ModelSerializer):
+class ChoferSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Chofer"""
     nombre_completo = serializers.SerializerMethodField()
     total_viajes = serializers.SerializerMethodField()
@@ -101,15 +116,16 @@ class ChoferSerializer(serializers.ModelSerializer):
             'licencia', 'telefono', 'email', 'fecha_contratacion', 'total_viajes'
         ]
         read_only_fields = ['id']
+        campos_requeridos = {'nombre_completo': ['nombre', 'apellido']}
     
     def get_nombre_completo(self, obj):
         return f"{obj.apellido}, {obj.nombre}"
     
     def get_total_viajes(self, obj):
-        return obj.viajes.count()
+        return _total_anotado(obj, 'total_viajes', 'viajes')
 
 
-class HorarioSerializer(serializers.ModelSerializer):
+class HorarioSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Horario"""
     ruta_detalle = RutaSerializer(source='ruta', read_only=True)
     
@@ -119,7 +135,7 @@ class HorarioSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class ViajeSerializer(serializers.ModelSerializer):
+class ViajeSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Viaje"""
     ruta_detalle = RutaSerializer(source='ruta', read_only=True)
     vehiculo_detalle = VehiculoSerializer(source='vehiculo', read_only=True)
@@ -136,10 +152,10 @@ class ViajeSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
     
     def get_total_boletos(self, obj):
-        return obj.boletos.count()
+        return _total_anotado(obj, 'total_boletos', 'boletos')
 
 
-class TarjetaSerializer(serializers.ModelSerializer):
+class TarjetaSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Tarjeta"""
     total_boletos = serializers.SerializerMethodField()
     
@@ -149,10 +165,10 @@ class TarjetaSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'fecha_emision']
     
     def get_total_boletos(self, obj):
-        return obj.boletos.count()
+        return _total_anotado(obj, 'total_boletos', 'boletos')
 
 
-class BoletoSerializer(serializers.ModelSerializer):
+class BoletoSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Boleto"""
     viaje_detalle = ViajeSerializer(source='viaje', read_only=True)
     tarjeta_detalle = TarjetaSerializer(source='tarjeta', read_only=True)
@@ -179,18 +195,34 @@ class BoletoSerializer(serializers.ModelSerializer):
         return attrs
     
     def create(self, validated_data):
-        """Descontar el saldo de la tarjeta al crear el boleto"""
+        """
+        Descontar el saldo de la tarjeta al crear el boleto.
+        El débito es un único UPDATE condicional (saldo >= monto) en la misma
+        transacción que el INSERT del boleto: no hay lectura previa que se
+        pueda pisar entre requests concurrentes y no se reescriben las demás
+        columnas de la tarjeta. Si no se actualizó ninguna fila, el saldo no
+        alcanzaba al momento del cobro.
+        """
         tarjeta = validated_data.get('tarjeta')
         monto = validated_data.get('monto')
         
-        if tarjeta:
-            tarjeta.saldo -= monto
-            tarjeta.save()
-        
-        return super().create(validated_data)
-
-
-class MantenimientoSerializer(serializers.ModelSerializer):
+        with transaction.atomic():
+            if tarjeta:
+                debitadas = Tarjeta.objects.filter(pk=tarjeta.pk, saldo__gte=monto).update(
+                    saldo=F('saldo') - monto, fecha_actualizacion=timezone.now()
+                )
+                if not debitadas:
+                    raise serializers.ValidationError({
+                        'tarjeta': 'Saldo insuficiente en la tarjeta.'
+                    })
+            boleto = Boleto(**validated_data)
+            # El débito ya actualizó `fecha_actualizacion` de la tarjeta (su total de boletos)
+            boleto._padres_actualizados = {'tarjeta'}
+            boleto.save()
+            return boleto
+
+
+class MantenimientoSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Mantenimiento"""
     vehiculo_detalle = VehiculoSerializer(source='vehiculo', read_only=True)
     
@@ -200,7 +232,7 @@ class MantenimientoSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class IncidenteSerializer(serializers.ModelSerializer):
+class IncidenteSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer para el modelo Incidente"""
     viaje_detalle = ViajeSerializer(source='viaje', read_only=True)
     
@@ -208,3 +240,11 @@ class IncidenteSerializer(serializers.ModelSerializer):
         model = Incidente
         fields = ['id', 'viaje', 'viaje_detalle', 'fecha', 'descripcion', 'gravedad', 'resuelto']
         read_only_fields = ['id', 'fecha']
+
+
+class PosicionVehiculoSerializer(serializers.ModelSerializer):
+    """Posición guardada del recorrido de un vehículo (mismo formato que las de memoria)"""
+    
+    class Meta:
+        model = PosicionVehiculo
+        fields = ['fecha_hora', 'latitud', 'longitud', 'velocidad', 'rumbo']
@@ -0,0 +1,166 @@
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Linea, Parada, Ruta, RutaParada, Horario, Boleto, Vehiculo, Viaje, Incidente
+from .autenticacion import olvidar_usuario
+from .cache import incrementar_generacion
+from .condicional import claves_contadas, tocar_padres
+from .estadisticas import acumular_boletos
+from .planificador import indice as indice_horarios
+from .cercania import indice as indice_paradas
+from .eta import indice as indice_eta
+from .posiciones import registro as registro_posiciones
+from .eventos import broker, evento_incidente, evento_viaje
+
+
+@receiver([post_save, post_delete], sender=Horario)
+@receiver([post_save, post_delete], sender=RutaParada)
+def invalidar_ruta_de_horario(sender, instance, **kwargs):
+    """Recompilar en el planificador la ruta del horario o de la parada de ruta"""
+    indice_horarios.invalidar_ruta(instance.ruta_id)
+    indice_eta.invalidar()
+
+
+@receiver([post_save, post_delete], sender=Ruta)
+def invalidar_ruta(sender, instance, **kwargs):
+    indice_horarios.invalidar_ruta(instance.pk)
+    indice_eta.invalidar()
+
+
+@receiver([post_save, post_delete], sender=Parada)
+def invalidar_parada(sender, instance, **kwargs):
+    indice_horarios.invalidar_parada(instance.pk)
+    indice_paradas.invalidar()
+    indice_eta.invalidar()
+
+
+@receiver([post_save, post_delete], sender=Linea)
+def invalidar_linea(sender, instance, **kwargs):
+    indice_horarios.invalidar()
+
+
+@receiver(post_save, sender=Vehiculo)
+def registrar_vehiculo(sender, instance, created, **kwargs):
+    """Un vehículo nuevo puede enviar posiciones sin esperar a que venza la lista"""
+    if created:
+        registro_posiciones.invalidar_vehiculos()
+
+
+@receiver(post_delete, sender=Vehiculo)
+def olvidar_vehiculo(sender, instance, **kwargs):
+    registro_posiciones.olvidar(instance.pk)
+
+
+def _accion(signal, created):
+    if signal is post_delete:
+        return 'borrado'
+    return 'creado' if created else 'actualizado'
+
+
+@receiver([post_save, post_delete], sender=Viaje)
+def publicar_viaje(sender, instance, signal, created=False, **kwargs):
+    """Los clientes de /api/eventos/ ven el cambio recién cuando se confirma"""
+    if not broker.escuchado():
+        return
+    evento = evento_viaje(instance, _accion(signal, created))
+    transaction.on_commit(lambda: broker.publicar(evento))
+
+
+@receiver([post_save, post_delete], sender=Incidente)
+def publicar_incidente(sender, instance, signal, created=False, **kwargs):
+    if not broker.escuchado():
+        # Sin nadie que pueda recibirlo no hace falta consultar el viaje
+        return
+    evento = evento_incidente(instance, _accion(signal, created))
+    transaction.on_commit(lambda: broker.publicar(evento))
+
+
+@receiver([post_save, post_delete])
+def invalidar_respuestas(sender, **kwargs):
+    """Nueva generación del modelo: las respuestas cacheadas que dependen de él dejan de usarse"""
+    if sender in apps.get_app_config('transporte').get_models():
+        # Recién con el commit: antes un GET concurrente todavía lee las filas viejas
+        transaction.on_commit(lambda: incrementar_generacion(sender))
+
+
+# Columnas de la fila anterior que usan otras señales además de los padres
+# contados: las que definen la clave y los importes de un boleto en los resúmenes
+CAMPOS_ANTERIORES = {
+    Boleto: ('fecha_compra', 'monto', 'viaje', 'tarjeta', 'parada_subida'),
+}
+
+
+@receiver(pre_save)
+def recordar_fila_anterior(sender, instance, update_fields=None, **kwargs):
+    """
+    Lee en una sola consulta lo que las señales de después del guardado
+    necesitan de la fila previa: los padres de una fila contada en un total
+    (`_padres_anteriores`) y las columnas de `CAMPOS_ANTERIORES`
+    (`_fila_anterior`). Si `update_fields` no toca ninguna de las dos, no lee.
+    """
+    claves = [campo.name for campo in claves_contadas(sender)]
+    extras = CAMPOS_ANTERIORES.get(sender, ())
+    instance._padres_anteriores = instance._fila_anterior = None
+    if not (claves or extras) or instance._state.adding or instance.pk is None:
+        return
+    tocados = set(update_fields) if update_fields is not None else set(claves) | set(extras)
+    leer_claves, leer_extras = bool(tocados & set(claves)), bool(tocados & set(extras))
+    if not leer_claves and not leer_extras:
+        return
+    columnas = {nombre: sender._meta.get_field(nombre).attname for nombre in (*claves, *extras)}
+    fila = sender._default_manager.filter(pk=instance.pk).values(*columnas.values()).first()
+    if fila is None:
+        return
+    if leer_claves:
+        instance._padres_anteriores = tuple(fila[columnas[nombre]] for nombre in claves)
+    if leer_extras:
+        instance._fila_anterior = {columnas[nombre]: fila[columnas[nombre]] for nombre in extras}
+
+
+@receiver([post_save, post_delete])
+def tocar_totales(sender, instance, signal, created=False, **kwargs):
+    """Las altas, bajas y cambios de padre actualizan `fecha_actualizacion` de los padres que las cuentan"""
+    claves = claves_contadas(sender)
+    if not claves:
+        return
+    if signal is post_delete or created:
+        # `_padres_actualizados`: claves cuyo padre ya se actualizó en la misma transacción
+        omitir = getattr(instance, '_padres_actualizados', ())
+        tocar_padres(sender, {
+            campo.name: [getattr(instance, campo.attname)] for campo in claves if campo.name not in omitir
+        })
+        return
+    anteriores = getattr(instance, '_padres_anteriores', None)
+    if anteriores is not None:
+        tocar_padres(sender, {
+            campo.name: [anterior, getattr(instance, campo.attname)]
+            for campo, anterior in zip(claves, anteriores) if anterior != getattr(instance, campo.attname)
+        })
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidar_usuario(sender, instance, **kwargs):
+    """La próxima autenticación con un token del usuario vuelve a leerlo de la base"""
+    olvidar_usuario(instance.pk)
+
+
+@receiver(post_save, sender=Boleto)
+def acumular_boleto(sender, instance, created, **kwargs):
+    """Un alta suma en los resúmenes; un cambio descuenta la versión previa y suma la nueva"""
+    if created:
+        acumular_boletos([instance])
+        return
+    anterior = getattr(instance, '_fila_anterior', None)
+    if anterior is None:
+        # `update_fields` no tocó ninguna columna de los resúmenes
+        return
+    acumular_boletos([Boleto(pk=instance.pk, **anterior)], signo=-1)
+    acumular_boletos([instance])
+
+
+@receiver(post_delete, sender=Boleto)
+def descontar_boleto(sender, instance, **kwargs):
+    acumular_boletos([instance], signo=-1)
@@ -1,9 +1,50 @@
 # Tests básicos para los modelos
 
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import math
+import os
+import random
+import statistics
+import tempfile
+import threading
+from contextlib import redirect_stderr
+from io import StringIO
+from types import ModuleType
+from unittest import mock
+import numpy as np
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
 from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.routers import DefaultRouter
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 from .models import *
-from datetime import date, time
+from rest_framework.exceptions import ValidationError
+from .bulk import acreditar_recargas
+from .serializers import BoletoSerializer, TarjetaSerializer
+from .views import BoletoViewSet, HorarioViewSet, LineaViewSet, ParadaViewSet, RutaViewSet, TarjetaViewSet, ViajeViewSet
+from .planificador import dias_a_mascara, indice as indice_horarios
+from .cercania import indice as indice_paradas
+from .eta import Perfiles, indice as indice_eta
+from .posiciones import registro as registro_posiciones
+from .eventos import Broker, broker as broker_eventos
+from .busqueda import campo_relacionado, clasificar_campos, sin_acentos
+from .autenticacion import JWTCacheAuthentication, cache_usuarios
+from .cache import cache_respuestas, estadisticas as estadisticas_cache
+from .instrumentacion import ConsultasRepetidas, InstrumentacionMiddleware, huella
+from .metricas import Registro as RegistroMetricas, registro as registro_metricas
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 
 
@@ -112,3 +153,1852 @@ class ViajeModelTest(TestCase):
         self.assertIsNotNone(self.viaje.ruta)
         self.assertIsNotNone(self.viaje.vehiculo)
         self.assertIsNotNone(self.viaje.chofer)
+
+
+def crear_red(cantidad):
+    """Crea `cantidad` filas de cada entidad con todas sus relaciones"""
+    inicio = Linea.objects.count()
+    for i in range(inicio, inicio + cantidad):
+        linea = Linea.objects.create(numero=1000 + i, nombre=f'Línea {i}')
+        ruta = Ruta.objects.create(linea=linea, nombre=f'Ruta {i}')
+        parada = Parada.objects.create(nombre=f'Parada {i}', direccion=f'Calle {i}')
+        RutaParada.objects.create(ruta=ruta, parada=parada, orden=1)
+        Horario.objects.create(
+            ruta=ruta, hora_salida=time(8, 0), hora_llegada=time(9, 0), dias_semana='L,M,X,J,V'
+        )
+        vehiculo = Vehiculo.objects.create(patente=f'VEH{i:04d}', capacidad=40)
+        chofer = Chofer.objects.create(
+            nombre='Chofer', apellido=f'N{i}', dni=f'DNI{i:05d}', licencia='D1',
+            fecha_contratacion=date(2024, 1, 1)
+        )
+        viaje = Viaje.objects.create(
+            ruta=ruta, vehiculo=vehiculo, chofer=chofer, fecha=date(2025, 1, 1)
+        )
+        tarjeta = Tarjeta.objects.create(numero=f'TAR{i:05d}', tipo='normal', saldo=Decimal('100'))
+        Boleto.objects.create(viaje=viaje, tarjeta=tarjeta, monto=Decimal('10'), parada_subida=parada)
+        Mantenimiento.objects.create(
+            vehiculo=vehiculo, tipo='preventivo', fecha=date(2025, 1, 1), descripcion='Service'
+        )
+        Incidente.objects.create(viaje=viaje, descripcion='Demora', gravedad='baja')
+        User.objects.create_user(username=f'usuario{i}')
+
+
+class ListadoQueryCountTest(APITestCase):
+    """Cada listado debe ejecutar una cantidad de consultas que no dependa de las filas"""
+    endpoints = {
+        'linea': '', 'parada': '', 'vehiculo': '', 'chofer': '', 'tarjeta': '', 'usuario': '',
+        'ruta': 'linea,paradas.parada',
+        'ruta-parada': 'parada',
+        'horario': 'ruta.linea,ruta.paradas.parada',
+        'viaje': 'ruta.linea,ruta.paradas.parada,vehiculo,chofer',
+        'boleto': 'viaje.ruta.linea,viaje.ruta.paradas.parada,viaje.vehiculo,viaje.chofer,tarjeta,parada_subida',
+        'mantenimiento': 'vehiculo',
+        'incidente': 'viaje.ruta.linea,viaje.ruta.paradas.parada,viaje.vehiculo,viaje.chofer',
+    }
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.admin)
+
+    def contar_consultas(self, basename, expand=''):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(f'{basename}-list'), {'expand': expand})
+        self.assertEqual(response.status_code, 200)
+        return len(ctx), response
+
+    def test_consultas_constantes_por_pagina(self):
+        crear_red(1)
+        casos = [(basename, expand) for basename, expand in self.endpoints.items()]
+        casos += [(basename, '') for basename, expand in self.endpoints.items() if expand]
+        con_una_fila = {caso: self.contar_consultas(*caso)[0] for caso in casos}
+        crear_red(8)
+        for caso in casos:
+            with self.subTest(caso=caso):
+                consultas, response = self.contar_consultas(*caso)
+                self.assertGreater(len(response.data['results']), 1)
+                self.assertEqual(consultas, con_una_fila[caso])
+
+    def test_totales_anotados(self):
+        crear_red(2)
+        response = self.client.get(reverse('viaje-list'), {'expand': 'ruta.linea,vehiculo,chofer'})
+        viaje = response.data['results'][0]
+        self.assertEqual(viaje['total_boletos'], 1)
+        self.assertEqual(viaje['vehiculo_detalle']['total_viajes'], 1)
+        self.assertEqual(viaje['chofer_detalle']['total_viajes'], 1)
+        self.assertEqual(viaje['ruta_detalle']['linea_detalle']['total_rutas'], 1)
+
+    def test_total_sin_anotacion_consulta_la_relacion(self):
+        crear_red(1)
+        tarjeta = Tarjeta.objects.get()
+        self.assertEqual(TarjetaSerializer(tarjeta).data['total_boletos'], 1)
+
+
+class ExpansionTest(APITestCase):
+    def setUp(self):
+        crear_red(3)
+
+    def test_detalles_omitidos_por_defecto(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('boleto-list'))
+        boleto = response.data['results'][0]
+        self.assertNotIn('viaje_detalle', boleto)
+        self.assertNotIn('tarjeta_detalle', boleto)
+        self.assertIn('viaje', boleto)
+
+    def test_expansion_anidada(self):
+        response = self.client.get(reverse('boleto-list'), {'expand': 'viaje.ruta,tarjeta'})
+        boleto = response.data['results'][0]
+        self.assertEqual(boleto['tarjeta_detalle']['total_boletos'], 1)
+        viaje = boleto['viaje_detalle']
+        self.assertIn('ruta_detalle', viaje)
+        self.assertNotIn('vehiculo_detalle', viaje)
+        self.assertNotIn('paradas', viaje['ruta_detalle'])
+        self.assertNotIn('parada_subida_detalle', boleto)
+
+    def test_expansion_desconocida_se_ignora(self):
+        response = self.client.get(reverse('incidente-list'), {'expand': 'inexistente,viaje.nada'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('viaje_detalle', response.data['results'][0])
+
+    def test_expansion_en_acciones(self):
+        viaje = Viaje.objects.first()
+        response = self.client.get(reverse('viaje-boletos', args=[viaje.pk]), {'expand': 'tarjeta'})
+        self.assertIn('tarjeta_detalle', response.data[0])
+        self.assertNotIn('viaje_detalle', response.data[0])
+
+
+class FieldsetTest(APITestCase):
+    def setUp(self):
+        crear_red(3)
+
+    def test_fields_limita_campos_y_columnas(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('tarjeta-list'), {'fields': 'id,numero,saldo'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'numero', 'saldo'})
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('fecha_emision', sql)
+        self.assertNotIn('COUNT', sql)
+
+    def test_omit_quita_campos(self):
+        response = self.client.get(reverse('viaje-list'), {'omit': 'total_boletos,ruta'})
+        viaje = response.data['results'][0]
+        self.assertNotIn('total_boletos', viaje)
+        self.assertNotIn('ruta', viaje)
+        self.assertIn('estado', viaje)
+
+    def test_fields_omite_expansion_no_seleccionada(self):
+        # El agregado de los validadores (ETag) y el listado
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('viaje-list'), {'fields': 'id,estado,fecha', 'expand': 'ruta,vehiculo'}
+            )
+        self.assertEqual(set(response.data['results'][0]), {'id', 'estado', 'fecha'})
+
+    def test_campos_requeridos_de_metodos(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('chofer-list'), {'fields': 'id,nombre_completo'})
+        self.assertTrue(response.data['results'][0]['nombre_completo'].startswith('N'))
+
+    def test_anidados_no_se_recortan(self):
+        response = self.client.get(
+            reverse('boleto-list'), {'fields': 'id,tarjeta,tarjeta_detalle', 'expand': 'tarjeta'}
+        )
+        boleto = response.data['results'][0]
+        self.assertEqual(set(boleto), {'id', 'tarjeta', 'tarjeta_detalle'})
+        self.assertIn('saldo', boleto['tarjeta_detalle'])
+
+
+class KeysetCursorPaginationTest(APITestCase):
+    def setUp(self):
+        crear_red(1)
+        viaje = Viaje.objects.get()
+        # Viajes con fecha y hora repetidas (y horas nulas) para forzar empates
+        for i in range(14):
+            Viaje.objects.create(
+                ruta=viaje.ruta, vehiculo=viaje.vehiculo, chofer=viaje.chofer,
+                fecha=date(2025, 1, 1 + i % 3),
+                hora_salida_real=None if i % 4 == 0 else time(8, i % 2),
+                estado='finalizado' if i % 2 else 'programado',
+            )
+
+    def recorrer(self, url, params=None):
+        ids, paginas = [], []
+        while url:
+            response = self.client.get(url, params)
+            params = None
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            paginas.append(response.data)
+            ids += [fila['id'] for fila in response.data['results']]
+            url = response.data['next']
+        return ids, paginas
+
+    def test_recorre_todo_sin_duplicados_con_orden_del_modelo(self):
+        ids, paginas = self.recorrer(reverse('viaje-list'), {'page_size': 4})
+        esperado = list(Viaje.objects.order_by(
+            '-fecha', F('hora_salida_real').desc(nulls_last=True), '-id'
+        ).values_list('id', flat=True))
+        self.assertEqual(ids, esperado)
+        self.assertEqual(len(paginas), 4)
+
+    def test_respeta_filtros_y_ordering(self):
+        ids, _ = self.recorrer(
+            reverse('viaje-list'), {'estado': 'finalizado', 'ordering': 'fecha', 'page_size': 3}
+        )
+        esperado = list(
+            Viaje.objects.filter(estado='finalizado').order_by('fecha', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, esperado)
+
+    def test_pagina_anterior(self):
+        primera = self.client.get(reverse('viaje-list'), {'page_size': 5}).data
+        segunda = self.client.get(primera['next']).data
+        anterior = self.client.get(segunda['previous']).data
+        self.assertEqual(anterior['results'], primera['results'])
+        self.assertIsNone(primera['previous'])
+
+    def test_cursor_con_fecha_hora(self):
+        crear_red(4)
+        ids, _ = self.recorrer(reverse('boleto-list'), {'page_size': 2, 'fields': 'id'})
+        esperado = list(Boleto.objects.order_by('-fecha_compra', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, esperado)
+
+    def test_sin_count_ni_offset(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('boleto-list'))
+        sql = ' '.join(query['sql'] for query in ctx.captured_queries)
+        self.assertNotIn('COUNT', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_cursor_invalido(self):
+        response = self.client.get(reverse('incidente-list'), {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_catalogos_siguen_con_paginas(self):
+        response = self.client.get(reverse('linea-list'))
+        self.assertIn('count', response.data)
+
+
+class CobroBoletoTest(APITestCase):
+    def setUp(self):
+        crear_red(1)
+        self.viaje = Viaje.objects.get()
+        self.tarjeta = Tarjeta.objects.get()
+        self.client.force_authenticate(User.objects.get())
+
+    def comprar(self, monto):
+        return self.client.post(reverse('boleto-list'), {
+            'viaje': self.viaje.pk, 'tarjeta': self.tarjeta.pk, 'monto': monto
+        })
+
+    def test_debito_con_update_condicional(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.comprar('30.00')
+        self.assertEqual(response.status_code, 201)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "tarjetas"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"saldo" >=', updates[0])
+        self.assertNotIn('"numero"', updates[0])
+        self.tarjeta.refresh_from_db()
+        self.assertEqual(self.tarjeta.saldo, Decimal('70.00'))
+
+    def test_saldo_insuficiente(self):
+        response = self.comprar('150.00')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tarjeta', response.data)
+
+    def test_saldo_consumido_despues_de_validar(self):
+        serializer = BoletoSerializer(data={
+            'viaje': self.viaje.pk, 'tarjeta': self.tarjeta.pk, 'monto': '80.00'
+        })
+        self.assertTrue(serializer.is_valid())
+        Tarjeta.objects.filter(pk=self.tarjeta.pk).update(saldo=Decimal('50.00'))
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        self.assertEqual(Boleto.objects.filter(monto=Decimal('80.00')).count(), 0)
+        self.tarjeta.refresh_from_db()
+        self.assertEqual(self.tarjeta.saldo, Decimal('50.00'))
+
+    def test_recarga_intercalada_con_cobro(self):
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='admin'))
+        leer = TarjetaViewSet.get_object
+
+        def leer_y_cobrar(vista):
+            tarjeta = leer(vista)
+            # Un cobro se confirma entre la lectura de la tarjeta y la recarga
+            self.assertEqual(self.comprar('30.00').status_code, 201)
+            return tarjeta
+
+        with mock.patch.object(TarjetaViewSet, 'get_object', leer_y_cobrar):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(reverse('tarjeta-recargar', args=[self.tarjeta.pk]), {'monto': '50'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['saldo']), Decimal('120.00'))
+        self.tarjeta.refresh_from_db()
+        self.assertEqual(self.tarjeta.saldo, Decimal('120.00'))
+        recarga = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "tarjetas"')][-1]
+        self.assertIn('"saldo" = (', recarga)
+        self.assertNotIn('"numero"', recarga)
+
+        Tarjeta.objects.filter(pk=self.tarjeta.pk).update(activa=False)
+        response = self.client.post(reverse('tarjeta-recargar', args=[self.tarjeta.pk]), {'monto': '50'})
+        self.assertEqual(response.status_code, 400)
+        self.tarjeta.refresh_from_db()
+        self.assertEqual(self.tarjeta.saldo, Decimal('120.00'))
+
+
+class BoletoBulkTest(APITestCase):
+    def setUp(self):
+        crear_red(2)
+        self.viaje = Viaje.objects.first()
+        self.parada = Parada.objects.first()
+        self.tarjeta, self.otra = Tarjeta.objects.order_by('pk')
+        self.client.force_authenticate(User.objects.first())
+        self.url = reverse('boleto-bulk')
+
+    def toque(self, tarjeta=None, monto='40.00', **extra):
+        fila = {'viaje': self.viaje.pk, 'monto': monto, 'parada_subida': self.parada.pk}
+        if tarjeta:
+            fila['tarjeta'] = tarjeta.pk
+        fila.update(extra)
+        return fila
+
+    def test_json_con_resultados_por_fila(self):
+        filas = [
+            self.toque(self.tarjeta),
+            self.toque(self.tarjeta),
+            self.toque(self.tarjeta),  # supera el saldo acumulado
+            self.toque(self.otra, monto='5.50'),
+            self.toque(viaje=999999),
+            self.toque(monto='abc'),
+            self.toque(),
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, filas, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['creados'], 4)
+        self.assertEqual(response.data['rechazados'], 3)
+        resultados = response.data['resultados']
+        self.assertIn('id', resultados[0])
+        self.assertEqual(resultados[2]['errores'], {'tarjeta': ['Saldo insuficiente en la tarjeta.']})
+        self.assertIn('viaje', resultados[4]['errores'])
+        self.assertIn('monto', resultados[5]['errores'])
+        self.tarjeta.refresh_from_db()
+        self.otra.refresh_from_db()
+        self.assertEqual(self.tarjeta.saldo, Decimal('20.00'))
+        self.assertEqual(self.otra.saldo, Decimal('94.50'))
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "boletos"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_ndjson(self):
+        cuerpo = '\n'.join(json.dumps(self.toque(self.otra, monto='1')) for _ in range(50))
+        response = self.client.post(self.url, cuerpo, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['creados'], 50)
+        self.otra.refresh_from_db()
+        self.assertEqual(self.otra.saldo, Decimal('50.00'))
+
+    def test_ndjson_invalido(self):
+        response = self.client.post(self.url, '{"viaje": 1}\n{roto', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+
+    def test_requiere_autenticacion(self):
+        self.client.force_authenticate(None)
+        response = self.client.post(self.url, [self.toque()], format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class RecargaLoteTest(TestCase):
+    def setUp(self):
+        crear_red(2)
+        self.tarjeta, self.inactiva = Tarjeta.objects.order_by('pk')
+        self.inactiva.activa = False
+        self.inactiva.save()
+
+    def test_recargas_agrupadas_y_rechazos(self):
+        contenido = '\n'.join([
+            'numero,monto',
+            f'{self.tarjeta.numero},10.50',
+            f'{self.tarjeta.numero},20',
+            'NO-EXISTE,5',
+            f'{self.inactiva.numero},5',
+            f'{self.tarjeta.numero},abc',
+            f'{self.tarjeta.numero},1.25',
+        ])
+        with tempfile.TemporaryDirectory() as directorio:
+            archivo = os.path.join(directorio, 'recargas.csv')
+            rechazos = os.path.join(directorio, 'rechazos.csv')
+            with open(archivo, 'w') as f:
+                f.write(contenido)
+            salida = StringIO()
+            call_command('recargar_tarjetas', archivo, bloque=2, rechazos=rechazos, stdout=salida)
+            with open(rechazos) as f:
+                filas = list(csv.reader(f))
+        self.tarjeta.refresh_from_db()
+        self.inactiva.refresh_from_db()
+        self.assertEqual(self.tarjeta.saldo, Decimal('131.75'))
+        self.assertEqual(self.inactiva.saldo, Decimal('100.00'))
+        self.assertEqual([fila[0] for fila in filas[1:]], ['4', '5', '6'])
+        self.assertEqual(filas[2][3], 'Tarjeta inactiva')
+        self.assertIn('3 recargas aplicadas', salida.getvalue())
+
+    def test_tarjetas_leidas_dentro_de_la_transaccion(self):
+        # La lectura de `activa` y el crédito ocurren en la misma transacción
+        with CaptureQueriesContext(connection) as ctx:
+            acreditar_recargas([(2, self.tarjeta.numero, '5'), (3, self.inactiva.numero, '5')])
+        consultas = [q['sql'] for q in ctx.captured_queries]
+        inicio = next(i for i, sql in enumerate(consultas) if sql.startswith('SAVEPOINT'))
+        lectura = next(i for i, sql in enumerate(consultas) if sql.startswith('SELECT') and 'FROM "tarjetas"' in sql)
+        self.assertLess(inicio, lectura)
+
+
+class EtaTest(APITestCase):
+    """Tiempos estimados de llegada con los perfiles de duración de los viajes"""
+
+    def setUp(self):
+        indice_eta.reiniciar()
+        linea = Linea.objects.create(numero=1, nombre='Línea 1')
+        self.ruta = Ruta.objects.create(linea=linea, nombre='Ida')
+        self.paradas = [Parada.objects.create(nombre=f'P{i}', direccion=f'Calle {i}') for i in range(3)]
+        for orden, parada in enumerate(self.paradas, 1):
+            RutaParada.objects.create(ruta=self.ruta, parada=parada, orden=orden)
+        self.vehiculo = Vehiculo.objects.create(patente='ETA001', capacidad=40)
+        self.chofer = Chofer.objects.create(
+            nombre='Chofer', apellido='ETA', dni='ETA001', licencia='D1', fecha_contratacion=date(2024, 1, 1)
+        )
+        hoy = timezone.localdate()
+        self.lunes = hoy - timedelta(days=hoy.weekday() + 7)
+        # Lunes a las 8: seis viajes; martes a las 8: uno; lunes a las 20: uno
+        self.duraciones = [1000, 1200, 1400, 1600, 1800, 6000]
+        for semana, duracion in enumerate(self.duraciones):
+            self.viaje(self.lunes - timedelta(weeks=semana), time(8, 5), duracion)
+        self.viaje(self.lunes + timedelta(days=1), time(8, 10), 900)
+        self.viaje(self.lunes, time(20, 0), 3000)
+        # Sin llegada y con duración imposible: no cuentan
+        Viaje.objects.create(ruta=self.ruta, vehiculo=self.vehiculo, chofer=self.chofer, fecha=self.lunes,
+                             hora_salida_real=time(8, 1), estado='en_curso')
+        self.viaje(self.lunes, time(8, 20), 0)
+
+    def viaje(self, fecha, salida, duracion):
+        llegada = (datetime.combine(fecha, salida) + timedelta(seconds=duracion)).time()
+        return Viaje.objects.create(
+            ruta=self.ruta, vehiculo=self.vehiculo, chofer=self.chofer, fecha=fecha,
+            hora_salida_real=salida, hora_llegada_real=llegada, estado='finalizado'
+        )
+
+    def eta(self, ruta=None, **params):
+        return self.client.get(reverse('ruta-eta', args=[ruta or self.ruta.pk]), params)
+
+    def test_perfiles_por_dia_franja_y_ruta(self):
+        with self.settings(ETA_MINIMO_VIAJES=3):
+            lunes = self.eta(parada=self.paradas[2].pk, hora='08:15', fecha=self.lunes.isoformat())
+            self.assertEqual(lunes.status_code, 200)
+            mediana = statistics.median(self.duraciones)
+            self.assertEqual(lunes.data['fuente'], 'dia')
+            self.assertEqual(lunes.data['viajes'], 6)
+            self.assertEqual(lunes.data['duracion_recorrido'], mediana)
+            self.assertEqual(lunes.data['segundos_p90'], 6000)
+            self.assertEqual(lunes.data['salida'], '08:15:00')
+            self.assertEqual(lunes.data['llegada_estimada'], '08:40:00')
+            self.assertEqual(lunes.data['dia'], 'L')
+
+            # La parada del medio está a mitad del recorrido (no hay coordenadas)
+            medio = self.eta(parada=self.paradas[1].pk, hora='08:15', fecha=self.lunes.isoformat())
+            self.assertEqual((medio.data['orden'], medio.data['segundos']), (2, mediana / 2))
+
+            martes = self.eta(parada=self.paradas[2].pk, hora='08:00', fecha=(self.lunes + timedelta(days=1)).isoformat())
+            self.assertEqual((martes.data['fuente'], martes.data['viajes']), ('franja', 7))
+            self.assertEqual(martes.data['duracion_recorrido'], statistics.median([*self.duraciones, 900]))
+
+            noche = self.eta(parada=self.paradas[2].pk, hora='20:10', fecha=self.lunes.isoformat())
+            self.assertEqual((noche.data['fuente'], noche.data['viajes']), ('ruta', 8))
+            self.assertEqual(noche.data['duracion_recorrido'], statistics.median([*self.duraciones, 900, 3000]))
+
+    def test_igual_al_calculo_fila_por_fila(self):
+        aleatorio = random.Random(3)
+        viajes = np.array([
+            (aleatorio.choice([4, 9, 15]), aleatorio.randrange(7), aleatorio.randrange(86400), 0)
+            for _ in range(3000)
+        ], dtype=np.int64)
+        viajes[:, 3] = (viajes[:, 2] + np.array([aleatorio.randrange(1, 5000) for _ in range(3000)])) % 86400
+        perfiles = Perfiles.calcular(viajes, 60, 0)
+        grupos = {}
+        for ruta, dia, salida, llegada in viajes.tolist():
+            grupos.setdefault((ruta, dia, salida // 3600), []).append((llegada - salida) % 86400)
+        for (ruta, dia, hora), duraciones in grupos.items():
+            mediana, p90, viajes_celda, fuente = perfiles.duracion(ruta, dia, hora * 3600)
+            duraciones.sort()
+            self.assertEqual((mediana, viajes_celda, fuente), (statistics.median(duraciones), len(duraciones), 'dia'))
+            self.assertEqual(p90, duraciones[math.ceil(0.9 * len(duraciones)) - 1])
+
+    def test_sin_consultas_y_archivo(self):
+        self.eta(parada=self.paradas[0].pk)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.eta(parada=self.paradas[2].pk, hora='08:15', fecha=self.lunes.isoformat())
+        self.assertEqual(len(ctx), 0)
+
+        with tempfile.TemporaryDirectory() as directorio:
+            archivo = os.path.join(directorio, 'eta.npz')
+            call_command('calcular_eta', archivo=archivo, stdout=StringIO())
+            Viaje.objects.all().delete()
+            with self.settings(ETA_ARCHIVO=archivo):
+                indice_eta.reiniciar()
+                self.assertEqual(
+                    self.eta(parada=self.paradas[2].pk, hora='08:15', fecha=self.lunes.isoformat()).data,
+                    response.data
+                )
+
+    def test_recalculo_en_segundo_plano(self):
+        anteriores = indice_eta.perfiles()
+        nuevos = Perfiles({}, 1800, None, None, None, None, 0.0)
+        empezado, seguir = threading.Event(), threading.Event()
+
+        def calcular():
+            empezado.set()
+            seguir.wait(5)
+            return nuevos
+
+        def esperar_recalculo():
+            recalculo = indice_eta._recalculo
+            if recalculo is not None:
+                recalculo.join(5)
+
+        with self.settings(ETA_MAX_EDAD=0), mock.patch('transporte.eta.calcular_perfiles', calcular):
+            self.assertIs(indice_eta.perfiles(), anteriores)
+            self.assertTrue(empezado.wait(5))
+            # Mientras se recalcula se sigue estimando con los perfiles anteriores
+            self.assertFalse(indice_eta._lock.locked())
+            self.assertIs(indice_eta.perfiles(), anteriores)
+            self.assertEqual(self.eta(parada=self.paradas[2].pk).status_code, 200)
+            seguir.set()
+            esperar_recalculo()
+            self.assertIs(indice_eta.perfiles(), nuevos)
+            esperar_recalculo()
+
+    def test_horario_sin_historial_y_errores(self):
+        otra = Ruta.objects.create(linea=self.ruta.linea, nombre='Vuelta')
+        RutaParada.objects.create(ruta=otra, parada=self.paradas[0], orden=1)
+        RutaParada.objects.create(ruta=otra, parada=self.paradas[1], orden=2)
+        response = self.eta(otra.pk, parada=self.paradas[1].pk)
+        self.assertEqual(response.status_code, 404)
+        Horario.objects.create(ruta=otra, hora_salida=time(8, 0), hora_llegada=time(8, 40), dias_semana='L-V')
+        response = self.eta(otra.pk, parada=self.paradas[1].pk, hora='23:50')
+        self.assertEqual((response.data['fuente'], response.data['segundos']), ('horario', 2400))
+        self.assertEqual(response.data['llegada_estimada'], '00:30:00')
+
+        self.assertEqual(self.eta().status_code, 400)
+        self.assertEqual(self.eta(parada='x').status_code, 400)
+        self.assertEqual(self.eta(parada=self.paradas[0].pk, hora='25:00').status_code, 400)
+        self.assertEqual(self.eta(999999, parada=self.paradas[0].pk).status_code, 404)
+        parada = Parada.objects.create(nombre='Fuera', direccion='-')
+        self.assertEqual(self.eta(parada=parada.pk).status_code, 404)
+
+
+class PlanificadorTest(APITestCase):
+    """Planificador de viajes sobre el índice de horarios en memoria"""
+    lunes = '2025-01-06'
+    sabado = '2025-01-11'
+
+    def crear_ruta(self, numero, paradas, *horarios):
+        linea = Linea.objects.create(numero=numero, nombre=f'Línea {numero}')
+        ruta = Ruta.objects.create(linea=linea, nombre=f'Ruta {numero}')
+        for orden, parada in enumerate(paradas, start=1):
+            RutaParada.objects.create(ruta=ruta, parada=parada, orden=orden)
+        for salida, llegada, dias in horarios:
+            Horario.objects.create(ruta=ruta, hora_salida=salida, hora_llegada=llegada, dias_semana=dias)
+        return ruta
+
+    def setUp(self):
+        indice_horarios.invalidar()
+        self.p1, self.p2, self.p3, self.p4 = [
+            Parada.objects.create(nombre=f'P{i}', direccion=f'Calle {i}') for i in range(1, 5)
+        ]
+        self.ruta_a = self.crear_ruta(1, [self.p1, self.p2, self.p3], (time(8, 0), time(8, 20), 'L-V'))
+        self.ruta_b = self.crear_ruta(
+            2, [self.p3, self.p4],
+            (time(8, 10), time(8, 20), 'L-V'),
+            (time(8, 30), time(8, 40), 'L,M,X,J,V'),
+        )
+        self.directa = self.crear_ruta(3, [self.p1, self.p4], (time(9, 0), time(9, 30), 'L-V'))
+
+    def planificar(self, **params):
+        params = {'origen': self.p1.pk, 'destino': self.p4.pk, 'hora': '07:50', 'fecha': self.lunes, **params}
+        return self.client.get(reverse('planificador'), params)
+
+    def test_itinerarios_por_transbordos(self):
+        response = self.planificar()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['dia'], 'L')
+        directo, con_transbordo = response.data['itinerarios']
+        self.assertEqual(directo['transbordos'], 0)
+        self.assertEqual(directo['llegada'], '09:30:00')
+        self.assertEqual(con_transbordo['transbordos'], 1)
+        self.assertEqual(con_transbordo['llegada'], '08:40:00')
+        primero, segundo = con_transbordo['tramos']
+        self.assertEqual((primero['ruta'], primero['desde'], primero['hasta']), (self.ruta_a.pk, self.p1.pk, self.p3.pk))
+        self.assertEqual((primero['salida'], primero['llegada']), ('08:00:00', '08:20:00'))
+        self.assertEqual((segundo['ruta'], segundo['salida']), (self.ruta_b.pk, '08:30:00'))
+
+    def test_sin_transbordos(self):
+        response = self.planificar(transbordos=0)
+        self.assertEqual([i['transbordos'] for i in response.data['itinerarios']], [0])
+
+    def test_hora_de_salida(self):
+        response = self.planificar(hora='08:05')
+        self.assertEqual([i['llegada'] for i in response.data['itinerarios']], ['09:30:00'])
+
+    def test_dias_de_servicio(self):
+        response = self.planificar(fecha=self.sabado)
+        self.assertEqual(response.data['itinerarios'], [])
+
+    def test_invalidacion_incremental(self):
+        self.assertEqual(self.planificar(fecha=self.sabado).data['itinerarios'], [])
+        Horario.objects.create(ruta=self.directa, hora_salida=time(10, 0), hora_llegada=time(10, 45), dias_semana='S,D')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.planificar(fecha=self.sabado)
+        self.assertEqual([i['llegada'] for i in response.data['itinerarios']], ['10:45:00'])
+        # Solo se recompila la ruta modificada: ruta, paradas y horarios
+        self.assertEqual(len(ctx), 3)
+
+    def test_reconstruccion_en_segundo_plano(self):
+        anterior = indice_horarios.red()
+        empezada, seguir = threading.Event(), threading.Event()
+
+        def cargar_paradas():
+            empezada.set()
+            seguir.wait(5)
+            return {}
+
+        def esperar_reconstruccion():
+            reconstruccion = indice_horarios._reconstruccion
+            if reconstruccion is not None:
+                reconstruccion.join(5)
+
+        with self.settings(PLANIFICADOR_MAX_EDAD=0), \
+                mock.patch.object(indice_horarios, '_cargar_paradas', cargar_paradas), \
+                mock.patch.object(indice_horarios, '_compilar'):
+            self.assertIs(indice_horarios.red(), anterior)
+            self.assertTrue(empezada.wait(5))
+            # Mientras se reconstruye se sigue planificando con la red anterior
+            self.assertFalse(indice_horarios._lock.locked())
+            self.assertIs(indice_horarios.red(), anterior)
+            self.assertEqual(self.planificar().status_code, 200)
+            indice_horarios.invalidar_ruta(self.directa.pk)
+            seguir.set()
+            esperar_reconstruccion()
+            # Lo invalidado durante la reconstrucción queda para la próxima consulta
+            self.assertIn(self.directa.pk, indice_horarios._rutas_sucias)
+            self.assertIsNot(indice_horarios.red(), anterior)
+            esperar_reconstruccion()
+
+    def test_interpolacion_por_distancia(self):
+        for parada, latitud in ((self.p1, 0), (self.p2, '0.01'), (self.p3, '0.04')):
+            parada.latitud, parada.longitud = latitud, 0
+            parada.save()
+        response = self.planificar(destino=self.p2.pk)
+        tramo, = response.data['itinerarios'][0]['tramos']
+        self.assertEqual(tramo['llegada'], '08:05:00')
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.planificar(origen='').status_code, 400)
+        self.assertEqual(self.planificar(hora='25:00').status_code, 400)
+        self.assertEqual(self.planificar(transbordos=9).status_code, 400)
+        self.assertEqual(self.planificar(destino=999999).status_code, 404)
+
+    def proximas_salidas(self, parada, **params):
+        params = {'hora': '08:00', 'fecha': self.lunes, **params}
+        return self.client.get(reverse('parada-proximas-salidas', args=[parada.pk]), params)
+
+    def test_proximas_salidas(self):
+        response = self.proximas_salidas(self.p3, hora='08:15')
+        self.assertEqual(response.status_code, 200)
+        salidas = response.data['salidas']
+        self.assertEqual([(s['hora'], s['ruta'], s['fecha']) for s in salidas], [
+            ('08:30:00', self.ruta_b.pk, date(2025, 1, 6)),
+            ('08:10:00', self.ruta_b.pk, date(2025, 1, 7)),
+            ('08:30:00', self.ruta_b.pk, date(2025, 1, 7)),
+            ('08:10:00', self.ruta_b.pk, date(2025, 1, 8)),
+            ('08:30:00', self.ruta_b.pk, date(2025, 1, 8)),
+        ])
+        self.assertEqual(salidas[0]['hacia'], 'P4')
+        # P3 es el final de la ruta A: no figura como salida
+        self.assertNotIn(self.ruta_a.pk, [s['ruta'] for s in salidas])
+
+    def test_proximas_salidas_fin_de_semana(self):
+        response = self.proximas_salidas(self.p1, fecha='2025-01-10', hora='12:00', cantidad=2)
+        self.assertEqual(
+            [(s['hora'], s['ruta'], s['fecha']) for s in response.data['salidas']],
+            [('08:00:00', self.ruta_a.pk, date(2025, 1, 13)), ('09:00:00', self.directa.pk, date(2025, 1, 13))],
+        )
+
+    def test_proximas_salidas_despues_de_medianoche(self):
+        nocturna = self.crear_ruta(4, [self.p2, self.p1], (time(23, 50), time(0, 10), 'V'))
+        response = self.proximas_salidas(self.p2, fecha='2025-01-11', hora='00:00', cantidad=1)
+        salida, = response.data['salidas']
+        # El viaje del viernes 23:50 pasa por P2 (inicio) a las 23:50; no hay más hasta el lunes
+        self.assertEqual((salida['ruta'], salida['fecha']), (self.ruta_a.pk, date(2025, 1, 13)))
+        nocturna.paradas_orden.all().delete()
+        RutaParada.objects.create(ruta=nocturna, parada=self.p4, orden=1)
+        RutaParada.objects.create(ruta=nocturna, parada=self.p2, orden=2)
+        RutaParada.objects.create(ruta=nocturna, parada=self.p1, orden=3)
+        response = self.proximas_salidas(self.p2, fecha='2025-01-11', hora='00:00', cantidad=1)
+        salida, = response.data['salidas']
+        self.assertEqual((salida['ruta'], salida['hora'], salida['fecha']), (nocturna.pk, '00:00:00', date(2025, 1, 11)))
+
+    def test_proximas_salidas_sin_consultas(self):
+        self.proximas_salidas(self.p1)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.proximas_salidas(self.p1)
+        self.assertEqual(len(ctx), 0)
+        self.assertEqual(self.proximas_salidas(self.p1, cantidad=0).status_code, 400)
+        self.assertEqual(self.client.get(reverse('parada-proximas-salidas', args=[999999])).status_code, 404)
+
+    def test_dias_a_mascara(self):
+        self.assertEqual(dias_a_mascara('L,M,X,J,V'), 0b0011111)
+        self.assertEqual(dias_a_mascara('L-V'), 0b0011111)
+        self.assertEqual(dias_a_mascara('S D'), 0b1100000)
+        self.assertEqual(dias_a_mascara('V-L'), 0b1110001)
+
+
+class ParadasCercanasTest(APITestCase):
+    """Búsqueda de paradas cercanas sobre el índice espacial en memoria"""
+
+    def setUp(self):
+        indice_paradas.invalidar()
+        aleatorio = random.Random(7)
+        self.coordenadas = {}
+        for i in range(300):
+            latitud = Decimal(f'{aleatorio.uniform(-0.3, -0.1):.6f}')
+            longitud = Decimal(f'{aleatorio.uniform(-78.6, -78.4):.6f}')
+            parada = Parada.objects.create(nombre=f'P{i}', direccion=f'Calle {i}', latitud=latitud, longitud=longitud)
+            self.coordenadas[parada.pk] = (float(latitud), float(longitud))
+        Parada.objects.create(nombre='Sin coordenadas', direccion='Calle s/n')
+
+    def distancias(self, latitud, longitud):
+        """Distancia haversine en metros a cada parada, calculada por fuerza bruta"""
+        resultado = {}
+        for pk, (lat, lon) in self.coordenadas.items():
+            lat1, lon1, lat2, lon2 = map(math.radians, (latitud, longitud, lat, lon))
+            h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+            resultado[pk] = 2 * 6371000 * math.asin(math.sqrt(h))
+        return resultado
+
+    def cercanas(self, **params):
+        return self.client.get(reverse('parada-cercanas'), params)
+
+    def test_k_mas_cercanas(self):
+        distancias = self.distancias(-0.2, -78.5)
+        response = self.cercanas(lat=-0.2, lon=-78.5, k=15)
+        self.assertEqual(response.status_code, 200)
+        esperadas = sorted(distancias, key=distancias.get)[:15]
+        self.assertEqual([parada['id'] for parada in response.data], esperadas)
+        for parada in response.data:
+            self.assertAlmostEqual(parada['distancia'], distancias[parada['id']], delta=0.1)
+        self.assertEqual(set(response.data[0]), {'id', 'nombre', 'direccion', 'latitud', 'longitud', 'distancia'})
+
+    def test_radio(self):
+        distancias = self.distancias(-0.15, -78.45)
+        response = self.cercanas(lat=-0.15, lon=-78.45, radio=2000, k=100)
+        esperadas = sorted((pk for pk, d in distancias.items() if d <= 2000), key=distancias.get)
+        self.assertTrue(esperadas)
+        self.assertEqual([parada['id'] for parada in response.data], esperadas[:100])
+
+    def test_sin_consultas_y_refresco(self):
+        self.cercanas(lat=0, lon=0)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.cercanas(lat=0, lon=0, k=1)
+        self.assertEqual(len(ctx), 0)
+        nueva = Parada.objects.create(nombre='Nueva', direccion='Ecuador', latitud=0, longitud=Decimal('0.001'))
+        response = self.cercanas(lat=0, lon=0, k=1)
+        self.assertEqual(response.data[0]['id'], nueva.pk)
+        nueva.delete()
+        self.assertNotEqual(self.cercanas(lat=0, lon=0, k=1).data[0]['id'], nueva.pk)
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.cercanas(lat=0).status_code, 400)
+        self.assertEqual(self.cercanas(lat=91, lon=0).status_code, 400)
+        self.assertEqual(self.cercanas(lat=0, lon=0, k=0).status_code, 400)
+        self.assertEqual(self.cercanas(lat=0, lon=0, radio=-5).status_code, 400)
+
+
+class CacheRespuestasTest(APITestCase):
+    """Cache de respuestas del catálogo invalidada por generación de modelo"""
+
+    def setUp(self):
+        cache_respuestas().clear()
+        estadisticas_cache.reiniciar()
+        crear_red(3)
+        self.linea = Linea.objects.first()
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, [consulta['sql'] for consulta in ctx.captured_queries]
+
+    def test_acierto_solo_consulta_validadores(self):
+        url = reverse('ruta-list')
+        primera, _ = self.get(url, expand='linea,paradas.parada')
+        segunda, consultas = self.get(url, expand='linea,paradas.parada')
+        self.assertEqual((primera['X-Cache'], segunda['X-Cache']), ('MISS', 'HIT'))
+        # Solo los agregados del ETag: nada se lee fila por fila
+        self.assertTrue(consultas)
+        self.assertTrue(all('MAX(' in sql for sql in consultas))
+        self.assertEqual(segunda.json(), primera.json())
+        # Otros parámetros son otra entrada
+        self.assertEqual(self.get(url, expand='linea')[0]['X-Cache'], 'MISS')
+
+    def test_invalidacion_por_modelo_dependiente(self):
+        url = reverse('ruta-detail', args=[self.linea.rutas.first().pk])
+        self.get(url, expand='linea')
+        # Un boleto no forma parte de la representación de la ruta
+        Boleto.objects.create(viaje=Viaje.objects.first(), monto=Decimal('1'))
+        self.assertEqual(self.get(url, expand='linea')[0]['X-Cache'], 'HIT')
+        self.linea.nombre = 'Renombrada'
+        self.linea.save()
+        response, _ = self.get(url, expand='linea')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['linea_detalle']['nombre'], 'Renombrada')
+
+    def test_generacion_al_confirmar(self):
+        clave = f'generacion:{Linea._meta.label_lower}'
+        self.get(reverse('linea-list'))
+        antes = cache_respuestas().get(clave)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.linea.nombre = 'Renombrada'
+            self.linea.save()
+            self.assertEqual(cache_respuestas().get(clave), antes)
+        self.assertEqual(cache_respuestas().get(clave), antes + 1)
+
+    def test_cambio_sin_generacion_nueva(self):
+        # Un cambio hecho en otro worker (cache local): la generación de este proceso no se entera
+        url = reverse('linea-detail', args=[self.linea.pk])
+        primera, _ = self.get(url)
+        self.assertEqual(self.get(url)[0]['X-Cache'], 'HIT')
+        Linea.objects.filter(pk=self.linea.pk).update(nombre='Otro worker', fecha_actualizacion=timezone.now())
+        response, _ = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['nombre'], 'Otro worker')
+        self.assertNotEqual(response['ETag'], primera['ETag'])
+
+    def test_totales(self):
+        url = reverse('linea-detail', args=[self.linea.pk])
+        self.assertEqual(self.get(url)[0].data['total_rutas'], 1)
+        Ruta.objects.create(linea=self.linea, nombre='Otra')
+        self.assertEqual(self.get(url)[0].data['total_rutas'], 2)
+
+    def test_estadisticas(self):
+        url = reverse('parada-list')
+        for _ in range(3):
+            self.get(url)
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='admin'))
+        response = self.client.get(reverse('cache-estadisticas'))
+        self.assertEqual((response.data['aciertos'], response.data['fallos']), (2, 1))
+        self.assertEqual(response.data['por_vista']['parada'], {'aciertos': 2, 'fallos': 1})
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('cache-estadisticas')).status_code, 401)
+
+    def test_backend_de_archivos(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            with self.settings(CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'respuestas': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directorio},
+            }):
+                url = reverse('horario-list')
+                self.assertEqual(self.get(url)[0]['X-Cache'], 'MISS')
+                self.assertEqual(self.get(url)[0]['X-Cache'], 'HIT')
+                Horario.objects.update(dias_semana='S,D')
+                Horario.objects.first().save()
+                response, _ = self.get(url)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertEqual(response.data['results'][0]['dias_semana'], 'S,D')
+
+
+class GetCondicionalTest(APITestCase):
+    """ETag / Last-Modified calculados con agregados antes de serializar"""
+
+    def setUp(self):
+        crear_red(3)
+        self.linea = Linea.objects.first()
+
+    def get(self, url, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, params, **headers)
+
+    def test_304_sin_serializar(self):
+        url = reverse('ruta-list')
+        response = self.get(url, expand='linea')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        with CaptureQueriesContext(connection) as ctx:
+            no_modificada = self.get(url, response['ETag'], expand='linea')
+        self.assertEqual(no_modificada.status_code, 304)
+        self.assertEqual(no_modificada.content, b'')
+        self.assertEqual(no_modificada['ETag'], response['ETag'])
+        # Rutas con sus líneas en una consulta; total_rutas ya está en la fecha de la línea
+        self.assertEqual(len(ctx), 1)
+        self.assertIn('MAX(', ctx.captured_queries[0]['sql'])
+
+    def test_viajes_solo_la_pagina(self):
+        url = reverse('viaje-list')
+        etag = self.get(url, page_size=2)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.get(url, etag, page_size=2).status_code, 304)
+        # Las filas de la página (y la siguiente) en el orden de la paginación, sin agregar boletos
+        self.assertEqual(len(ctx), 1)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertIn('LIMIT 3', sql)
+        self.assertIn('ORDER BY', sql)
+        self.assertNotIn('boletos', sql)
+        self.assertNotIn('COUNT(', sql)
+
+    def test_baja_dentro_de_la_pagina(self):
+        crear_red(1)
+        url = reverse('viaje-list')
+        etag = self.get(url, page_size=2)['ETag']
+        # Se borra la segunda fila y entra otra: el máximo y la cantidad de la página no cambian
+        Viaje.objects.order_by('-id')[1].delete()
+        self.assertEqual(self.get(url, etag, page_size=2).status_code, 200)
+
+    def test_boleto_cambia_de_viaje(self):
+        url = reverse('viaje-list')
+        etag = self.get(url)['ETag']
+        boleto = Boleto.objects.first()
+        anterior = boleto.viaje
+        boleto.viaje = Viaje.objects.exclude(pk=anterior.pk).first()
+        boleto.save()
+        anterior_actualizado = Viaje.objects.get(pk=anterior.pk).fecha_actualizacion
+        self.assertGreater(anterior_actualizado, anterior.fecha_actualizacion)
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+        # bulk_create no emite señales: la ingesta masiva actualiza los viajes
+        etag = self.get(url)['ETag']
+        self.client.force_authenticate(User.objects.first())
+        self.client.post(reverse('boleto-bulk'), [{'viaje': anterior.pk, 'monto': '1.00'}], format='json')
+        self.assertGreater(Viaje.objects.get(pk=anterior.pk).fecha_actualizacion, anterior_actualizado)
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_cambios_en_relaciones_mostradas(self):
+        url = reverse('ruta-list')
+        sin_expandir = self.get(url)['ETag']
+        expandida = self.get(url, expand='linea')['ETag']
+        self.linea.nombre = 'Renombrada'
+        self.linea.save()
+        # La línea solo aparece en la representación expandida
+        self.assertEqual(self.get(url, sin_expandir).status_code, 304)
+        self.assertEqual(self.get(url, expandida, expand='linea').status_code, 200)
+
+    def test_altas_y_bajas(self):
+        url = reverse('viaje-list')
+        etag = self.get(url)['ETag']
+        # total_boletos cuenta los boletos de cada viaje
+        boleto = Boleto.objects.create(viaje=Viaje.objects.first(), monto=Decimal('1'))
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        boleto.delete()
+        self.assertEqual(self.get(url, response['ETag']).status_code, 200)
+
+        url = reverse('horario-list')
+        etag = self.get(url)['ETag']
+        Horario.objects.order_by('fecha_actualizacion').first().delete()
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_etag_depende_de_los_parametros(self):
+        url = reverse('parada-list')
+        self.assertNotEqual(self.get(url)['ETag'], self.get(url, page_size=1, ordering='-nombre')['ETag'])
+
+    def test_if_modified_since(self):
+        url = reverse('linea-detail', args=[self.linea.pk])
+        response = self.get(url)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+        self.assertEqual(self.get(url, response['ETag']).status_code, 304)
+        self.assertEqual(self.get(reverse('linea-detail', args=['abc'])).status_code, 404)
+
+
+class EstadisticasTest(APITestCase):
+    """Resúmenes de boletos mantenidos al registrar boletos y su API"""
+
+    def setUp(self):
+        # Los resúmenes se suman al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_red(2)
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.admin)
+        self.viaje = Viaje.objects.first()
+        self.tarjeta = Tarjeta.objects.create(numero='EST00001', tipo='estudiante', saldo=Decimal('100'))
+        self.parada = Parada.objects.first()
+        self.hoy = timezone.localdate()
+
+    def resumenes(self):
+        return (
+            sorted(ResumenBoletosHora.objects.filter(boletos__gt=0).values_list(
+                'hora', 'ruta', 'parada_subida', 'tipo_tarjeta', 'boletos', 'recaudacion'), key=str),
+            sorted(ResumenBoletosDia.objects.filter(boletos__gt=0).values_list(
+                'dia', 'ruta', 'tipo_tarjeta', 'boletos', 'recaudacion'), key=str),
+        )
+
+    def estadisticas(self, **params):
+        params = {'desde': self.hoy.isoformat(), 'hasta': self.hoy.isoformat(), **params}
+        return self.client.get(reverse('estadisticas'), params)
+
+    def test_acumula_altas_bulk_cambios_y_bajas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('boleto-list'), {
+                'viaje': self.viaje.pk, 'tarjeta': self.tarjeta.pk, 'monto': '2.50', 'parada_subida': self.parada.pk
+            }, format='json')
+            self.client.post(reverse('boleto-bulk'), [
+                {'viaje': self.viaje.pk, 'tarjeta': self.tarjeta.pk, 'monto': '2.50', 'parada_subida': self.parada.pk},
+                {'viaje': self.viaje.pk, 'monto': '3.00'},
+                {'viaje': self.viaje.pk, 'monto': '3.00'},
+            ], format='json')
+            boleto = Boleto.objects.filter(monto=Decimal('3.00')).first()
+            boleto.monto = Decimal('4.00')
+            boleto.save()
+            Boleto.objects.filter(monto=Decimal('10')).first().delete()
+
+        incremental = self.resumenes()
+        self.assertEqual(sum(fila[-2] for fila in incremental[1]), Boleto.objects.count())
+        call_command('recalcular_estadisticas', stdout=StringIO())
+        self.assertEqual(self.resumenes(), incremental)
+        # Boletos sin parada ni tarjeta de la misma hora y ruta: una sola fila
+        self.assertEqual(ResumenBoletosHora.objects.filter(parada_subida=None, tipo_tarjeta='').count(), 1)
+
+    def test_una_lectura_de_la_fila_anterior(self):
+        boleto = Boleto.objects.filter(monto=Decimal('10')).first()
+        recaudado = sum(fila[-1] for fila in self.resumenes()[1])
+
+        def lecturas(**kwargs):
+            with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+                boleto.save(**kwargs)
+            return [q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "boletos"' in q['sql']]
+
+        boleto.monto = Decimal('12')
+        self.assertEqual(len(lecturas()), 1)
+        self.assertEqual(sum(fila[-1] for fila in self.resumenes()[1]), recaudado + 2)
+        # Sin columnas de los resúmenes ni padres en `update_fields` no se lee la fila
+        self.assertEqual(lecturas(update_fields=['fecha_actualizacion']), [])
+        boleto.monto = Decimal('15')
+        self.assertEqual(len(lecturas(update_fields=['monto'])), 1)
+        self.assertEqual(sum(fila[-1] for fila in self.resumenes()[1]), recaudado + 5)
+
+    def test_fuera_de_la_transaccion_del_cobro(self):
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('boleto-list'), {
+                'viaje': self.viaje.pk, 'tarjeta': self.tarjeta.pk, 'monto': '2.50', 'parada_subida': self.parada.pk
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([q for q in ctx.captured_queries if 'resumen_boletos' in q['sql']])
+        antes = self.resumenes()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(sum(fila[-2] for fila in self.resumenes()[1]), sum(fila[-2] for fila in antes[1]) + 1)
+
+    def test_api_por_linea_y_tipo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Boleto.objects.create(viaje=self.viaje, tarjeta=self.tarjeta, monto=Decimal('2.50'), parada_subida=self.parada)
+        response = self.estadisticas(agrupar='linea,tipo_tarjeta')
+        self.assertEqual(response.status_code, 200)
+        linea = self.viaje.ruta.linea
+        filas = [fila for fila in response.data['resultados'] if fila['linea'] == linea.pk]
+        self.assertEqual(
+            [(fila['periodo'], fila['linea_numero'], fila['tipo_tarjeta'], fila['boletos'], fila['recaudacion']) for fila in filas],
+            [(self.hoy, linea.numero, 'estudiante', 1, '2.50'), (self.hoy, linea.numero, 'normal', 1, '10.00')],
+        )
+        self.assertEqual(response.data['total_boletos'], Boleto.objects.count())
+
+    def test_api_por_hora_y_parada(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Boleto.objects.create(viaje=self.viaje, monto=Decimal('2.50'), parada_subida=self.parada)
+        response = self.estadisticas(periodo='hora', agrupar='parada', parada=self.parada.pk)
+        fila, = response.data['resultados']
+        self.assertEqual((fila['parada'], fila['parada_nombre'], fila['boletos']), (self.parada.pk, self.parada.nombre, 2))
+        self.assertEqual(fila['periodo'].minute, 0)
+        total = self.estadisticas(periodo='total', agrupar='')
+        self.assertEqual(total.data['resultados'], [{'boletos': Boleto.objects.count(), 'recaudacion': '22.50'}])
+
+    def test_parametros_y_permisos(self):
+        self.assertEqual(self.estadisticas(periodo='semana').status_code, 400)
+        self.assertEqual(self.estadisticas(agrupar='chofer').status_code, 400)
+        self.assertEqual(self.estadisticas(desde='2025-02-01', hasta='2025-01-01').status_code, 400)
+        self.assertEqual(self.estadisticas(linea='x').status_code, 400)
+        self.client.force_authenticate(User.objects.create_user(username='comun'))
+        self.assertEqual(self.estadisticas().status_code, 403)
+
+
+class ExportacionTest(APITestCase):
+    """Exportación en streaming de boletos, viajes e incidentes"""
+
+    def setUp(self):
+        crear_red(3)
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.admin)
+
+    def exportar(self, basename, **params):
+        response = self.client.get(reverse(f'{basename}-exportar'), params)
+        contenido = b''.join(response.streaming_content).decode() if response.streaming else None
+        return response, contenido
+
+    def test_csv_con_filtros_y_lotes(self):
+        viaje = Viaje.objects.first()
+        Boleto.objects.bulk_create(
+            Boleto(viaje=viaje, monto=Decimal('1.50'), fecha_compra=timezone.now()) for _ in range(5)
+        )
+        with mock.patch.object(BoletoViewSet, 'tamanio_lote_exportacion', 2), \
+                CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('boleto-exportar'), {'viaje': viaje.pk})
+            fragmentos = list(response.streaming_content)
+        contenido = b''.join(fragmentos).decode()
+        # Encabezado y un fragmento cada dos filas
+        self.assertEqual(len(fragmentos), 4)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="boleto-', response['Content-Disposition'])
+        filas = list(csv.DictReader(StringIO(contenido)))
+        self.assertEqual(len(filas), viaje.boletos.count())
+        self.assertEqual({fila['viaje_id'] for fila in filas}, {str(viaje.pk)})
+        self.assertEqual(filas[0]['linea'], str(viaje.ruta.linea.numero))
+        self.assertEqual(sorted(fila['monto'] for fila in filas), ['1.50'] * 5 + ['10.00'])
+        consultas = [q for q in ctx.captured_queries if 'FROM "boletos"' in q['sql']]
+        self.assertEqual(len(consultas), 1)
+
+    def test_ndjson_y_busqueda(self):
+        Incidente.objects.create(descripcion='Choque leve', gravedad='media')
+        response, contenido = self.exportar('incidente', formato='ndjson', search='choque')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        filas = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual(len(filas), 1)
+        self.assertEqual(
+            (filas[0]['descripcion'], filas[0]['gravedad'], filas[0]['resuelto'], filas[0]['viaje_id']),
+            ('Choque leve', 'media', False, None),
+        )
+        _, contenido = self.exportar('viaje', formato='ndjson', ordering='fecha')
+        self.assertEqual(len(contenido.splitlines()), Viaje.objects.count())
+
+    def test_csv_sin_formulas(self):
+        peligrosas = ['=HYPERLINK("http://x")', '+1+1', '-2+3', '@SUMA(A1)', '\tx', '\rx']
+        for descripcion in peligrosas + ['Choque leve']:
+            Incidente.objects.create(descripcion=descripcion, gravedad='media')
+        _, contenido = self.exportar('incidente')
+        descripciones = {fila['descripcion'] for fila in csv.DictReader(StringIO(contenido, newline=''))}
+        self.assertLessEqual({"'" + texto for texto in peligrosas} | {'Choque leve'}, descripciones)
+        self.assertFalse(descripciones & set(peligrosas))
+        # NDJSON no se interpreta como planilla: los textos salen tal cual
+        _, contenido = self.exportar('incidente', formato='ndjson')
+        descripciones = {json.loads(linea)['descripcion'] for linea in contenido.splitlines()}
+        self.assertLessEqual(set(peligrosas) | {'Choque leve'}, descripciones)
+
+    def test_formato_y_permisos(self):
+        response, _ = self.exportar('boleto', formato='xlsx')
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(User.objects.create_user(username='comun'))
+        for basename in ('boleto', 'viaje', 'incidente'):
+            response, _ = self.exportar(basename)
+            self.assertEqual(response.status_code, 403)
+
+
+class BusquedaTest(APITestCase):
+    """`?search=` con `BusquedaFilter` (en SQLite, el comportamiento de `SearchFilter`)"""
+
+    def setUp(self):
+        crear_red(2)
+        Incidente.objects.create(descripcion='Choque leve con un camión', gravedad='media')
+        Parada.objects.create(nombre='Plaza Independencia', direccion='Av. Sarmiento 100')
+
+    def buscar(self, basename, termino, **params):
+        response = self.client.get(reverse(f'{basename}-list'), {'search': termino, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_busca_en_los_campos_de_la_vista(self):
+        self.assertEqual([p['nombre'] for p in self.buscar('parada', 'independencia sarmiento')], ['Plaza Independencia'])
+        self.assertEqual(len(self.buscar('incidente', 'camión')), 1)
+        self.assertEqual([c['dni'] for c in self.buscar('chofer', 'DNI00001')], ['DNI00001'])
+        self.assertEqual(len(self.buscar('mantenimiento', 'VEH0000')), 1)
+        self.assertEqual(self.buscar('parada', 'inexistente'), [])
+
+    def test_ordering_explicito(self):
+        nombres = [p['nombre'] for p in self.buscar('parada', 'parada', ordering='-nombre')]
+        self.assertEqual(nombres, ['Parada 1', 'Parada 0'])
+
+    def test_clasificacion_de_campos(self):
+        self.assertEqual(
+            clasificar_campos(Mantenimiento, ['vehiculo__patente', 'descripcion']),
+            (['descripcion'], [], ['vehiculo__patente']),
+        )
+        self.assertEqual(clasificar_campos(Parada, ['nombre', '^direccion']), ([], ['nombre'], ['^direccion']))
+        self.assertEqual(sin_acentos('Camión Ñandú'), 'camion nandu')
+        # La patente se resuelve en `vehiculos`; los demás relacionados siguen con `icontains`
+        relacion, modelo, campo = campo_relacionado(Mantenimiento, 'vehiculo__patente')
+        self.assertEqual((relacion.attname, modelo, campo), ('vehiculo_id', Vehiculo, 'patente'))
+        self.assertIsNone(campo_relacionado(Mantenimiento, 'vehiculo__capacidad'))
+        self.assertIsNone(campo_relacionado(Mantenimiento, '^vehiculo__patente'))
+        self.assertIsNone(campo_relacionado(Viaje, 'ruta__linea__nombre'))
+
+
+class DatosSinteticosTest(TestCase):
+    """Comandos `generar_datos` y `prueba_carga` a escala mínima"""
+
+    def generar(self):
+        call_command(
+            'generar_datos', lineas=2, paradas=30, paradas_por_ruta=5, frecuencia=120, dias=3,
+            tarjetas=20, boletos_por_viaje=3, incidentes=0.5, stdout=StringIO(),
+        )
+
+    def test_genera_red_e_historia(self):
+        self.generar()
+        self.assertEqual(Ruta.objects.count(), 4)
+        for ruta in Ruta.objects.all():
+            self.assertEqual(list(ruta.paradas_orden.values_list('orden', flat=True)), [1, 2, 3, 4, 5])
+            self.assertTrue(ruta.horarios.exists())
+        hoy = timezone.localdate()
+        self.assertEqual(
+            set(Viaje.objects.values_list('fecha', flat=True)),
+            {hoy - timedelta(days=dias) for dias in range(3)},
+        )
+        # Las fechas de compra son las generadas, no la de la inserción
+        self.assertLess(timezone.localdate(Boleto.objects.order_by('fecha_compra').first().fecha_compra), hoy)
+        self.assertFalse(Boleto.objects.filter(fecha_compra__gt=timezone.now()).exists())
+        self.assertFalse(Boleto.objects.exclude(viaje__estado__in=['finalizado', 'en_curso']).exists())
+        self.assertEqual(
+            sum(ResumenBoletosDia.objects.values_list('boletos', flat=True)), Boleto.objects.count()
+        )
+        # Se puede generar otra vez sobre la misma base
+        self.generar()
+        self.assertEqual(Linea.objects.count(), 4)
+
+    def test_prueba_carga(self):
+        self.generar()
+        with tempfile.TemporaryDirectory() as directorio:
+            archivo = os.path.join(directorio, 'carga.json')
+            call_command('prueba_carga', solicitudes=60, calentamiento=5, guardar=archivo, stdout=StringIO())
+            with open(archivo, encoding='utf-8') as resultado:
+                resultado = json.load(resultado)
+        total = resultado['solicitudes']['total']
+        self.assertEqual((total['solicitudes'], total['errores']), (60, 0))
+        self.assertLessEqual(total['p50_ms'], total['p99_ms'])
+        self.assertIsNotNone(total['consultas_media'])
+        self.assertEqual(resultado['pools'], {})
+        self.assertNotIn('comprar_boleto', resultado['solicitudes'])
+        with self.assertRaises(CommandError):
+            call_command('prueba_carga', mezcla='comprar_boleto=5', stdout=StringIO())
+
+
+class InstrumentacionTest(APITestCase):
+    """`InstrumentacionMiddleware`: Server-Timing, log y detección de consultas repetidas"""
+
+    def middleware(self, repeticiones):
+        def vista(request):
+            for i in range(repeticiones):
+                list(Linea.objects.filter(numero=i))
+            return HttpResponse('ok')
+        return InstrumentacionMiddleware(vista)
+
+    def test_server_timing_y_log(self):
+        crear_red(3)
+        with self.assertLogs('transporte.instrumentacion', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('viaje-list'), {'expand': 'ruta.linea,vehiculo'})
+        metricas = {parte.split(';')[0].strip(): parte for parte in response['Server-Timing'].split(',')}
+        self.assertEqual(set(metricas), {'db', 'serializacion', 'total'})
+        self.assertIn(f'desc="{len(ctx)} consultas"', metricas['db'])
+        registro = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((registro['ruta'], registro['estado'], registro['consultas']), ('/api/viajes/', 200, len(ctx)))
+        self.assertGreater(registro['serializacion_ms'], 0)
+        self.assertEqual(registro['repetidas'], [])
+
+    def test_consultas_repetidas(self):
+        request = RequestFactory().get('/api/lineas/')
+        self.assertEqual(self.middleware(10)(request).status_code, 200)
+        with self.assertRaisesMessage(ConsultasRepetidas, 'ejecutó 11 veces'):
+            self.middleware(11)(request)
+        with self.settings(CONSULTAS_REPETIDAS_ERROR=False):
+            with self.assertLogs('transporte.instrumentacion', 'WARNING') as logs:
+                self.assertEqual(self.middleware(11)(request).status_code, 200)
+        self.assertEqual(json.loads(logs.records[0].getMessage())['repetidas'][0]['veces'], 11)
+
+    def test_maximo_de_la_vista(self):
+        request = RequestFactory().get('/api/lineas/')
+        middleware = self.middleware(20)
+        vista = mock.Mock(
+            cls=type('Lote', (), {'consultas_repetidas_maximo': 50}),
+            initkwargs={'basename': 'lote'}, actions={'get': 'list'},
+        )
+        middleware.process_view(request, vista, (), {})
+        self.assertEqual(middleware(request).status_code, 200)
+        # Declarado en el `@action`
+        request = RequestFactory().get('/api/lineas/')
+        vista = mock.Mock(
+            cls=type('Vista', (), {'consultas_repetidas_maximo': None}),
+            initkwargs={'basename': 'lote', 'consultas_repetidas_maximo': 50}, actions={'get': 'lote'},
+        )
+        middleware.process_view(request, vista, (), {})
+        self.assertEqual(middleware(request).status_code, 200)
+
+    def test_huella(self):
+        self.assertEqual(
+            huella('SELECT "a" FROM "t" WHERE "id" IN (%s, %s, %s) AND "n" = \'x\' LIMIT 21'),
+            huella('SELECT "a"  FROM "t" WHERE "id" IN (%s) AND "n" = \'y\' LIMIT 30'),
+        )
+
+
+class MetricasTest(APITestCase):
+    """`GET /api/metrics` en el formato de Prometheus, sumado entre procesos"""
+
+    def setUp(self):
+        registro_metricas.reiniciar()
+        cache_respuestas().clear()
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+
+    def metricas(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('metricas'))
+        self.client.force_authenticate(None)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return dict(linea.rsplit(' ', 1) for linea in response.content.decode().splitlines() if not linea.startswith('#'))
+
+    def test_por_vista_y_accion(self):
+        crear_red(2)
+        self.client.get(reverse('linea-list'))
+        self.client.get(reverse('linea-list'))
+        self.client.get(reverse('parada-cercanas'), {'lat': 'x'})
+        self.client.get('/api/inexistente/')
+        metricas = self.metricas()
+        self.assertEqual(metricas['transporte_solicitudes_total{vista="linea",accion="list",metodo="GET",estado="200"}'], '2')
+        self.assertEqual(metricas['transporte_solicitudes_total{vista="parada",accion="cercanas",metodo="GET",estado="400"}'], '1')
+        self.assertEqual(metricas['transporte_solicitudes_total{vista="sin_ruta",accion="get",metodo="GET",estado="404"}'], '1')
+        self.assertEqual(metricas['transporte_solicitud_duracion_segundos_count{vista="linea",accion="list"}'], '2')
+        self.assertEqual(metricas['transporte_solicitud_duracion_segundos_bucket{vista="linea",accion="list",le="+Inf"}'], '2')
+        self.assertEqual(metricas['transporte_solicitud_consultas_bucket{vista="parada",accion="cercanas",le="0"}'], '1')
+        self.assertEqual(metricas['transporte_cache_respuestas_total{vista="linea",accion="list",resultado="acierto"}'], '1')
+        self.assertEqual(metricas['transporte_cache_respuestas_tasa_aciertos{vista="linea",accion="list"}'], '0.5')
+        self.assertGreater(int(metricas['transporte_respuesta_bytes_sum{vista="linea",accion="list"}']), 0)
+        self.assertEqual(metricas['transporte_procesos'], '1')
+
+    def test_suma_los_archivos_de_otros_procesos(self):
+        with tempfile.TemporaryDirectory() as directorio, self.settings(METRICAS_DIRECTORIO=directorio):
+            otro = RegistroMetricas()
+            otro.registrar('linea', 'list', 'GET', 200, 0.2, 100, 2, 0.01)
+            otro.guardar()
+            viejo = RegistroMetricas()
+            viejo.registrar('linea', 'list', 'GET', 200, 0.2, 100, 2, 0.01)
+            viejo.guardar()
+            os.utime(viejo.archivo(), (0, 0))
+            registro_metricas._archivo = None
+            self.client.get(reverse('linea-list'))
+            metricas = self.metricas()
+            self.assertFalse(os.path.exists(viejo.archivo()))
+            registro_metricas._archivo = None
+        self.assertEqual(metricas['transporte_procesos'], '2')
+        self.assertEqual(metricas['transporte_solicitudes_total{vista="linea",accion="list",metodo="GET",estado="200"}'], '2')
+        self.assertEqual(metricas['transporte_solicitud_duracion_segundos_bucket{vista="linea",accion="list",le="0.25"}'], '2')
+        self.assertEqual(metricas['transporte_solicitud_duracion_segundos_bucket{vista="linea",accion="list",le="0.1"}'], '1')
+
+    def test_guardado_concurrente(self):
+        errores = []
+
+        def guardar():
+            try:
+                for _ in range(50):
+                    otro.guardar()
+            except Exception as error:
+                errores.append(error)
+
+        with tempfile.TemporaryDirectory() as directorio, self.settings(METRICAS_DIRECTORIO=directorio):
+            otro = RegistroMetricas()
+            otro.registrar('linea', 'list', 'GET', 200, 0.2, 100, 2, 0.01)
+            hilos = [threading.Thread(target=guardar) for _ in range(8)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            with open(otro.archivo(), encoding='utf-8') as entrada:
+                self.assertEqual(json.load(entrada)['solicitudes'], [['linea', 'list', 'GET', 200, 1]])
+        self.assertEqual(errores, [])
+
+    def test_error_al_guardar_no_falla_la_solicitud(self):
+        with tempfile.NamedTemporaryFile() as archivo, \
+                self.settings(METRICAS_DIRECTORIO=os.path.join(archivo.name, 'metricas'), METRICAS_INTERVALO=0):
+            registro_metricas._archivo = None
+            with self.assertLogs('transporte.metricas', 'ERROR'):
+                self.assertEqual(self.client.get(reverse('linea-list')).status_code, 200)
+            registro_metricas._archivo = None
+
+    def test_permisos_y_token(self):
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 401)
+        with self.settings(METRICAS_TOKEN='secreto'):
+            self.assertEqual(self.client.get(reverse('metricas'), HTTP_AUTHORIZATION='Bearer secreto').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metricas'), HTTP_AUTHORIZATION='Bearer otro').status_code, 401)
+        self.client.force_authenticate(User.objects.create_user(username='comun'))
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 403)
+
+    def test_pool_de_conexiones(self):
+        pool = mock.Mock()
+        pool.get_stats.return_value = {
+            'pool_min': 2, 'pool_max': 20, 'pool_size': 8, 'pool_available': 3,
+            'requests_waiting': 1, 'requests_queued': 7, 'requests_wait_ms': 1500,
+        }
+        with mock.patch.object(type(connections['default']), '_connection_pools', {'default': pool}, create=True):
+            metricas = self.metricas()
+        self.assertEqual(metricas['transporte_db_pool{alias="default",estadistica="pool_size"}'], '8')
+        self.assertEqual(metricas['transporte_db_pool_saturacion{alias="default"}'], '0.25')
+        self.assertEqual(metricas['transporte_db_pool_esperando{alias="default"}'], '1')
+        self.assertEqual(metricas['transporte_db_pool_esperas_total{alias="default"}'], '7')
+        self.assertEqual(metricas['transporte_db_pool_espera_segundos_total{alias="default"}'], '1.5')
+
+
+class PosicionesVehiculosTest(APITestCase):
+    """Ingesta de posiciones GPS en buffers circulares por vehículo y foto de la flota desde memoria"""
+
+    def setUp(self):
+        registro_posiciones.reiniciar()
+        crear_red(2)
+        self.vehiculos = list(Vehiculo.objects.order_by('pk').values_list('pk', flat=True))
+        self.inicio = (timezone.localtime() - timedelta(days=1)).replace(hour=12, minute=0, second=0, microsecond=0)
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='admin'))
+
+    def posicion(self, vehiculo, segundos, **datos):
+        return {
+            'vehiculo': vehiculo, 'fecha_hora': (self.inicio + timedelta(seconds=segundos)).isoformat(),
+            'latitud': -34.6 + segundos / 1e4, 'longitud': -58.4, **datos,
+        }
+
+    def enviar(self, posiciones):
+        response = self.client.post(reverse('vehiculo-posiciones'), posiciones, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_permisos_de_la_ingesta(self):
+        url = reverse('vehiculo-posiciones')
+        cuerpo = [self.posicion(self.vehiculos[0], 0)]
+        self.client.force_authenticate(User.objects.exclude(is_staff=True).first())
+        self.assertEqual(self.client.post(url, cuerpo, format='json').status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(url, cuerpo, format='json').status_code, 401)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.settings(POSICIONES_TOKEN='pasarela'):
+            self.assertEqual(
+                self.client.post(url, cuerpo, format='json', HTTP_AUTHORIZATION='Bearer pasarela').status_code, 200
+            )
+            self.assertEqual(
+                self.client.post(url, cuerpo, format='json', HTTP_AUTHORIZATION='Bearer otro').status_code, 401
+            )
+        self.assertEqual(registro_posiciones.flota()[0]['vehiculo'], self.vehiculos[0])
+
+    def test_ingesta_y_flota(self):
+        primero, segundo = self.vehiculos
+        resultado = self.enviar([
+            self.posicion(primero, 0, velocidad=32.5, rumbo=90),
+            self.posicion(segundo, 0),
+            self.posicion(primero, 1),
+            self.posicion(999999, 1),
+            self.posicion(segundo, 1, latitud=-91),
+            self.posicion(primero, 1),
+            'x',
+            {'vehiculo': segundo, 'longitud': 'oeste'},
+        ])
+        self.assertEqual((resultado['aceptadas'], resultado['rechazadas']), (3, 5))
+        errores = {error['indice']: error['errores'] for error in resultado['errores']}
+        self.assertEqual(set(errores[3]), {'vehiculo'})
+        self.assertEqual(set(errores[4]), {'latitud'})
+        self.assertEqual(set(errores[5]), {'fecha_hora'})
+        self.assertEqual(set(errores[6]), {'non_field_errors'})
+        self.assertEqual(set(errores[7]), {'latitud', 'longitud'})
+
+        self.client.force_authenticate(None)
+        with self.assertNumQueries(0):
+            flota = self.client.get(reverse('vehiculo-posiciones')).json()
+        self.assertEqual([posicion['vehiculo'] for posicion in flota], [primero, segundo])
+        self.assertEqual(flota[0]['latitud'], -34.6 + 1 / 1e4)
+        self.assertIsNone(flota[0]['velocidad'])
+        self.assertEqual(
+            parse_datetime(flota[0]['fecha_hora']), self.inicio + timedelta(seconds=1)
+        )
+        self.assertEqual(self.client.get(reverse('vehiculo-posiciones'), {'max_edad': 60}).json(), [])
+        self.assertEqual(self.client.get(reverse('vehiculo-posiciones'), {'max_edad': 0}).status_code, 400)
+        self.assertEqual(
+            self.client.post(reverse('vehiculo-posiciones'), [self.posicion(primero, 2)], format='json').status_code,
+            401
+        )
+
+    def test_buffer_circular(self):
+        vehiculo = self.vehiculos[0]
+        with self.settings(POSICIONES_POR_VEHICULO=3):
+            registro_posiciones.reiniciar()
+            self.enviar([self.posicion(vehiculo, segundos, rumbo=segundos) for segundos in range(5)])
+        recorrido = self.client.get(reverse('vehiculo-recorrido', args=[vehiculo])).json()
+        self.assertEqual([posicion['rumbo'] for posicion in recorrido], [2, 3, 4])
+        self.assertEqual(self.client.get(reverse('vehiculo-recorrido', args=[self.vehiculos[1]])).json(), [])
+
+    def test_ndjson(self):
+        cuerpo = '\n'.join(json.dumps(self.posicion(vehiculo, 0)) for vehiculo in self.vehiculos)
+        response = self.client.post(reverse('vehiculo-posiciones'), cuerpo, content_type='application/x-ndjson')
+        self.assertEqual(response.data['aceptadas'], 2)
+
+    def test_guarda_recorrido_submuestreado(self):
+        vehiculo = self.vehiculos[0]
+        with self.settings(POSICIONES_INTERVALO_GUARDADO=30, POSICIONES_LOTE_GUARDADO=2):
+            with CaptureQueriesContext(connection) as ctx:
+                self.enviar([self.posicion(vehiculo, segundos) for segundos in (0, 10, 30, 40, 60)])
+            self.assertEqual(sum(q['sql'].startswith('INSERT') for q in ctx.captured_queries), 1)
+            self.assertEqual(PosicionVehiculo.objects.count(), 3)
+            # Menos del lote y sin vencer el intervalo: queda pendiente
+            self.enviar([self.posicion(vehiculo, 90)])
+            self.assertEqual(PosicionVehiculo.objects.count(), 3)
+            registro_posiciones.guardar_pendientes()
+        guardadas = PosicionVehiculo.objects.filter(vehiculo=vehiculo).values_list('fecha_hora', flat=True)
+        self.assertEqual(list(guardadas), [self.inicio + timedelta(seconds=segundos) for segundos in (0, 30, 60, 90)])
+        response = self.client.get(
+            reverse('vehiculo-recorrido', args=[vehiculo]), {'fecha': timezone.localdate(self.inicio).isoformat()}
+        )
+        self.assertEqual(response.data[1], {
+            'fecha_hora': (self.inicio + timedelta(seconds=30)).astimezone(timezone.get_current_timezone()).isoformat(),
+            'latitud': -34.6 + 30 / 1e4, 'longitud': -58.4, 'velocidad': None, 'rumbo': None,
+        })
+
+    def test_vehiculos_nuevos_y_borrados(self):
+        self.enviar([self.posicion(self.vehiculos[0], 0)])
+        nuevo = Vehiculo.objects.create(patente='NUEVO', capacidad=30)
+        self.assertEqual(self.enviar([self.posicion(nuevo.pk, 0)])['aceptadas'], 1)
+        nuevo.delete()
+        self.assertEqual(
+            [posicion['vehiculo'] for posicion in self.client.get(reverse('vehiculo-posiciones')).json()],
+            [self.vehiculos[0]]
+        )
+        self.assertEqual(self.enviar([self.posicion(nuevo.pk, 1)])['rechazadas'], 1)
+
+
+class AutenticacionJWTTest(APITestCase):
+    """Usuarios de los tokens JWT desde la cache o los claims, sin consultar `auth_user` en cada solicitud"""
+
+    def setUp(self):
+        cache_usuarios().clear()
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+
+    def token(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'admin', 'password': 'admin'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def metricas(self, access):
+        """Estado de `GET /api/metrics` (solo administradores) y consultas a `auth_user`"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('metricas'), HTTP_AUTHORIZATION=f'Bearer {access}')
+        return response.status_code, sum('"auth_user"' in q['sql'] for q in ctx.captured_queries)
+
+    def test_cache_e_invalidacion(self):
+        access = self.token()['access']
+        self.assertEqual(self.metricas(access), (200, 1))
+        self.assertEqual(self.metricas(access), (200, 0))
+        self.admin.is_staff = self.admin.is_superuser = False
+        self.admin.save()
+        self.assertEqual(self.metricas(access), (403, 1))
+        self.admin.is_active = False
+        self.admin.save()
+        self.assertEqual(self.metricas(access)[0], 401)
+        self.admin.delete()
+        self.assertEqual(self.metricas(access)[0], 401)
+
+    def test_vence_con_el_ttl(self):
+        access = self.token()['access']
+        self.metricas(access)
+        User.objects.filter(pk=self.admin.pk).update(is_staff=False, is_superuser=False)
+        self.assertEqual(self.metricas(access), (200, 0))
+        with self.settings(JWT_USUARIOS_TTL=0):
+            cache_usuarios().clear()
+            self.assertEqual(self.metricas(access), (403, 1))
+
+    def test_usuario_diferido(self):
+        access = self.token()['access']
+        self.metricas(access)
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(0):
+            usuario, _ = JWTCacheAuthentication().authenticate(request)
+        self.assertEqual(usuario, self.admin)
+        self.assertTrue(usuario.is_superuser)
+        with self.assertNumQueries(1):
+            self.assertEqual(usuario.email, self.admin.email)
+
+    def test_sin_estado(self):
+        with self.settings(JWT_SIN_ESTADO=True):
+            tokens = self.token()
+            self.assertEqual(self.metricas(tokens['access']), (200, 0))
+            self.assertEqual(self.metricas(tokens['access']), (200, 0))
+
+            # Un token emitido sin los claims se resuelve con la cache
+            anterior = str(RefreshToken.for_user(self.admin).access_token)
+            self.assertEqual(self.metricas(anterior), (200, 1))
+
+            # Los cambios se ven recién con el próximo access token
+            self.admin.is_staff = self.admin.is_superuser = False
+            self.admin.save()
+            self.assertEqual(self.metricas(tokens['access']), (200, 0))
+            response = self.client.post(reverse('token_refresh'), {'refresh': tokens['refresh']})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.metricas(response.data['access']), (403, 0))
+
+
+    def test_esquema_openapi(self):
+        avisos = StringIO()
+        with redirect_stderr(avisos):
+            response = self.client.get(reverse('schema'), {'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('could not resolve authenticator', avisos.getvalue())
+        esquemas = response.data['components']['securitySchemes']
+        self.assertEqual(esquemas['jwtAuth'], {'type': 'http', 'scheme': 'bearer', 'bearerFormat': 'JWT'})
+        self.assertEqual(esquemas['metricasToken'], {'type': 'http', 'scheme': 'bearer'})
+        self.assertIn({'jwtAuth': []}, response.data['paths']['/api/lineas/']['post']['security'])
+
+class LecturaAsincronaTest(TestCase):
+    """Listados y detalles asíncronos (`LECTURAS_ASINCRONAS`): las mismas respuestas que las vistas de DRF"""
+
+    @classmethod
+    def setUpTestData(cls):
+        crear_red(3)
+        cls.admin = User.objects.create_superuser(username='admin', password='admin')
+
+    def setUp(self):
+        # Las URLs del proyecto se cargaron sin el ajuste: se arman otras con las vistas asíncronas
+        with self.settings(LECTURAS_ASINCRONAS=True):
+            router = DefaultRouter()
+            router.register(r'lineas', LineaViewSet, basename='linea')
+            router.register(r'paradas', ParadaViewSet, basename='parada')
+            router.register(r'rutas', RutaViewSet, basename='ruta')
+            router.register(r'horarios', HorarioViewSet, basename='horario')
+            router.register(r'viajes', ViajeViewSet, basename='viaje')
+            self.urls = ModuleType('urls_asincronas')
+            self.urls.urlpatterns = [path('api/', include(router.urls))]
+
+    def asincrona(self, metodo, url, datos=None, **extra):
+        with self.settings(ROOT_URLCONF=self.urls):
+            return async_to_sync(getattr(self.async_client, metodo))(url, datos, **extra)
+
+    def comparar(self, url, datos=None, **extra):
+        cache_respuestas().clear()
+        sincrona = self.client.get(url, datos, **extra)
+        cache_respuestas().clear()
+        asincrona = self.asincrona('get', url, datos, **extra)
+        self.assertEqual(asincrona.status_code, sincrona.status_code, url)
+        self.assertEqual(asincrona.content, sincrona.content, url)
+        self.assertEqual(asincrona.get('ETag'), sincrona.get('ETag'), url)
+        self.assertEqual(asincrona.get('X-Cache'), sincrona.get('X-Cache'), url)
+        return asincrona
+
+    def test_solo_listados_y_detalles_con_el_ajuste(self):
+        for url in ['/api/lineas/', '/api/lineas/1/', '/api/viajes/', '/api/viajes/1/']:
+            self.assertTrue(iscoroutinefunction(resolve(url, urlconf=self.urls).func), url)
+        self.assertFalse(iscoroutinefunction(resolve('/api/paradas/cercanas/', urlconf=self.urls).func))
+        self.assertFalse(iscoroutinefunction(resolve('/api/lineas/').func))
+        self.assertFalse(iscoroutinefunction(LineaViewSet.as_view({'get': 'list'})))
+
+    def test_mismas_respuestas(self):
+        linea, ruta, viaje = Linea.objects.first(), Ruta.objects.first(), Viaje.objects.first()
+        for url, datos in [
+            ('/api/lineas/', {}),
+            ('/api/lineas/', {'page_size': 2, 'page': 2}),
+            ('/api/lineas/', {'page': 9}),
+            ('/api/lineas/', {'fields': 'id,numero', 'ordering': '-numero'}),
+            (f'/api/lineas/{linea.pk}/', {'expand': 'rutas'}),
+            ('/api/lineas/999999/', {}),
+            ('/api/lineas/abc/', {}),
+            ('/api/paradas/', {'search': 'parada 1'}),
+            ('/api/rutas/', {'linea': linea.pk, 'expand': 'linea,paradas.parada'}),
+            ('/api/rutas/', {'linea': 999999}),
+            (f'/api/rutas/{ruta.pk}/', {'expand': 'linea,paradas.parada'}),
+            ('/api/horarios/', {'ruta': ruta.pk, 'expand': 'ruta.linea'}),
+            ('/api/viajes/', {'page_size': 2, 'expand': 'ruta,vehiculo,chofer'}),
+            ('/api/viajes/', {'cursor': 'invalido'}),
+            (f'/api/viajes/{viaje.pk}/', {'omit': 'total_boletos'}),
+        ]:
+            self.comparar(url, datos)
+
+        siguiente = self.comparar('/api/viajes/', {'page_size': 1}).json()['next']
+        while siguiente:
+            siguiente = self.comparar(siguiente).json()['next']
+
+    def test_get_condicional_y_cache(self):
+        cache_respuestas().clear()
+        primera = self.asincrona('get', '/api/lineas/')
+        self.assertEqual(primera['X-Cache'], 'MISS')
+        self.assertEqual(self.asincrona('get', '/api/lineas/')['X-Cache'], 'HIT')
+        self.assertEqual(self.asincrona('get', '/api/lineas/', headers={'If-None-Match': primera['ETag']}).status_code, 304)
+        self.assertEqual(self.asincrona('head', '/api/lineas/').status_code, 200)
+
+    def test_autenticacion_y_escrituras(self):
+        token = str(RefreshToken.for_user(self.admin).access_token)
+        self.comparar('/api/lineas/', headers={'Authorization': f'Bearer {token}'})
+        self.comparar('/api/lineas/', headers={'Authorization': 'Bearer invalido'})
+        # Los demás métodos siguen en la vista de DRF
+        self.assertEqual(self.asincrona('post', '/api/lineas/', {'numero': 5, 'nombre': 'Nueva'}).status_code, 401)
+        response = self.asincrona(
+            'post', '/api/lineas/', {'numero': 5, 'nombre': 'Nueva'}, headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_instrumentacion(self):
+        cache_respuestas().clear()
+        response = self.asincrona('get', '/api/rutas/', {'expand': 'linea,paradas.parada'})
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* consultas"')
+
+
+class EventosEnVivoTest(TestCase):
+    """Eventos de viajes e incidentes por /api/eventos/: filtros, desborde, reconexión y varios procesos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        crear_red(2)
+        cls.viaje, cls.otro_viaje = Viaje.objects.order_by('pk')[:2]
+
+    def evento(self, linea=1, tipo='viaje'):
+        return {'tipo': tipo, 'accion': 'creado', 'linea': linea, 'ruta': None, 'vehiculo': None, 'datos': {}}
+
+    def test_filtros_desborde_y_reconexion(self):
+        async def probar():
+            broker = Broker()
+            suscripcion, anteriores = broker.suscribir({'linea': {1}}, {'viaje'})
+            self.assertEqual(anteriores, [])
+            for evento in [self.evento(1), self.evento(2), self.evento(1, 'incidente'), self.evento(1)]:
+                broker.publicar(evento)
+            eventos, desbordada = await suscripcion.esperar(1)
+            self.assertEqual([evento['id'].split('-')[1] for evento in eventos], ['1', '4'])
+            self.assertFalse(desbordada)
+            self.assertEqual(await suscripcion.esperar(0.01), ([], False))
+
+            # Reconexión: los eventos perdidos que pasan los filtros, o None si no se pueden recuperar
+            broker.publicar(self.evento(1))
+            otra, anteriores = broker.suscribir({}, {'viaje', 'incidente'}, eventos[0]['id'])
+            self.assertEqual([evento['id'].split('-')[1] for evento in anteriores], ['2', '3', '4', '5'])
+            self.assertIsNone(broker.suscribir({}, {'viaje'}, 'otro-1')[1])
+            self.assertIsNone(broker.suscribir({}, {'viaje'}, f'{broker.instancia}-99')[1])
+            with self.settings(EVENTOS_HISTORIAL=2):
+                broker.publicar(self.evento(1))
+                self.assertIsNone(broker.suscribir({}, {'viaje'}, eventos[0]['id'])[1])
+            broker.desuscribir(otra)
+
+            with self.settings(EVENTOS_MAX_PENDIENTES=2):
+                lenta, _ = broker.suscribir({}, {'viaje'})
+            for _ in range(3):
+                broker.publicar(self.evento(1))
+            await asyncio.sleep(0)
+            self.assertEqual(await lenta.esperar(1), ([], True))
+            broker.publicar(self.evento(1))
+            eventos, desbordada = await lenta.esperar(1)
+            self.assertEqual((len(eventos), desbordada), (1, False))
+
+        async_to_sync(probar)()
+
+    def test_varios_procesos(self):
+        async def probar(directorio):
+            origen, destino = Broker(), Broker()
+            suscripcion, _ = destino.suscribir({'linea': {1}}, {'viaje'})
+            origen.publicar(self.evento(2))
+            origen.publicar(self.evento(1))
+            try:
+                eventos, _ = await suscripcion.esperar(5)
+            finally:
+                destino.detener()
+            self.assertEqual([(evento['linea'], evento['id']) for evento in eventos], [(1, f'{destino.instancia}-2')])
+            self.assertEqual(len(os.listdir(directorio)), 1)
+
+        with tempfile.TemporaryDirectory() as directorio, \
+                self.settings(EVENTOS_DIRECTORIO=directorio, EVENTOS_INTERVALO=0.01):
+            async_to_sync(probar)(directorio)
+
+    def cambiar_viajes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Viaje.objects.create(
+                ruta=self.otro_viaje.ruta, vehiculo=self.otro_viaje.vehiculo, chofer=self.otro_viaje.chofer,
+                fecha=date(2025, 1, 2)
+            )
+            self.viaje.estado = 'en_curso'
+            self.viaje.save()
+            Incidente.objects.create(viaje=self.viaje, descripcion='Pinchazo', gravedad='media')
+
+    def test_sin_clientes_no_publica(self):
+        with mock.patch.object(broker_eventos, '_con_historial', False), \
+                mock.patch.object(broker_eventos, 'publicar') as publicar:
+            with CaptureQueriesContext(connection) as ctx:
+                self.cambiar_viajes()
+            publicar.assert_not_called()
+            # El incidente no consulta su viaje para armar el evento
+            self.assertFalse([q for q in ctx.captured_queries if 'FROM "viajes" INNER JOIN "rutas"' in q['sql']])
+            with tempfile.TemporaryDirectory() as directorio, self.settings(EVENTOS_DIRECTORIO=directorio):
+                self.cambiar_viajes()
+            self.assertEqual(publicar.call_count, 3)
+            broker_eventos._con_historial = True
+            self.cambiar_viajes()
+            self.assertEqual(publicar.call_count, 6)
+
+    def test_flujo(self):
+        ruta = self.viaje.ruta
+
+        async def probar():
+            clientes = broker_eventos.clientes()
+            response = await self.async_client.get('/api/eventos/', {'linea': ruta.linea_id})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+            self.assertEqual(broker_eventos.clientes(), clientes + 1)
+            contenido = aiter(response)
+            self.assertEqual(await anext(contenido), b'retry: 3000\n\n')
+
+            await sync_to_async(self.cambiar_viajes)()
+            bloques = []
+            while sum(bloque.count(b'\n\n') for bloque in bloques) < 2:
+                bloques.append(await asyncio.wait_for(anext(contenido), 5))
+            eventos = b''.join(bloques).decode().split('\n\n')[:2]
+            self.assertRegex(eventos[0], r'^id: \w+-\d+\nevent: viaje\ndata: ')
+            viaje = json.loads(eventos[0].split('data: ')[1])
+            self.assertEqual((viaje['accion'], viaje['linea'], viaje['ruta']), ('actualizado', ruta.linea_id, ruta.pk))
+            self.assertEqual((viaje['datos']['id'], viaje['datos']['estado']), (self.viaje.pk, 'en_curso'))
+            self.assertIn('event: incidente', eventos[1])
+            incidente = json.loads(eventos[1].split('data: ')[1])
+            self.assertEqual((incidente['accion'], incidente['vehiculo']), ('creado', self.viaje.vehiculo_id))
+
+            with self.settings(EVENTOS_LATIDO=0.01):
+                self.assertEqual(await asyncio.wait_for(anext(contenido), 5), b': latido\n\n')
+
+            # El servidor ASGI cancela la respuesta cuando el cliente se desconecta
+            lectura = asyncio.ensure_future(anext(contenido))
+            await asyncio.sleep(0.01)
+            lectura.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await lectura
+            self.assertEqual(broker_eventos.clientes(), clientes)
+
+        async_to_sync(probar)()
+
+    def test_parametros_y_wsgi(self):
+        async def obtener(datos):
+            return await self.async_client.get('/api/eventos/', datos)
+
+        for datos in [{'linea': 'a'}, {'tipo': 'boleto'}, {'tipo': ','}]:
+            self.assertEqual(async_to_sync(obtener)(datos).status_code, 400, datos)
+        with self.settings(EVENTOS_MAX_CLIENTES=0):
+            self.assertEqual(async_to_sync(obtener)({}).status_code, 503)
+        self.assertEqual(self.client.get('/api/eventos/').status_code, 501)
+        self.assertEqual(self.client.post('/api/eventos/').status_code, 405)
+
+
+class PruebaCargaAsgiTest(TransactionTestCase):
+    """`prueba_carga --interfaz asgi`: cada solicitud usa su hilo y su conexión, como con un servidor ASGI"""
+
+    def test_prueba_carga_asgi(self):
+        call_command(
+            'generar_datos', lineas=1, paradas=10, paradas_por_ruta=3, frecuencia=240, dias=1,
+            tarjetas=5, boletos_por_viaje=1, stdout=StringIO(),
+        )
+        with tempfile.TemporaryDirectory() as directorio:
+            archivo = os.path.join(directorio, 'carga.json')
+            call_command(
+                'prueba_carga', solicitudes=20, calentamiento=2, concurrencia=4, interfaz='asgi',
+                guardar=archivo, stdout=StringIO(), stderr=StringIO(),
+            )
+            with open(archivo, encoding='utf-8') as resultado:
+                resultado = json.load(resultado)
+        total = resultado['solicitudes']['total']
+        self.assertEqual((resultado['interfaz'], total['solicitudes'], total['errores']), ('asgi', 20, 0))
+        self.assertIsNotNone(total['consultas_media'])
+        with self.assertRaises(CommandError):
+            call_command('prueba_carga', url='http://localhost:8000', interfaz='asgi', stdout=StringIO())
@@ -3,7 +3,8 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, LineaViewSet, ParadaViewSet, RutaViewSet, RutaParadaViewSet,
     VehiculoViewSet, ChoferViewSet, HorarioViewSet, ViajeViewSet,
-    TarjetaViewSet, BoletoViewSet, MantenimientoViewSet, IncidenteViewSet
+    TarjetaViewSet, BoletoViewSet, MantenimientoViewSet, IncidenteViewSet,
+    PlanificadorView, EstadisticasCacheView, EstadisticasView, MetricasView, eventos
 )
 
 # Router para los ViewSets
@@ -23,5 +24,11 @@ router.register(r'mantenimientos', MantenimientoViewSet, basename='mantenimiento
 router.register(r'incidentes', IncidenteViewSet, basename='incidente')
 
 urlpatterns = [
+    path('planificador/', PlanificadorView.as_view(), name='planificador'),
+    path('estadisticas/', EstadisticasView.as_view(), name='estadisticas'),
+    # Sin barra final, como lo espera Prometheus
+    path('metrics', MetricasView.as_view(), name='metricas'),
+    path('eventos/', eventos, name='eventos'),
+    path('cache/estadisticas/', EstadisticasCacheView.as_view(), name='cache-estadisticas'),
     path('', include(router.urls)),
 ]
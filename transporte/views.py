@@ -1,9 +1,20 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.parsers import JSONParser
+from rest_framework.settings import api_settings
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import F
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from django.utils import timezone
+from datetime import date, time, timedelta
+from decimal import Decimal
 
 from .models import (
     Linea, Parada, Ruta, RutaParada, Vehiculo, Chofer,
@@ -13,9 +24,41 @@ from .serializers import (
     UserSerializer, UserRegistrationSerializer,
     LineaSerializer, ParadaSerializer, RutaSerializer, RutaParadaSerializer,
     VehiculoSerializer, ChoferSerializer, HorarioSerializer, ViajeSerializer,
-    TarjetaSerializer, BoletoSerializer, MantenimientoSerializer, IncidenteSerializer
+    TarjetaSerializer, BoletoSerializer, MantenimientoSerializer, IncidenteSerializer,
+    PosicionVehiculoSerializer
 )
-from .permissions import IsAdminOrReadOnly, IsOwnerOrAdmin
+from .permissions import IsAdminOrReadOnly, IsOwnerOrAdmin, IsAdminOrMetricsScraper, IsAdminOrPositionsGateway
+from .fieldsets import FieldsetViewSetMixin
+from .condicional import CondicionalViewSetMixin
+from .asincrono import LecturaAsincronaMixin
+from .exportacion import ExportacionViewSetMixin
+from .cache import RespuestaCacheViewSetMixin, estadisticas as estadisticas_cache
+from .pagination import KeysetCursorPagination
+from .parsers import NDJSONParser
+from .bulk import MAX_FILAS, ingresar_boletos
+from .busqueda import BusquedaFilter
+from .cercania import indice as indice_paradas
+from .eta import indice as indice_eta
+from .posiciones import MAX_POSICIONES, TokenPosicionesAuthentication, registro as registro_posiciones
+from .eventos import FILTROS as FILTROS_EVENTOS, TIPOS as TIPOS_EVENTOS, broker, flujo_sse
+from .metricas import (
+    TIPO_CONTENIDO as TIPO_CONTENIDO_METRICAS, TokenMetricasAuthentication, formato_prometheus, recolectar
+)
+from .estadisticas import DIMENSIONES, PERIODOS, consultar as consultar_estadisticas
+from .planificador import DIAS, a_segundos, formatear_hora, indice as indice_horarios
+
+CENTAVO = Decimal('0.01')
+
+
+def _hora_y_fecha(request):
+    """`hora` (HH:MM) y `fecha` (AAAA-MM-DD) de la consulta, por defecto las actuales"""
+    ahora = timezone.localtime()
+    hora = request.query_params.get('hora')
+    fecha = request.query_params.get('fecha')
+    return (
+        time.fromisoformat(hora) if hora else ahora.time(),
+        date.fromisoformat(fecha) if fecha else ahora.date(),
+    )
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -43,7 +86,7 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class LineaViewSet(viewsets.ModelViewSet):
+class LineaViewSet(CondicionalViewSetMixin, RespuestaCacheViewSetMixin, FieldsetViewSetMixin, LecturaAsincronaMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar líneas de transporte.
     GET: Público | POST/PUT/DELETE: Solo Admin
@@ -61,29 +104,86 @@ class LineaViewSet(viewsets.ModelViewSet):
         return [permissions.IsAdminUser()]
 
 
-class ParadaViewSet(viewsets.ModelViewSet):
+class ParadaViewSet(CondicionalViewSetMixin, RespuestaCacheViewSetMixin, FieldsetViewSetMixin, LecturaAsincronaMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar paradas.
     GET: Público | POST/PUT/DELETE: Solo Admin
     """
     queryset = Parada.objects.all()
     serializer_class = ParadaSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, BusquedaFilter, OrderingFilter]
     search_fields = ['nombre', 'direccion']
     ordering_fields = ['nombre', 'direccion']
+    max_cercanas = 100
+    max_salidas = 50
     
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'cercanas', 'proximas_salidas']:
             return [permissions.AllowAny()]
         return [permissions.IsAdminUser()]
+    
+    @action(detail=False, methods=['get'])
+    def cercanas(self, request):
+        """
+        Paradas más cercanas a un punto, ordenadas por distancia (en metros).
+        Parámetros: lat, lon, k (cantidad, por defecto 10) y radio (metros, opcional).
+        """
+        try:
+            latitud = float(request.query_params['lat'])
+            longitud = float(request.query_params['lon'])
+            k = int(request.query_params.get('k', 10))
+            radio = request.query_params.get('radio')
+            radio = float(radio) if radio else None
+            if (not -90 <= latitud <= 90 or not -180 <= longitud <= 180
+                    or not 1 <= k <= self.max_cercanas or (radio is not None and not radio > 0)):
+                raise ValueError()
+        except (KeyError, ValueError):
+            return Response(
+                {'error': f'Debe indicar lat y lon válidas, k entre 1 y {self.max_cercanas} y radio positivo'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(indice_paradas.cercanas(latitud, longitud, k, radio))
+    
+    @action(detail=True, methods=['get'], url_path='proximas-salidas')
+    def proximas_salidas(self, request, pk=None):
+        """
+        Próximas salidas desde la parada según los horarios de sus rutas.
+        Parámetros: hora, fecha (por defecto las actuales) y cantidad (por defecto 5).
+        """
+        try:
+            hora, fecha = _hora_y_fecha(request)
+            cantidad = int(request.query_params.get('cantidad', 5))
+            if not 1 <= cantidad <= self.max_salidas:
+                raise ValueError()
+        except ValueError:
+            return Response(
+                {'error': f'hora (HH:MM), fecha (AAAA-MM-DD) o cantidad (1 a {self.max_salidas}) inválidas'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        red = indice_horarios.red()
+        parada = int(pk) if pk.isdigit() else None
+        if parada not in red.paradas:
+            return Response({'error': 'Parada inexistente'}, status=status.HTTP_404_NOT_FOUND)
+        
+        salidas = red.proximas_salidas(parada, a_segundos(hora), fecha.weekday(), cantidad)
+        for salida in salidas:
+            salida['fecha'] = fecha + timedelta(days=salida.pop('dias'))
+        return Response({
+            'parada': parada,
+            'parada_nombre': red.paradas[parada]['nombre'],
+            'fecha': fecha,
+            'hora': formatear_hora(a_segundos(hora)),
+            'salidas': salidas,
+        })
 
 
-class RutaViewSet(viewsets.ModelViewSet):
+class RutaViewSet(CondicionalViewSetMixin, RespuestaCacheViewSetMixin, FieldsetViewSetMixin, LecturaAsincronaMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar rutas.
     GET: Público | POST/PUT/DELETE: Solo Admin
     """
-    queryset = Ruta.objects.select_related('linea').prefetch_related('paradas_orden__parada')
+    queryset = Ruta.objects.all()
     serializer_class = RutaSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['linea']
@@ -91,17 +191,53 @@ class RutaViewSet(viewsets.ModelViewSet):
     ordering_fields = ['nombre']
     
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'eta']:
             return [permissions.AllowAny()]
         return [permissions.IsAdminUser()]
+    
+    @action(detail=True, methods=['get'])
+    def eta(self, request, pk=None):
+        """
+        Tiempo estimado de llegada a una parada de la ruta según los viajes hechos.
+        Parámetros: parada (id), hora de salida desde la cabecera y fecha (por defecto las actuales).
+        """
+        try:
+            parada = int(request.query_params['parada'])
+            hora, fecha = _hora_y_fecha(request)
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Debe indicar la parada, y hora (HH:MM) y fecha (AAAA-MM-DD) válidas'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        ruta = int(pk) if pk.isdigit() else None
+        if ruta not in indice_eta.recorridos():
+            return Response({'error': 'Ruta inexistente'}, status=status.HTTP_404_NOT_FOUND)
+        salida = a_segundos(hora)
+        estimacion = indice_eta.estimar(ruta, parada, salida, fecha.weekday())
+        if estimacion is None:
+            return Response(
+                {'error': 'La parada no pertenece a la ruta o la ruta no tiene viajes ni horarios'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        llegada = estimacion.pop('llegada')
+        return Response({
+            'ruta': ruta,
+            'parada': parada,
+            'fecha': fecha,
+            'dia': DIAS[fecha.weekday()],
+            'salida': formatear_hora(salida),
+            'llegada_estimada': formatear_hora(llegada),
+            **estimacion,
+        })
 
 
-class RutaParadaViewSet(viewsets.ModelViewSet):
+class RutaParadaViewSet(CondicionalViewSetMixin, RespuestaCacheViewSetMixin, FieldsetViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar la relación ruta-parada.
     GET: Público | POST/PUT/DELETE: Solo Admin
     """
-    queryset = RutaParada.objects.select_related('ruta', 'parada')
+    queryset = RutaParada.objects.all()
     serializer_class = RutaParadaSerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['ruta', 'parada']
@@ -113,7 +249,7 @@ class RutaParadaViewSet(viewsets.ModelViewSet):
         return [permissions.IsAdminUser()]
 
 
-class VehiculoViewSet(viewsets.ModelViewSet):
+class VehiculoViewSet(FieldsetViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar vehículos.
     GET: Público | POST/PUT/DELETE: Solo Admin
@@ -124,9 +260,15 @@ class VehiculoViewSet(viewsets.ModelViewSet):
     filterset_fields = ['marca', 'modelo', 'anio']
     search_fields = ['patente', 'marca', 'modelo']
     ordering_fields = ['patente', 'marca', 'anio', 'capacidad']
+    # Lo redefine `posiciones`, que guarda los recorridos en varios INSERT
+    consultas_repetidas_maximo = None
     
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'mantenimientos']:
+        if self.action in ['list', 'retrieve', 'mantenimientos', 'recorrido']:
+            return [permissions.AllowAny()]
+        if self.action == 'posiciones':
+            if self.request.method == 'POST':
+                return [IsAdminOrPositionsGateway()]
             return [permissions.AllowAny()]
         return [permissions.IsAdminUser()]
     
@@ -134,19 +276,80 @@ class VehiculoViewSet(viewsets.ModelViewSet):
     def mantenimientos(self, request, pk=None):
         """Obtener todos los mantenimientos de un vehículo"""
         vehiculo = self.get_object()
-        mantenimientos = vehiculo.mantenimientos.all()
-        serializer = MantenimientoSerializer(mantenimientos, many=True)
+        mantenimientos = self.expandir(vehiculo.mantenimientos.all(), MantenimientoSerializer)
+        serializer = MantenimientoSerializer(mantenimientos, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
+    
+    @action(
+        detail=False, methods=['get', 'post'], parser_classes=[JSONParser, NDJSONParser],
+        authentication_classes=[TokenPosicionesAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+        consultas_repetidas_maximo=MAX_POSICIONES,
+    )
+    def posiciones(self, request):
+        """
+        GET: última posición de cada vehículo, desde memoria. Parámetro:
+        max_edad (segundos, opcional) para omitir las de vehículos sin señal.
+        POST: lote de posiciones (JSON: lista de objetos, o NDJSON: uno por
+        línea) con vehiculo, latitud, longitud y opcionalmente fecha_hora,
+        velocidad (km/h) y rumbo (grados). Se informan solo las rechazadas.
+        """
+        if request.method == 'GET':
+            max_edad = request.query_params.get('max_edad')
+            try:
+                max_edad = int(max_edad) if max_edad else None
+                if max_edad is not None and max_edad < 1:
+                    raise ValueError()
+            except ValueError:
+                return Response(
+                    {'error': 'max_edad debe ser una cantidad positiva de segundos'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return Response(registro_posiciones.flota(max_edad))
+        
+        filas = request.data
+        if not isinstance(filas, list):
+            return Response(
+                {'error': 'Se esperaba una lista de posiciones'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(filas) > MAX_POSICIONES:
+            return Response(
+                {'error': f'Se admiten como máximo {MAX_POSICIONES} posiciones por lote'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        aceptadas, errores = registro_posiciones.agregar(filas)
+        return Response({'aceptadas': aceptadas, 'rechazadas': len(errores), 'errores': errores})
+    
+    @action(detail=True, methods=['get'])
+    def recorrido(self, request, pk=None):
+        """
+        Posiciones recientes del vehículo (en memoria), de la más antigua a la
+        más reciente. Con fecha (AAAA-MM-DD), el recorrido guardado de ese día.
+        """
+        vehiculo = self.get_object()
+        fecha = request.query_params.get('fecha')
+        if not fecha:
+            return Response(registro_posiciones.recorrido(vehiculo.pk))
+        try:
+            fecha = date.fromisoformat(fecha)
+        except ValueError:
+            return Response(
+                {'error': 'Formato de fecha inválido. Use AAAA-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        posiciones = vehiculo.posiciones.filter(fecha_hora__date=fecha)
+        return Response(PosicionVehiculoSerializer(posiciones, many=True).data)
 
 
-class ChoferViewSet(viewsets.ModelViewSet):
+class ChoferViewSet(FieldsetViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar choferes.
     GET: Público | POST/PUT/DELETE: Solo Admin
     """
     queryset = Chofer.objects.all()
     serializer_class = ChoferSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, BusquedaFilter, OrderingFilter]
     search_fields = ['nombre', 'apellido', 'dni', 'licencia']
     ordering_fields = ['apellido', 'nombre', 'fecha_contratacion']
     
@@ -159,17 +362,17 @@ class ChoferViewSet(viewsets.ModelViewSet):
     def viajes(self, request, pk=None):
         """Obtener todos los viajes de un chofer"""
         chofer = self.get_object()
-        viajes = chofer.viajes.all()
-        serializer = ViajeSerializer(viajes, many=True)
+        viajes = self.expandir(chofer.viajes.all(), ViajeSerializer)
+        serializer = ViajeSerializer(viajes, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
 
-class HorarioViewSet(viewsets.ModelViewSet):
+class HorarioViewSet(CondicionalViewSetMixin, RespuestaCacheViewSetMixin, FieldsetViewSetMixin, LecturaAsincronaMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar horarios.
     GET: Público | POST/PUT/DELETE: Solo Admin
     """
-    queryset = Horario.objects.select_related('ruta__linea')
+    queryset = Horario.objects.all()
     serializer_class = HorarioSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['ruta', 'dias_semana']
@@ -182,17 +385,30 @@ class HorarioViewSet(viewsets.ModelViewSet):
         return [permissions.IsAdminUser()]
 
 
-class ViajeViewSet(viewsets.ModelViewSet):
+class ViajeViewSet(CondicionalViewSetMixin, ExportacionViewSetMixin, FieldsetViewSetMixin, LecturaAsincronaMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar viajes.
     GET: Público | POST/PUT/DELETE: Solo Admin
     """
-    queryset = Viaje.objects.select_related('ruta', 'vehiculo', 'chofer')
+    queryset = Viaje.objects.all()
     serializer_class = ViajeSerializer
+    pagination_class = KeysetCursorPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['ruta', 'vehiculo', 'chofer', 'estado', 'fecha']
     search_fields = ['ruta__nombre', 'vehiculo__patente', 'chofer__apellido']
     ordering_fields = ['fecha', 'hora_salida_real']
+    columnas_exportacion = {
+        'id': 'id',
+        'fecha': 'fecha',
+        'linea': 'ruta__linea__numero',
+        'ruta_id': 'ruta_id',
+        'ruta': 'ruta__nombre',
+        'vehiculo': 'vehiculo__patente',
+        'chofer_id': 'chofer_id',
+        'hora_salida_real': 'hora_salida_real',
+        'hora_llegada_real': 'hora_llegada_real',
+        'estado': 'estado',
+    }
     
     def get_permissions(self):
         if self.action in ['list', 'retrieve', 'boletos']:
@@ -203,20 +419,20 @@ class ViajeViewSet(viewsets.ModelViewSet):
     def boletos(self, request, pk=None):
         """Obtener todos los boletos de un viaje"""
         viaje = self.get_object()
-        boletos = viaje.boletos.all()
-        serializer = BoletoSerializer(boletos, many=True)
+        boletos = self.expandir(viaje.boletos.all(), BoletoSerializer)
+        serializer = BoletoSerializer(boletos, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def incidentes(self, request, pk=None):
         """Obtener todos los incidentes de un viaje"""
         viaje = self.get_object()
-        incidentes = viaje.incidentes.all()
-        serializer = IncidenteSerializer(incidentes, many=True)
+        incidentes = self.expandir(viaje.incidentes.all(), IncidenteSerializer)
+        serializer = IncidenteSerializer(incidentes, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
 
-class TarjetaViewSet(viewsets.ModelViewSet):
+class TarjetaViewSet(FieldsetViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar tarjetas.
     GET: Público | POST/PUT/DELETE: Solo Admin
@@ -257,8 +473,17 @@ class TarjetaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        tarjeta.saldo += monto
-        tarjeta.save()
+        # Suma en la base, como los débitos: un cobro confirmado entre la
+        # lectura y la escritura no se pierde ni se reescriben las demás columnas
+        acreditadas = Tarjeta.objects.filter(pk=tarjeta.pk, activa=True).update(
+            saldo=F('saldo') + monto, fecha_actualizacion=timezone.now()
+        )
+        if not acreditadas:
+            return Response(
+                {'error': 'La tarjeta está inactiva'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        tarjeta.refresh_from_db(fields=['saldo', 'fecha_actualizacion'])
         
         serializer = self.get_serializer(tarjeta)
         return Response(serializer.data)
@@ -267,38 +492,78 @@ class TarjetaViewSet(viewsets.ModelViewSet):
     def boletos(self, request, pk=None):
         """Obtener todos los boletos de una tarjeta"""
         tarjeta = self.get_object()
-        boletos = tarjeta.boletos.all()
-        serializer = BoletoSerializer(boletos, many=True)
+        boletos = self.expandir(tarjeta.boletos.all(), BoletoSerializer)
+        serializer = BoletoSerializer(boletos, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
 
-class BoletoViewSet(viewsets.ModelViewSet):
+class BoletoViewSet(ExportacionViewSetMixin, FieldsetViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar boletos.
     GET: Público | POST/PUT/DELETE: Requiere autenticación
     """
-    queryset = Boleto.objects.select_related('viaje', 'tarjeta', 'parada_subida')
+    queryset = Boleto.objects.all()
     serializer_class = BoletoSerializer
+    pagination_class = KeysetCursorPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['viaje', 'tarjeta', 'parada_subida']
     search_fields = ['tarjeta__numero']
     ordering_fields = ['fecha_compra', 'monto']
+    columnas_exportacion = {
+        'id': 'id',
+        'fecha_compra': 'fecha_compra',
+        'monto': 'monto',
+        'viaje_id': 'viaje_id',
+        'linea': 'viaje__ruta__linea__numero',
+        'ruta': 'viaje__ruta__nombre',
+        'tarjeta': 'tarjeta__numero',
+        'tipo_tarjeta': 'tarjeta__tipo',
+        'parada_subida_id': 'parada_subida_id',
+    }
     
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
             return [permissions.AllowAny()]
+        elif self.action == 'exportar':
+            return [permissions.IsAdminUser()]
         return [permissions.IsAuthenticated()]
+    
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Ingesta masiva de boletos (JSON: lista de objetos, o NDJSON: uno por línea).
+        Cada fila se valida por separado y el resultado se informa por índice.
+        """
+        filas = request.data
+        if not isinstance(filas, list):
+            return Response(
+                {'error': 'Se esperaba una lista de boletos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(filas) > MAX_FILAS:
+            return Response(
+                {'error': f'Se admiten como máximo {MAX_FILAS} boletos por lote'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        resultados = ingresar_boletos(filas)
+        creados = sum(1 for resultado in resultados if 'id' in resultado)
+        return Response({
+            'creados': creados,
+            'rechazados': len(resultados) - creados,
+            'resultados': resultados,
+        })
 
 
-class MantenimientoViewSet(viewsets.ModelViewSet):
+class MantenimientoViewSet(FieldsetViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar mantenimientos.
     GET: Público | POST/PUT/DELETE: Solo Admin
     """
-    queryset = Mantenimiento.objects.select_related('vehiculo')
+    queryset = Mantenimiento.objects.all()
     serializer_class = MantenimientoSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, BusquedaFilter, OrderingFilter]
     filterset_fields = ['vehiculo', 'tipo', 'fecha']
     search_fields = ['vehiculo__patente', 'descripcion']
     ordering_fields = ['fecha', 'costo']
@@ -309,18 +574,29 @@ class MantenimientoViewSet(viewsets.ModelViewSet):
         return [permissions.IsAdminUser()]
 
 
-class IncidenteViewSet(viewsets.ModelViewSet):
+class IncidenteViewSet(ExportacionViewSetMixin, FieldsetViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar incidentes.
     GET: Público | POST: Requiere autenticación | PUT/DELETE: Solo Admin
     """
-    queryset = Incidente.objects.select_related('viaje')
+    queryset = Incidente.objects.all()
     serializer_class = IncidenteSerializer
+    pagination_class = KeysetCursorPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, BusquedaFilter, OrderingFilter]
     filterset_fields = ['viaje', 'gravedad', 'resuelto']
     search_fields = ['descripcion']
     ordering_fields = ['fecha', 'gravedad']
+    # La paginación por cursor necesita un orden por columnas
+    ordenar_por_relevancia = False
+    columnas_exportacion = {
+        'id': 'id',
+        'fecha': 'fecha',
+        'viaje_id': 'viaje_id',
+        'gravedad': 'gravedad',
+        'resuelto': 'resuelto',
+        'descripcion': 'descripcion',
+    }
     
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -328,3 +604,166 @@ class IncidenteViewSet(viewsets.ModelViewSet):
         elif self.action == 'create':
             return [permissions.IsAuthenticated()]
         return [permissions.IsAdminUser()]
+
+
+class PlanificadorView(APIView):
+    """
+    Planificador de viajes entre dos paradas.
+    GET: Público
+    
+    Parámetros: origen, destino (ids de parada), hora (HH:MM, por defecto
+    ahora), fecha (AAAA-MM-DD, por defecto hoy) y transbordos (máximo, 0 a 5).
+    """
+    permission_classes = [permissions.AllowAny]
+    max_transbordos = 5
+    
+    def get(self, request):
+        try:
+            origen = int(request.query_params['origen'])
+            destino = int(request.query_params['destino'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Debe indicar las paradas origen y destino'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            hora, fecha = _hora_y_fecha(request)
+            transbordos = int(request.query_params.get('transbordos', 3))
+            if not 0 <= transbordos <= self.max_transbordos:
+                raise ValueError()
+        except ValueError:
+            return Response(
+                {'error': f'hora (HH:MM), fecha (AAAA-MM-DD) o transbordos (0 a {self.max_transbordos}) inválidos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        red = indice_horarios.red()
+        if origen not in red.paradas or destino not in red.paradas:
+            return Response({'error': 'Parada inexistente'}, status=status.HTTP_404_NOT_FOUND)
+        
+        itinerarios = red.planificar(origen, destino, a_segundos(hora), fecha.weekday(), transbordos)
+        return Response({
+            'origen': origen,
+            'destino': destino,
+            'fecha': fecha,
+            'dia': DIAS[fecha.weekday()],
+            'salida': formatear_hora(a_segundos(hora)),
+            'itinerarios': itinerarios,
+        })
+
+
+class EstadisticasCacheView(APIView):
+    """
+    Aciertos y fallos de la cache de respuestas en este proceso.
+    GET: Solo Admin | DELETE: reinicia los contadores
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response(estadisticas_cache.resumen())
+    
+    def delete(self, request):
+        estadisticas_cache.reiniciar()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MetricasView(APIView):
+    """
+    Métricas de todos los workers en el formato de texto de Prometheus.
+    GET: Solo Admin o el scraper con "Authorization: Bearer <METRICAS_TOKEN>"
+    """
+    authentication_classes = [TokenMetricasAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    permission_classes = [IsAdminOrMetricsScraper]
+    
+    def get(self, request):
+        return HttpResponse(formato_prometheus(recolectar()), content_type=TIPO_CONTENIDO_METRICAS)
+
+
+class EstadisticasView(APIView):
+    """
+    Boletos y recaudación por período y dimensión, desde los resúmenes.
+    GET: Solo Admin
+    
+    Parámetros: desde, hasta (AAAA-MM-DD, por defecto los últimos 30 días),
+    periodo (hora, dia, mes o total), agrupar (lista de linea, ruta, parada,
+    tipo_tarjeta) y filtros por linea, ruta, parada o tipo_tarjeta.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        params = request.query_params
+        try:
+            hasta = date.fromisoformat(params['hasta']) if params.get('hasta') else timezone.localdate()
+            desde = date.fromisoformat(params['desde']) if params.get('desde') else hasta - timedelta(days=29)
+            if desde > hasta:
+                raise ValueError()
+        except ValueError:
+            return Response(
+                {'error': 'desde y hasta deben ser fechas AAAA-MM-DD y desde no puede ser posterior a hasta'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        periodo = params.get('periodo', 'dia')
+        agrupar = [nombre.strip() for nombre in params.get('agrupar', 'linea').split(',') if nombre.strip()]
+        if periodo not in PERIODOS or any(nombre not in DIMENSIONES for nombre in agrupar):
+            return Response(
+                {'error': f"periodo debe ser uno de {', '.join(PERIODOS)} y agrupar una lista de {', '.join(DIMENSIONES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        filtros = {nombre: params[nombre] for nombre in DIMENSIONES if params.get(nombre)}
+        try:
+            for nombre in filtros.keys() - {'tipo_tarjeta'}:
+                filtros[nombre] = int(filtros[nombre])
+        except ValueError:
+            return Response({'error': 'Los filtros linea, ruta y parada son ids'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        resultados = consultar_estadisticas(desde, hasta, periodo, agrupar, filtros)
+        recaudacion = sum((fila['recaudacion'] for fila in resultados), Decimal('0'))
+        for fila in resultados:
+            # Como en los serializers: importes como texto para no perder precisión
+            fila['recaudacion'] = str(fila['recaudacion'].quantize(CENTAVO))
+        return Response({
+            'desde': desde,
+            'hasta': hasta,
+            'periodo': periodo,
+            'agrupar': agrupar,
+            'total_boletos': sum(fila['boletos'] for fila in resultados),
+            'total_recaudacion': str(recaudacion.quantize(CENTAVO)),
+            'resultados': resultados,
+        })
+
+
+@require_GET
+async def eventos(request):
+    """
+    Cambios de viajes e incidentes en vivo (text/event-stream).
+    GET: Público, solo con ASGI
+
+    Parámetros: linea, ruta, vehiculo (listas de ids separados por coma) y
+    tipo (viaje, incidente). Con el encabezado Last-Event-ID se reciben los
+    eventos perdidos desde ese id. No pasa por DRF, que no tiene vistas
+    asíncronas: cada cliente conectado es una corrutina y no un hilo.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Los eventos en vivo requieren el servidor ASGI'}, status=501)
+    try:
+        filtros = {
+            campo: {int(valor) for valor in request.GET[campo].split(',') if valor.strip()}
+            for campo in FILTROS_EVENTOS if request.GET.get(campo)
+        }
+        tipos = {tipo.strip() for tipo in request.GET.get('tipo', ','.join(TIPOS_EVENTOS)).split(',') if tipo.strip()}
+        if not tipos or not tipos <= set(TIPOS_EVENTOS):
+            raise ValueError()
+    except ValueError:
+        return JsonResponse(
+            {'error': f"linea, ruta y vehiculo deben ser listas de ids y tipo una lista de {', '.join(TIPOS_EVENTOS)}"},
+            status=400
+        )
+    if broker.clientes() >= settings.EVENTOS_MAX_CLIENTES:
+        return JsonResponse({'error': 'Demasiados clientes conectados, reintente más tarde'}, status=503)
+
+    suscripcion, anteriores = broker.suscribir(filtros, tipos, request.headers.get('Last-Event-ID'))
+    respuesta = StreamingHttpResponse(flujo_sse(suscripcion, anteriores), content_type='text/event-stream')
+    respuesta['Cache-Control'] = 'no-cache'
+    # Sin buffer en nginx: cada evento sale apenas se publica
+    respuesta['X-Accel-Buffering'] = 'no'
+    return respuesta
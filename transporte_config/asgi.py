@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'transporte_config.settings')
+# Listados y detalles públicos con vistas asíncronas (transporte/asincrono.py)
+os.environ.setdefault('LECTURAS_ASINCRONAS', 'True')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import sys
 from pathlib import Path
 from decouple import config
 from datetime import timedelta
@@ -27,6 +28,8 @@ SECRET_KEY = config('SECRET_KEY', default='django-insecure-change-this-in-produc
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config('DEBUG', default=True, cast=bool)
 
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = ['*']
 
 
@@ -39,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'rest_framework',
@@ -53,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'transporte.instrumentacion.InstrumentacionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -96,9 +101,24 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD', default=''),
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='5432'),
+        # Con el pool, verifica cada conexión al sacarla (descarta las caídas)
+        'CONN_HEALTH_CHECKS': config('DB_POOL_VERIFICAR', default=True, cast=bool),
     }
 }
 
+# Pool de conexiones de psycopg (psycopg[pool]): cada worker mantiene entre
+# DB_POOL_MIN y DB_POOL_MAX conexiones abiertas y una solicitud espera hasta
+# DB_POOL_TIMEOUT segundos a que se libere una. Sin pool, cada solicitud abre
+# y cierra su conexión (CONN_MAX_AGE tiene que quedar en 0 con el pool)
+if config('DB_POOL', default=False, cast=bool):
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': config('DB_POOL_MIN', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX', default=20, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -149,7 +169,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'transporte.autenticacion.JWTCacheAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -186,6 +206,115 @@ SIMPLE_JWT = {
 
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+
+    'TOKEN_OBTAIN_SERIALIZER': 'transporte.autenticacion.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'transporte.autenticacion.TokenRefreshSerializer',
+}
+
+# Usuarios de los tokens JWT: se resuelven en la cache JWT_USUARIOS_CACHE
+# (una compartida, p. ej. Redis, la ven todos los workers) y se vuelven a leer
+# de la base cada JWT_USUARIOS_TTL segundos. Con JWT_SIN_ESTADO los tokens
+# llevan username/is_active/is_staff/is_superuser y autenticar no consulta
+# nada; los cambios de permisos se ven con el próximo access token
+JWT_USUARIOS_CACHE = config('JWT_USUARIOS_CACHE', default='default')
+JWT_USUARIOS_TTL = config('JWT_USUARIOS_TTL', default=60, cast=int)
+JWT_SIN_ESTADO = config('JWT_SIN_ESTADO', default=False, cast=bool)
+
+# Cache de respuestas del catálogo público (líneas, paradas, rutas, horarios).
+# RESPUESTAS_CACHE_BACKEND admite p. ej. django.core.cache.backends.filebased.FileBasedCache
+# con RESPUESTAS_CACHE_LOCATION apuntando a un directorio compartido por los workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'respuestas': {
+        'BACKEND': config('RESPUESTAS_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('RESPUESTAS_CACHE_LOCATION', default='respuestas'),
+        'TIMEOUT': config('RESPUESTAS_CACHE_TIMEOUT', default=3600, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('RESPUESTAS_CACHE_MAX_ENTRADAS', default=5000, cast=int),
+        },
+    },
+}
+
+# Planificador de viajes: segundos tras los que el índice en memoria se
+# reconstruye entero (recoge cambios hechos por otros workers)
+PLANIFICADOR_MAX_EDAD = config('PLANIFICADOR_MAX_EDAD', default=300, cast=int)
+
+# Paradas cercanas: segundos tras los que el índice espacial se reconstruye
+PARADAS_CERCANAS_MAX_EDAD = config('PARADAS_CERCANAS_MAX_EDAD', default=300, cast=int)
+
+# Tiempos estimados de llegada (GET /api/rutas/{id}/eta/): duraciones de los
+# viajes de los últimos ETA_DIAS_HISTORIAL días por ruta, día y franja de
+# ETA_FRANJA_MINUTOS; una franja con menos de ETA_MINIMO_VIAJES viajes usa la
+# de todos los días o la de la ruta. Se recalculan cada ETA_MAX_EDAD segundos
+# o, con ETA_ARCHIVO, se leen del archivo que guarda "manage.py calcular_eta"
+ETA_DIAS_HISTORIAL = config('ETA_DIAS_HISTORIAL', default=365, cast=int)
+ETA_FRANJA_MINUTOS = config('ETA_FRANJA_MINUTOS', default=30, cast=int)
+ETA_MINIMO_VIAJES = config('ETA_MINIMO_VIAJES', default=5, cast=int)
+ETA_MAX_EDAD = config('ETA_MAX_EDAD', default=3600, cast=int)
+ETA_ARCHIVO = config('ETA_ARCHIVO', default='')
+
+# Posiciones de los vehículos: cada uno conserva en memoria las últimas
+# POSICIONES_POR_VEHICULO y a la base va una cada POSICIONES_INTERVALO_GUARDADO
+# segundos, insertadas en lotes de hasta POSICIONES_LOTE_GUARDADO. La lista de
+# vehículos existentes se vuelve a leer cada POSICIONES_VEHICULOS_MAX_EDAD segundos
+POSICIONES_POR_VEHICULO = config('POSICIONES_POR_VEHICULO', default=60, cast=int)
+POSICIONES_INTERVALO_GUARDADO = config('POSICIONES_INTERVALO_GUARDADO', default=30, cast=int)
+POSICIONES_LOTE_GUARDADO = config('POSICIONES_LOTE_GUARDADO', default=1000, cast=int)
+POSICIONES_VEHICULOS_MAX_EDAD = config('POSICIONES_VEHICULOS_MAX_EDAD', default=300, cast=int)
+# Con POSICIONES_TOKEN la pasarela de los equipos envía posiciones con
+# "Authorization: Bearer <token>"; sin él solo pueden los administradores
+POSICIONES_TOKEN = config('POSICIONES_TOKEN', default='')
+
+# Eventos en vivo (GET /api/eventos/, solo con ASGI): cada cliente acumula
+# hasta EVENTOS_MAX_PENDIENTES sin enviar antes de recibir un "reinicio", el
+# proceso guarda los últimos EVENTOS_HISTORIAL para las reconexiones con
+# Last-Event-ID y acepta hasta EVENTOS_MAX_CLIENTES conexiones. Sin eventos se
+# envía un latido cada EVENTOS_LATIDO segundos. Con varios workers,
+# EVENTOS_DIRECTORIO (uno por despliegue) reparte los eventos entre todos; cada
+# uno lee los de los demás cada EVENTOS_INTERVALO segundos
+EVENTOS_MAX_PENDIENTES = config('EVENTOS_MAX_PENDIENTES', default=500, cast=int)
+EVENTOS_HISTORIAL = config('EVENTOS_HISTORIAL', default=1000, cast=int)
+EVENTOS_MAX_CLIENTES = config('EVENTOS_MAX_CLIENTES', default=1000, cast=int)
+EVENTOS_LATIDO = config('EVENTOS_LATIDO', default=15, cast=float)
+EVENTOS_REINTENTO_MS = config('EVENTOS_REINTENTO_MS', default=3000, cast=int)
+EVENTOS_DIRECTORIO = config('EVENTOS_DIRECTORIO', default='')
+EVENTOS_INTERVALO = config('EVENTOS_INTERVALO', default=0.25, cast=float)
+
+# Instrumentación por solicitud (Server-Timing y log de consultas). Una misma
+# consulta repetida más de CONSULTAS_REPETIDAS_MAXIMO veces en una solicitud es
+# un error con CONSULTAS_REPETIDAS_ERROR (por defecto en DEBUG y en los tests)
+# y una advertencia en el log si no
+CONSULTAS_REPETIDAS_MAXIMO = config('CONSULTAS_REPETIDAS_MAXIMO', default=10, cast=int)
+CONSULTAS_REPETIDAS_ERROR = config('CONSULTAS_REPETIDAS_ERROR', default=DEBUG or TESTING, cast=bool)
+
+# Métricas (GET /api/metrics): cada worker vuelca las suyas cada
+# METRICAS_INTERVALO segundos a un archivo en METRICAS_DIRECTORIO (uno por
+# despliegue, p. ej. BASE_DIR / 'var' / 'metricas'; vacío, por defecto = solo
+# las del proceso que atiende) y el endpoint suma los de todos. METRICAS_TOKEN
+# habilita el scrape con "Authorization: Bearer <token>"
+METRICAS_DIRECTORIO = config('METRICAS_DIRECTORIO', default='')
+METRICAS_INTERVALO = config('METRICAS_INTERVALO', default=5, cast=float)
+METRICAS_RETENCION = config('METRICAS_RETENCION', default=86400, cast=int)
+METRICAS_TOKEN = config('METRICAS_TOKEN', default='')
+
+# Listados y detalles públicos con vistas asíncronas (ORM asíncrono). Lo
+# activa asgi.py; con WSGI conviene dejarlo apagado
+LECTURAS_ASINCRONAS = config('LECTURAS_ASINCRONAS', default=False, cast=bool)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'transporte': {
+            'handlers': ['consola'],
+            'level': config('LOG_NIVEL', default='ERROR' if TESTING else 'INFO'),
+        },
+    },
 }
 
 # CORS Settings